@@ -1,9 +1,30 @@
 import asyncio
+from functools import partial
+
 from fastapi import APIRouter
-from .crud import db
-from .tasks import wait_for_paid_invoices
+from loguru import logger
+
+from .assets import ensure_assets_built
+from .backfills import run_backfills
+from .counters import scan_counters
+from .crud import db, writer
+from .leases import run_exclusive
+from .profiler import profiler
+from .tasks import (
+    WITHDRAWAL_WORKERS,
+    drain_invoice_listener,
+    resolve_stale_withdrawals,
+    resume_invoice_listener,
+    run_invoice_refill,
+    run_reconciliation,
+    run_scan_counter_flush,
+    run_withdrawal_worker,
+    save_listener_checkpoint,
+    wait_for_paid_invoices,
+)
 from .views import lnurlFlip_generic_router
 from .views_api import lnurlFlip_api_router
+from .webhooks import WEBHOOK_WORKERS, close_client, run_webhook_worker
 
 lnurlFlip_ext: APIRouter = APIRouter(prefix="/lnurlFlip", tags=["LnurlFlip"])
 lnurlFlip_ext.include_router(lnurlFlip_generic_router)
@@ -18,19 +39,91 @@ lnurlFlip_static_files = [
 
 scheduled_tasks: list[asyncio.Task] = []
 
-def lnurlFlip_stop():
+async def lnurlFlip_stop():
+    # Let the listener finish queued payments before it is cancelled
+    await drain_invoice_listener()
     for task in scheduled_tasks:
         try:
             task.cancel()
         except Exception:
             pass
+    if scheduled_tasks:
+        await asyncio.wait(scheduled_tasks, timeout=1)
+    # A later start appends fresh tasks; don't keep the cancelled ones alive
+    scheduled_tasks.clear()
+    try:
+        await save_listener_checkpoint()
+    except Exception as e:
+        logger.warning(f"Could not save invoice listener checkpoint: {str(e)}")
+    try:
+        await scan_counters.flush()
+    except Exception as e:
+        logger.warning(f"Could not flush scan counters on stop: {str(e)}")
+    await writer.stop()
+    profiler.stop()
+    await close_client()
 
 def lnurlFlip_start():
     from lnbits.tasks import create_permanent_unique_task
+
+    try:
+        ensure_assets_built()
+    except Exception as e:
+        # Templates fall back to the plain static files
+        logger.warning(f"Could not build fingerprinted assets: {str(e)}")
     
     task = create_permanent_unique_task("ext_lnurlFlip", wait_for_paid_invoices)
     scheduled_tasks.append(task)
 
+    # Catches up on what the last stop (or crash) left unapplied, then exits
+    task = create_permanent_unique_task(
+        "ext_lnurlFlip_resume", resume_invoice_listener
+    )
+    scheduled_tasks.append(task)
+
+    for i in range(WITHDRAWAL_WORKERS):
+        task = create_permanent_unique_task(
+            f"ext_lnurlFlip_withdraw_{i}", run_withdrawal_worker
+        )
+        scheduled_tasks.append(task)
+
+    for i in range(WEBHOOK_WORKERS):
+        task = create_permanent_unique_task(
+            f"ext_lnurlFlip_webhooks_{i}", run_webhook_worker
+        )
+        scheduled_tasks.append(task)
+
+    # Shared maintenance runs on one node at a time (see leases.py)
+    task = create_permanent_unique_task(
+        "ext_lnurlFlip_withdraw_sweep",
+        partial(run_exclusive, "withdraw_sweep", resolve_stale_withdrawals),
+    )
+    scheduled_tasks.append(task)
+
+    task = create_permanent_unique_task(
+        "ext_lnurlFlip_reconcile",
+        partial(run_exclusive, "reconcile", run_reconciliation),
+    )
+    scheduled_tasks.append(task)
+
+    task = create_permanent_unique_task(
+        "ext_lnurlFlip_backfills",
+        partial(run_exclusive, "backfills", run_backfills),
+    )
+    scheduled_tasks.append(task)
+
+    # Pre-minted invoices are kept in memory, so every node refills its own
+    task = create_permanent_unique_task(
+        "ext_lnurlFlip_invoice_refill", run_invoice_refill
+    )
+    scheduled_tasks.append(task)
+
+    # Every node holds its own unflushed scans, so every node flushes them
+    task = create_permanent_unique_task(
+        "ext_lnurlFlip_scan_counters", run_scan_counter_flush
+    )
+    scheduled_tasks.append(task)
+
 __all__ = [
     "db",
     "lnurlFlip_ext",
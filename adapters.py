@@ -0,0 +1,294 @@
+"""
+Lazy access to LNbits core services and the lnurlp / withdraw extensions.
+
+Nothing here imports another extension at module load. Each callable is
+resolved on first use and cached on the adapter, so importing lnurlFlip stays
+cheap and the whole cross-extension surface can be swapped for an in-memory
+fake (see FakeAdapter) when benchmarking or replaying payments.
+"""
+
+import asyncio
+import hashlib
+import itertools
+from importlib import import_module
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+WITHDRAW_LINKS_PAGE = 100  # Page size when fetching every withdraw link of some wallets
+
+
+class LnbitsAdapter:
+    """Resolves cross-extension callables on first use and caches them."""
+
+    _targets = {
+        "get_pay_link": "lnbits.extensions.lnurlp.crud",
+        "get_pay_links": "lnbits.extensions.lnurlp.crud",
+        "get_withdraw_link": "lnbits.extensions.withdraw.crud",
+        "get_withdraw_links": "lnbits.extensions.withdraw.crud",
+        "get_wallet": "lnbits.core.crud",
+        "get_standalone_payment": "lnbits.core.crud",
+        "get_payments": "lnbits.core.crud",
+        "create_invoice": "lnbits.core.services",
+        "pay_invoice": "lnbits.core.services",
+        "get_funding_source": "lnbits.wallets",
+    }
+    # Batch link lookups read the extensions' tables directly, through the
+    # `db` and model their crud modules happen to expose. Neither extension
+    # promises that layout, so without them the lookups fall back to one
+    # get_*_link call per id (see _link_source).
+    _link_tables = {
+        "pay": ("lnbits.extensions.lnurlp.crud", "lnurlp.pay_links", "PayLink"),
+        "withdraw": ("lnbits.extensions.withdraw.crud", "withdraw.withdraw_link", "WithdrawLink"),
+    }
+
+    def __init__(self):
+        self._resolved: Dict[str, Callable] = {}
+        self._sources: Dict[str, Optional[Tuple[Any, Any]]] = {}
+
+    def _resolve(self, name: str) -> Callable:
+        fn = self._resolved.get(name)
+        if fn is None:
+            fn = getattr(import_module(self._targets[name]), name)
+            self._resolved[name] = fn
+        return fn
+
+    def _link_source(self, kind: str) -> Optional[Tuple[Any, Any]]:
+        """The extension's (db, model) for batch lookups, or None if it has none."""
+        key = f"{kind}_links_by_id"
+        if key not in self._sources:
+            module_name, _table, model = self._link_tables[kind]
+            crud = import_module(module_name)
+            db, model_class = getattr(crud, "db", None), getattr(crud, model, None)
+            self._sources[key] = (db, model_class) if db and model_class else None
+        return self._sources[key]
+
+    async def _get_links_by_id(
+        self, kind: str, link_ids: Iterable[str], fetch_one: Callable
+    ) -> Dict[str, Any]:
+        unique_ids = list(dict.fromkeys(i for i in link_ids if i))
+        if not unique_ids:
+            return {}
+        source = self._link_source(kind)
+        if source is None:
+            return await _gather_by_id(fetch_one, unique_ids)
+        db, model = source
+        values = {f"id_{i}": link_id for i, link_id in enumerate(unique_ids)}
+        placeholders = ",".join(f":{key}" for key in values)
+        links = await db.fetchall(
+            f"SELECT * FROM {self._link_tables[kind][1]} WHERE id IN ({placeholders})",
+            values,
+            model,
+        )
+        return {link.id: link for link in links}
+
+    async def get_pay_link(self, link_id: str) -> Optional[Any]:
+        return await self._resolve("get_pay_link")(link_id)
+
+    async def get_pay_links(self, wallet_ids: List[str]) -> List[Any]:
+        return await self._resolve("get_pay_links")(wallet_ids=wallet_ids)
+
+    async def get_pay_links_by_id(self, link_ids: Iterable[str]) -> Dict[str, Any]:
+        """
+        Fetch many pay links, keyed by id, in one query when lnurlp's crud
+        exposes `db` and `PayLink`. Missing links are left out.
+        """
+        return await self._get_links_by_id("pay", link_ids, self.get_pay_link)
+
+    async def get_withdraw_link(self, link_id: str) -> Optional[Any]:
+        return await self._resolve("get_withdraw_link")(link_id)
+
+    async def get_withdraw_links(
+        self, wallet_ids: List[str], limit: Optional[int] = None, offset: int = 0
+    ) -> List[Any]:
+        """
+        Withdraw links of the wallets. The extension's crud is paginated and
+        binds limit as a parameter (SQLite rejects LIMIT NULL), so without a
+        limit this pages through every link WITHDRAW_LINKS_PAGE at a time.
+        """
+        fetch = self._resolve("get_withdraw_links")
+        if limit is not None:
+            links, _total = await fetch(wallet_ids, limit=limit, offset=offset)
+            return links
+        links: List[Any] = []
+        while True:
+            page, total = await fetch(wallet_ids, limit=WITHDRAW_LINKS_PAGE, offset=offset)
+            links.extend(page)
+            offset += len(page)
+            if len(page) < WITHDRAW_LINKS_PAGE or offset >= total:
+                return links
+
+    async def get_withdraw_links_by_id(self, link_ids: Iterable[str]) -> Dict[str, Any]:
+        """
+        Fetch many withdraw links, keyed by id, in one query when withdraw's
+        crud exposes `db` and `WithdrawLink`. Missing links are left out.
+        """
+        return await self._get_links_by_id("withdraw", link_ids, self.get_withdraw_link)
+
+    async def get_wallet(self, wallet_id: str) -> Optional[Any]:
+        return await self._resolve("get_wallet")(wallet_id)
+
+    async def get_wallets_by_id(self, wallet_ids: Iterable[str]) -> Dict[str, Any]:
+        """
+        Fetch many wallets, keyed by id. Missing wallets are left out. Core has
+        no batch wallet lookup (get_wallet also resolves shared wallets and the
+        balance), so this runs the single lookups concurrently, not one query.
+        """
+        return await _gather_by_id(self.get_wallet, wallet_ids)
+
+    async def get_standalone_payment(self, payment_hash: str) -> Optional[Any]:
+        return await self._resolve("get_standalone_payment")(payment_hash)
+
+    async def get_tagged_payments(
+        self, tag: str, since: Optional[int] = None, limit: int = 100, offset: int = 0
+    ) -> List[Any]:
+        """
+        Settled incoming payments carrying `tag`, oldest first. `since` is a
+        unix time compared against the payment's creation time.
+        """
+        from lnbits.core.models import PaymentFilters
+        from lnbits.db import Filter, Filters
+
+        filters = Filters(
+            filters=[Filter.parse_query("tag", [tag], PaymentFilters)],
+            model=PaymentFilters,
+            sortby="time",
+            direction="asc",
+        )
+        return await self._resolve("get_payments")(
+            complete=True,
+            incoming=True,
+            since=since,
+            filters=filters,
+            limit=limit,
+            offset=offset,
+        )
+
+    async def create_invoice(self, **kwargs) -> Any:
+        return await self._resolve("create_invoice")(**kwargs)
+
+    async def pay_invoice(self, **kwargs) -> Any:
+        return await self._resolve("pay_invoice")(**kwargs)
+
+    def get_funding_source(self) -> Any:
+        return self._resolve("get_funding_source")()
+
+
+class FakeAdapter(LnbitsAdapter):
+    """
+    In-memory stand-in for LNbits core, lnurlp and withdraw.
+
+    Links and wallets are plain objects keyed by id (anything with the
+    attributes the views read, e.g. SimpleNamespace). Invoices created and paid
+    through the fake are recorded so callers can assert on them. Incoming
+    payments (anything with tag, time, amount, status and extra) can be added
+    to `incoming` for get_tagged_payments to return.
+    """
+
+    def __init__(
+        self,
+        pay_links: Optional[Dict[str, Any]] = None,
+        withdraw_links: Optional[Dict[str, Any]] = None,
+        wallets: Optional[Dict[str, Any]] = None,
+        funding_source: Any = None,
+    ):
+        super().__init__()
+        self.pay_links = pay_links or {}
+        self.withdraw_links = withdraw_links or {}
+        self.wallets = wallets or {}
+        self.funding_source = funding_source
+        self.invoices: List[dict] = []
+        self.payments: List[Any] = []
+        self.incoming: List[Any] = []
+        # Hashes stay unique even if a long run trims `invoices`
+        self._invoice_numbers = itertools.count(1)
+
+    async def get_pay_link(self, link_id: str) -> Optional[Any]:
+        return self.pay_links.get(link_id)
+
+    async def get_pay_links(self, wallet_ids: List[str]) -> List[Any]:
+        return [link for link in self.pay_links.values() if link.wallet in wallet_ids]
+
+    async def get_pay_links_by_id(self, link_ids: Iterable[str]) -> Dict[str, Any]:
+        return {i: self.pay_links[i] for i in link_ids if i in self.pay_links}
+
+    async def get_withdraw_link(self, link_id: str) -> Optional[Any]:
+        return self.withdraw_links.get(link_id)
+
+    async def get_withdraw_links(
+        self, wallet_ids: List[str], limit: Optional[int] = None, offset: int = 0
+    ) -> List[Any]:
+        links = [
+            link for link in self.withdraw_links.values() if link.wallet in wallet_ids
+        ]
+        return links[offset : offset + limit if limit else None]
+
+    async def get_withdraw_links_by_id(self, link_ids: Iterable[str]) -> Dict[str, Any]:
+        return {i: self.withdraw_links[i] for i in link_ids if i in self.withdraw_links}
+
+    async def get_wallet(self, wallet_id: str) -> Optional[Any]:
+        return self.wallets.get(wallet_id)
+
+    async def get_standalone_payment(self, payment_hash: str) -> Optional[Any]:
+        for payment in self.payments:
+            if payment.payment_hash == payment_hash:
+                return payment
+        return None
+
+    async def get_tagged_payments(
+        self, tag: str, since: Optional[int] = None, limit: int = 100, offset: int = 0
+    ) -> List[Any]:
+        payments = sorted(
+            (
+                p for p in self.incoming
+                if p.tag == tag
+                and p.status == "success"
+                and p.amount > 0
+                and (since is None or p.time.timestamp() > since)
+            ),
+            key=lambda p: p.time,
+        )
+        return payments[offset : offset + limit]
+
+    async def create_invoice(self, **kwargs) -> Any:
+        self.invoices.append(kwargs)
+        payment_hash = hashlib.sha256(
+            f"invoice-{next(self._invoice_numbers)}".encode()
+        ).hexdigest()
+        return SimpleNamespace(
+            payment_hash=payment_hash,
+            checking_id=payment_hash,
+            bolt11=f"lnfake{payment_hash[:20]}",
+            **kwargs,
+        )
+
+    async def pay_invoice(self, **kwargs) -> Any:
+        payment_hash = hashlib.sha256(kwargs["payment_request"].encode()).hexdigest()
+        payment = SimpleNamespace(
+            payment_hash=payment_hash, checking_id=payment_hash, status="success", **kwargs
+        )
+        self.payments.append(payment)
+        return payment
+
+    def get_funding_source(self) -> Any:
+        return self.funding_source
+
+
+async def _gather_by_id(fetch: Callable, ids: Iterable[str]) -> Dict[str, Any]:
+    unique_ids = list(dict.fromkeys(i for i in ids if i))
+    results = await asyncio.gather(*(fetch(i) for i in unique_ids))
+    return {i: r for i, r in zip(unique_ids, results) if r}
+
+
+_adapter: LnbitsAdapter = LnbitsAdapter()
+
+
+def get_adapter() -> LnbitsAdapter:
+    return _adapter
+
+
+def set_adapter(adapter: LnbitsAdapter) -> LnbitsAdapter:
+    """Swap the active adapter (e.g. for a FakeAdapter) and return the previous one."""
+    global _adapter
+    previous = _adapter
+    _adapter = adapter
+    return previous
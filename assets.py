@@ -0,0 +1,138 @@
+"""
+Fingerprinted, precompressed static assets.
+
+`python assets.py` (or ensure_assets_built() at startup) copies every file
+under static/ into static/dist/ with a content hash in its name, writes
+gzip and (when the optional `brotli` package is installed) brotli variants of
+text assets, and re-encodes PNGs with Pillow's optimizer when Pillow is
+available. static/dist/manifest.json maps each source path to its hashed
+name; templates resolve assets through asset_url(), and the /assets route in
+views.py serves them as immutable.
+
+Builds never delete or rewrite a live file: hashed files are content-addressed
+and only written when missing, each file and the manifest are written to a
+temporary name and renamed into place, so other workers or nodes serving the
+same checkout (and their cached manifests) keep working during a rebuild.
+Superseded hashed files are left behind; they are small and safe to delete
+once every server has restarted.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional
+    Image = None
+
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+DIST_DIR = STATIC_DIR / "dist"
+MANIFEST_PATH = DIST_DIR / "manifest.json"
+ASSETS_URL = "/lnurlFlip/assets"
+COMPRESSIBLE = {".js", ".css", ".svg", ".json", ".html", ".txt"}
+
+
+def _optimize_png(content: bytes) -> bytes:
+    if Image is None:
+        return content
+    out = io.BytesIO()
+    with Image.open(io.BytesIO(content)) as image:
+        image.save(out, format="PNG", optimize=True)
+    optimized = out.getvalue()
+    return optimized if len(optimized) < len(content) else content
+
+
+def _write_atomic(target: Path, content: bytes) -> None:
+    """Write `target` via a temporary file and a rename, so readers never see it half-written."""
+    temporary = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    temporary.write_bytes(content)
+    os.replace(temporary, target)
+
+
+def _write_missing(target: Path, content: bytes) -> None:
+    # Hashed names are content-addressed, so an existing file is already right
+    if not target.exists():
+        _write_atomic(target, content)
+
+
+def _sources():
+    for path in sorted(STATIC_DIR.rglob("*")):
+        if path.is_file() and DIST_DIR not in path.parents:
+            yield path
+
+
+def build_assets() -> Dict[str, str]:
+    """Bring static/dist up to date with static/ and return the manifest."""
+    manifest: Dict[str, str] = {}
+    for source in _sources():
+        content = source.read_bytes()
+        if source.suffix == ".png":
+            content = _optimize_png(content)
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        relative = source.relative_to(STATIC_DIR)
+        hashed = relative.with_name(f"{source.stem}.{digest}{source.suffix}")
+        target = DIST_DIR / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        _write_missing(target, content)
+        if source.suffix in COMPRESSIBLE:
+            gz = target.with_name(target.name + ".gz")
+            if not gz.exists():
+                # mtime=0 keeps the gzip output reproducible
+                _write_atomic(gz, gzip.compress(content, compresslevel=9, mtime=0))
+            br = target.with_name(target.name + ".br")
+            if brotli is not None and not br.exists():
+                _write_atomic(br, brotli.compress(content, quality=11))
+        manifest[relative.as_posix()] = hashed.as_posix()
+    _write_atomic(MANIFEST_PATH, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    load_manifest.cache_clear()
+    return manifest
+
+
+def ensure_assets_built() -> None:
+    """Build static/dist when it is missing or older than any source file."""
+    if MANIFEST_PATH.exists():
+        built = MANIFEST_PATH.stat().st_mtime
+        if all(source.stat().st_mtime <= built for source in _sources()):
+            return
+    build_assets()
+
+
+@lru_cache(maxsize=1)
+def load_manifest() -> Dict[str, str]:
+    try:
+        return json.loads(MANIFEST_PATH.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def hashed_asset_path(path: str) -> Optional[Path]:
+    """Resolve a hashed name from the manifest to its file, or None if unknown."""
+    if path not in load_manifest().values():
+        return None
+    return DIST_DIR / path
+
+
+def asset_url(path: str) -> str:
+    """URL for a static asset, fingerprinted when a build is available."""
+    hashed = load_manifest().get(path)
+    if hashed:
+        return f"{ASSETS_URL}/{hashed}"
+    from lnbits.helpers import static_url_for
+
+    return static_url_for("lnurlFlip/static", path)
+
+
+if __name__ == "__main__":
+    for source, hashed in build_assets().items():
+        print(f"{source} -> {hashed}")
@@ -0,0 +1,114 @@
+"""
+Online backfills for derived columns.
+
+Filling a new column across a large table inside a migration would hold the
+extension's startup (and the table) for the whole UPDATE. Instead the
+migration only adds the column, and a backfill registered here fills it in
+the background:
+
+- Rows are visited in primary key order, BACKFILL_CHUNK_SIZE at a time. Each
+  chunk is one short transaction.
+- After every chunk the last key is saved to backfill_progress, so a restart
+  or a new leader resumes where the previous one stopped.
+- Between chunks the backfill sleeps long enough to keep the database busy
+  with it at most BACKFILL_DUTY_CYCLE of the time.
+- One node runs the backfills at a time (see leases.py).
+
+A backfill is a pair of functions. `fetch(after_key, limit)` returns the
+next rows still needing the column, as dicts with an "id" key. `apply(rows)`
+fills them and returns how many it updated. Both must be idempotent, because
+a chunk can be applied again after a crash between apply and the progress
+write. Keyset pagination only visits keys after the saved one, so the rows
+to fill must not appear anew: new code must already write the column.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+
+from lnbits.bolt11 import decode as decode_bolt11
+from loguru import logger
+
+from .crud import (
+    get_backfill_progress,
+    get_withdrawals_without_hash,
+    save_backfill_progress,
+    set_withdrawal_payment_hashes,
+)
+
+BACKFILL_CHUNK_SIZE = 500
+BACKFILL_DUTY_CYCLE = 0.2  # Share of the time spent running chunks
+BACKFILL_MIN_PAUSE_SECONDS = 0.1
+BACKFILL_RECHECK_SECONDS = 3600  # How often a leader looks for newly registered backfills
+BACKFILL_RETRY_SECONDS = 60
+
+
+class Backfill(NamedTuple):
+    name: str
+    fetch: Callable[[Optional[str], int], Awaitable[List[dict]]]
+    apply: Callable[[List[dict]], Awaitable[int]]
+
+
+async def fill_withdrawal_payment_hashes(rows: List[dict]) -> int:
+    """Decode payment_hash from the bolt11 of withdrawals queued before m006."""
+    hashes = []
+    for row in rows:
+        try:
+            hashes.append((row["id"], decode_bolt11(row["payment_request"]).payment_hash))
+        except Exception as e:
+            logger.warning(f"Backfill skipped withdrawal {row['id']}: {str(e)}")
+    return await set_withdrawal_payment_hashes(hashes) if hashes else 0
+
+
+BACKFILLS: List[Backfill] = [
+    Backfill(
+        "withdrawal_payment_hash",
+        get_withdrawals_without_hash,
+        fill_withdrawal_payment_hashes,
+    ),
+]
+
+
+async def run_backfill(
+    backfill: Backfill,
+    progress: Optional[dict] = None,
+    chunk_size: int = BACKFILL_CHUNK_SIZE,
+    duty_cycle: float = BACKFILL_DUTY_CYCLE,
+) -> int:
+    """Run one backfill to completion from its saved progress; return rows updated."""
+    last_key = progress["last_key"] if progress else None
+    rows_done = progress["rows_done"] if progress else 0
+    started = rows_done
+    while True:
+        began = time.monotonic()
+        rows = await backfill.fetch(last_key, chunk_size)
+        if rows:
+            rows_done += await backfill.apply(rows)
+            last_key = rows[-1]["id"]
+        done = len(rows) < chunk_size
+        await save_backfill_progress(backfill.name, last_key, rows_done, done)
+        if done:
+            logger.info(f"Backfill {backfill.name} finished, {rows_done} rows updated")
+            return rows_done - started
+        # Throttle: leave the database to live traffic most of the time
+        elapsed = time.monotonic() - began
+        await asyncio.sleep(
+            max(BACKFILL_MIN_PAUSE_SECONDS, elapsed * (1 / duty_cycle - 1))
+        )
+
+
+async def run_backfills():
+    while True:
+        failed = False
+        try:
+            progress = {row["name"]: row for row in await get_backfill_progress()}
+            for backfill in BACKFILLS:
+                saved = progress.get(backfill.name)
+                if saved and saved["done"]:
+                    continue
+                await run_backfill(backfill, saved)
+        except Exception as e:
+            # The next pass resumes from the last saved chunk
+            logger.error(f"Error running backfills: {str(e)}")
+            failed = True
+        await asyncio.sleep(BACKFILL_RETRY_SECONDS if failed else BACKFILL_RECHECK_SECONDS)
@@ -0,0 +1,88 @@
+"""
+Write-behind QR scan counters.
+
+api_lnurlflip_redirect records every scan and the mode it resolved to in
+memory, with no I/O on the hot path. tasks.run_scan_counter_flush writes the
+accumulated counts in one bulk upsert every SCAN_FLUSH_SECONDS, sooner once
+SCAN_FLUSH_THRESHOLD scans are waiting, and once more on stop. A crash loses
+at most the scans since the last flush. A flush that is cancelled (as on
+stop) lets its upsert finish; the scans are put back only if it fails.
+"""
+
+import asyncio
+import time
+from functools import partial
+from typing import Dict, Optional
+
+from .crud import add_scan_counts
+
+SCAN_FLUSH_THRESHOLD = 1000  # Unflushed scans that trigger an early flush
+
+COUNT_FIELDS = ("scans", "pay_scans", "withdraw_scans")
+
+
+class ScanCounters:
+    def __init__(self, threshold: int = SCAN_FLUSH_THRESHOLD):
+        self.threshold = threshold
+        self.pending: Dict[str, dict] = {}
+        self.pending_scans = 0
+        self.flush_due = asyncio.Event()
+        self._writing: Optional[asyncio.Future] = None
+
+    def record(self, flip_id: str, mode: str) -> None:
+        counts = self.pending.get(flip_id)
+        if counts is None:
+            counts = self.pending[flip_id] = {
+                "scans": 0, "pay_scans": 0, "withdraw_scans": 0, "last_scan_time": 0
+            }
+        counts["scans"] += 1
+        counts["withdraw_scans" if mode == "withdraw" else "pay_scans"] += 1
+        counts["last_scan_time"] = int(time.time())
+        self.pending_scans += 1
+        if self.pending_scans >= self.threshold:
+            self.flush_due.set()
+
+    def unflushed(self, flip_id: str) -> dict:
+        """Counts recorded on this node that are not in the database yet."""
+        counts = self.pending.get(flip_id)
+        return dict(counts) if counts else {field: 0 for field in COUNT_FIELDS}
+
+    def discard(self, flip_id: str) -> None:
+        """Drop a deleted flip's unflushed counts, so a flush does not recreate its row."""
+        counts = self.pending.pop(flip_id, None)
+        if counts:
+            self.pending_scans -= counts["scans"]
+
+    async def flush(self) -> int:
+        """Write the pending counts in one transaction; returns the number of scans written."""
+        if self._writing:
+            # An earlier flush was cancelled mid-write; settle its upsert first
+            await asyncio.wait({self._writing})
+        pending, self.pending = self.pending, {}
+        scans, self.pending_scans = self.pending_scans, 0
+        if not pending:
+            return 0
+        write = self._writing = asyncio.ensure_future(add_scan_counts(pending))
+        write.add_done_callback(partial(self._written, pending, scans))
+        # Cancelling the flush must not cancel the upsert: it may already be
+        # committing, and putting its scans back would count them twice
+        await asyncio.shield(write)
+        return scans
+
+    def _written(self, pending: Dict[str, dict], scans: int, write: asyncio.Future) -> None:
+        if self._writing is write:
+            self._writing = None
+        if write.cancelled() or write.exception() is not None:
+            self._restore(pending, scans)
+
+    def _restore(self, pending: Dict[str, dict], scans: int) -> None:
+        # Scans recorded during the failed flush stay on top of the restored ones
+        for flip_id, counts in pending.items():
+            current = self.pending.setdefault(flip_id, dict(counts, scans=0, pay_scans=0, withdraw_scans=0))
+            for field in COUNT_FIELDS:
+                current[field] += counts[field]
+            current["last_scan_time"] = max(current["last_scan_time"], counts["last_scan_time"])
+        self.pending_scans += scans
+
+
+scan_counters = ScanCounters()
@@ -1,21 +1,168 @@
-from typing import Optional, Union, List
-from lnbits.db import Database
-from .models import LnurlFlip
-from fastapi import HTTPException
+import json
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union, List
+from lnbits.db import Connection, Database, insert_query, model_to_dict, update_query
+from lnbits.helpers import urlsafe_short_hash
+from .models import (
+    MIN_WITHDRAWABLE_MSAT,
+    CreatePoolMemberData,
+    FlipDailyStats,
+    LnurlFlip,
+    LnurlFlipRecord,
+    PendingWithdrawal,
+    PoolMember,
+)
+from .writer import SingleWriter
 from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 
 db = Database("ext_lnurlFlip")
 
+# Withdrawals in these states still hold a reservation against the flip balance
+RESERVED_STATUSES = "('pending', 'processing')"
+
+# Column list for LnurlFlipRecord reads; the aliases keep the camelCase keys
+# on Postgres, which folds unquoted identifiers to lower case
+RECORD_COLUMNS = """
+    id, name, wallet, selectedLnurlp AS "selectedLnurlp",
+    selectedLnurlw AS "selectedLnurlw", total_msat, uses, pool_policy, webhook_url
+"""
+POOL_MEMBER_COLUMNS = """
+    id, flip_id, wallet, selectedLnurlp AS "selectedLnurlp",
+    selectedLnurlw AS "selectedLnurlw", balance_msat, created_time
+"""
+
+# Daily rollup upsert, shared by every settlement path
+DAILY_STATS_COLUMNS = "(flip_id, day, in_msat, out_msat, payment_count, withdrawal_count)"
+DAILY_STATS_CONFLICT = """
+    ON CONFLICT (flip_id, day) DO UPDATE SET
+        in_msat = flip_daily_stats.in_msat + excluded.in_msat,
+        out_msat = flip_daily_stats.out_msat + excluded.out_msat,
+        payment_count = flip_daily_stats.payment_count + excluded.payment_count,
+        withdrawal_count = flip_daily_stats.withdrawal_count + excluded.withdrawal_count
+"""
+DAILY_STATS_SELECT = """
+    SELECT id, :day, CAST(:in_msat AS BIGINT), CAST(:out_msat AS BIGINT),
+    CAST(:payment_count AS INTEGER), CAST(:withdrawal_count AS INTEGER)
+"""
+
+# Flips per multi-row scan counter upsert
+SCAN_UPSERT_CHUNK = 200
+
+COMMENT_SEARCH_MAX_WORDS = 16  # Longer searches are cut to their first words
+
+# Every balance change is keyed in payment_ledger; a key that is already there
+# was applied before, so inserting it first makes settlement exactly-once
+LEDGER_INSERT = """
+    INSERT INTO lnurlFlip.payment_ledger (payment_hash, flip_id, amount_msat, time)
+    VALUES (:payment_hash, :flip_id, :amount_delta, :time)
+    ON CONFLICT (payment_hash) DO NOTHING
+"""
+
+
+class Transaction:
+    """
+    Statements executed on one connection and committed together.
+    lnbits' Connection.execute commits after every statement, so this drives
+    the underlying SQLAlchemy connection directly.
+    """
+
+    def __init__(self, conn: Connection):
+        self._conn = conn
+        self.type = conn.type
+
+    async def execute(self, query: str, values: Optional[dict] = None):
+        return await self._conn.conn.execute(
+            text(self._conn.rewrite_query(query)),
+            self._conn.rewrite_values(values) if values else {}
+        )
+
+    async def fetchone(self, query: str, values: Optional[dict] = None, model=None):
+        row = (await self.execute(query, values)).mappings().first()
+        return model(**row) if model and row else row
+
+    async def fetchall(self, query: str, values: Optional[dict] = None, model=None):
+        rows = (await self.execute(query, values)).mappings().all()
+        return [model(**row) for row in rows] if model else rows
+
+    async def insert(self, table_name: str, model):
+        """Like Database.insert, without the commit."""
+        return await self._conn.conn.execute(
+            text(insert_query(table_name, model)), model_to_dict(model)
+        )
+
+    async def update(self, table_name: str, model, where: str = "WHERE id = :id"):
+        """Like Database.update, without the commit."""
+        return await self._conn.conn.execute(
+            text(update_query(table_name, model, where)), model_to_dict(model)
+        )
+
+
+@asynccontextmanager
+async def transaction():
+    """Run several statements atomically: commit on success, roll back on error."""
+    async with db.connect() as conn:
+        tx = Transaction(conn)
+        try:
+            yield tx
+        except BaseException:
+            await conn.conn.rollback()
+            raise
+        await conn.conn.commit()
+
+writer = SingleWriter(transaction)
+writer.configure(db.type)
+
+async def write(mutation: Callable[[Transaction], Awaitable]):
+    """
+    Run a mutation (an async callable taking a Transaction) atomically: through
+    the single writer when it is enabled, otherwise in its own transaction.
+    """
+    if writer.enabled:
+        return await writer.submit(mutation)
+    async with transaction() as tx:
+        return await mutation(tx)
+
+async def execute_write(query: str, values: Optional[dict] = None):
+    """A single-statement mutation, see write()."""
+    return await write(lambda tx: tx.execute(query, values))
+
+def greatest() -> str:
+    """SQLite spells GREATEST as MAX."""
+    return "MAX" if db.type == "SQLITE" else "GREATEST"
+
+def raise_if_duplicate_name(error: IntegrityError, name: str) -> None:
+    """
+    Translate a violation of the (wallet, LOWER(name)) unique index into a
+    ValueError, which the API returns as a 400.
+    """
+    if "idx_maintable_wallet_name" in str(error):
+        raise ValueError(
+            f"A lnurlflip with the name '{name}' already exists in this wallet"
+        ) from error
+
 async def create_lnurlflip(data: LnurlFlip) -> LnurlFlip:
-    """Create a new LnurlFlip record."""
+    """
+    Create a new LnurlFlip record.
+
+    Raises:
+        ValueError: the wallet already has a flip with this name
+    """
     # Ensure fields are initialized with valid values
     data.total_msat = 0
     data.uses = 0
     
     try:
         # Use the pattern from withdraw extension
-        await db.insert("maintable", data)
+        await write(lambda tx: tx.insert("maintable", data))
         
+    except IntegrityError as e:
+        raise_if_duplicate_name(e, data.name)
+        raise
     except Exception as e:
         logger.error(f"Error creating lnurlFlip {data.id}: {type(e).__name__}: {str(e)}")
         raise
@@ -29,30 +176,74 @@ async def get_lnurlflip_balance(lnurlflip_id: str) -> int:
     Returns:
         The available balance in millisatoshis (msats)
     """
-    flip = await get_lnurlFlip(lnurlflip_id)
-    if not flip:
+    found = await get_lnurlflip_with_balance(lnurlflip_id)
+    if not found:
         return None
-    
-    # Get pending withdrawals
-    pending = await db.fetchone(
-        """
-        SELECT COALESCE(SUM(amount_msat), 0) as total
-        FROM pending_withdrawals
-        WHERE flip_id = :flip_id
-        AND status = 'pending'
+    _flip, available_balance_msat = found
+    return available_balance_msat
+
+async def get_lnurlflip_with_balance(
+    lnurlflip_id: str
+) -> Optional[Tuple[LnurlFlipRecord, int]]:
+    """
+    Get a flip record and its available balance (total minus reserved
+    withdrawals, in msats) in one query, for the LNURL hot paths.
+    """
+    row = await db.fetchone(
+        f"""
+        SELECT {RECORD_COLUMNS},
+        (
+            SELECT COALESCE(SUM(amount_msat), 0)
+            FROM lnurlFlip.pending_withdrawals
+            WHERE flip_id = maintable.id
+            AND status IN {RESERVED_STATUSES}
+        ) AS reserved_msat
+        FROM lnurlFlip.maintable
+        WHERE id = :id
         """,
-        {"flip_id": lnurlflip_id}
+        {"id": lnurlflip_id}
     )
-    pending_amount_msat = pending["total"] if pending else 0
-    # Note: flip.total_msat is in msats, pending_amount_msat is now also in msats
-    available_balance_msat = max(0, flip.total_msat - pending_amount_msat)
-    return available_balance_msat
+    if not row:
+        return None
+    flip = LnurlFlipRecord.from_row(row)
+    return flip, max(0, flip.total_msat - row["reserved_msat"])
+
+async def get_lnurlflips_with_balance(
+    lnurlflip_ids: List[str]
+) -> Dict[str, Tuple[LnurlFlipRecord, int]]:
+    """
+    Like get_lnurlflip_with_balance for many flips in one query, keyed by
+    id. Unknown ids are left out.
+    """
+    if not lnurlflip_ids:
+        return {}
+    values = {f"id_{i}": flip_id for i, flip_id in enumerate(dict.fromkeys(lnurlflip_ids))}
+    placeholders = ",".join(f":{key}" for key in values)
+    rows = await db.fetchall(
+        f"""
+        SELECT {RECORD_COLUMNS},
+        (
+            SELECT COALESCE(SUM(amount_msat), 0)
+            FROM lnurlFlip.pending_withdrawals
+            WHERE flip_id = maintable.id
+            AND status IN {RESERVED_STATUSES}
+        ) AS reserved_msat
+        FROM lnurlFlip.maintable
+        WHERE id IN ({placeholders})
+        """,
+        values
+    )
+    found = {}
+    for row in rows:
+        flip = LnurlFlipRecord.from_row(row)
+        found[flip.id] = (flip, max(0, flip.total_msat - row["reserved_msat"]))
+    return found
 
 async def get_lnurlFlip(lnurlflip_id: str) -> Optional[LnurlFlip]:
     """Get a single LnurlFlip by ID."""
     try:
         row = await db.fetchone(
-            "SELECT * FROM maintable WHERE id = :id", 
+            f"SELECT {RECORD_COLUMNS} FROM maintable WHERE id = :id",
             {"id": lnurlflip_id}
         )
         if row:
@@ -64,6 +255,63 @@ async def get_lnurlFlip(lnurlflip_id: str) -> Optional[LnurlFlip]:
         logger.error(f"Row data: {row if 'row' in locals() else 'Not fetched'}")
         raise
 
+async def get_lnurlflip_record(lnurlflip_id: str) -> Optional[LnurlFlipRecord]:
+    """Get a single flip as a lightweight read-only record (hot paths)."""
+    row = await db.fetchone(
+        f"SELECT {RECORD_COLUMNS} FROM lnurlFlip.maintable WHERE id = :id",
+        {"id": lnurlflip_id}
+    )
+    return LnurlFlipRecord.from_row(row) if row else None
+
+async def get_lnurlflip_records(wallet_ids: List[str]) -> List[LnurlFlipRecord]:
+    """Get all flips for the given wallets as lightweight read-only records."""
+    if not wallet_ids:
+        return []
+    values = {f"wallet_{i}": wallet_id for i, wallet_id in enumerate(wallet_ids)}
+    placeholders = ",".join(f":{key}" for key in values)
+    rows = await db.fetchall(
+        f"SELECT {RECORD_COLUMNS} FROM lnurlFlip.maintable WHERE wallet IN ({placeholders})",
+        values
+    )
+    return [LnurlFlipRecord.from_row(row) for row in rows]
+
+async def get_lnurlflip_summaries(wallet_ids: List[str]) -> List[dict]:
+    """
+    Get all flips for the given wallets with their available balance and
+    comment count in one query, instead of a balance and a count per flip.
+    Both subqueries are correlated on flip_id and served by its indexes.
+    """
+    if not wallet_ids:
+        return []
+    values = {f"wallet_{i}": wallet_id for i, wallet_id in enumerate(wallet_ids)}
+    placeholders = ",".join(f":{key}" for key in values)
+    rows = await db.fetchall(
+        f"""
+        SELECT {RECORD_COLUMNS},
+        (
+            SELECT COALESCE(SUM(amount_msat), 0)
+            FROM lnurlFlip.pending_withdrawals
+            WHERE flip_id = maintable.id
+            AND status IN {RESERVED_STATUSES}
+        ) AS reserved_msat,
+        (
+            SELECT COUNT(*)
+            FROM lnurlFlip.invoice_comments
+            WHERE flip_id = maintable.id
+        ) AS comment_count
+        FROM lnurlFlip.maintable
+        WHERE wallet IN ({placeholders})
+        """,
+        values
+    )
+    summaries = []
+    for row in rows:
+        data = LnurlFlipRecord.from_row(row)._asdict()
+        data["balance"] = max(0, data["total_msat"] - row["reserved_msat"])
+        data["comment_count"] = row["comment_count"]
+        summaries.append(data)
+    return summaries
+
 async def get_lnurlFlips(wallet_ids: Union[str, List[str]]) -> List[LnurlFlip]:
     """Get all LnurlFlips for given wallet IDs."""
     if isinstance(wallet_ids, str):
@@ -85,7 +333,7 @@ async def get_lnurlFlips(wallet_ids: Union[str, List[str]]) -> List[LnurlFlip]:
         values[key] = wallet_id
     
     # Use parameterized query with individually named placeholders
-    query = f"SELECT * FROM maintable WHERE wallet IN ({','.join(placeholders)})"
+    query = f"SELECT {RECORD_COLUMNS} FROM maintable WHERE wallet IN ({','.join(placeholders)})"
     
     rows = await db.fetchall(
         query,
@@ -95,74 +343,89 @@ async def get_lnurlFlips(wallet_ids: Union[str, List[str]]) -> List[LnurlFlip]:
     return rows
 
 async def update_lnurlFlip(data: LnurlFlip) -> LnurlFlip:
-    """Update an existing LnurlFlip."""
+    """
+    Update an existing LnurlFlip.
+
+    Raises:
+        ValueError: the wallet already has another flip with this name
+    """
     logger.info(f"Updating lnurlFlip: {data.id}")
     
-    await db.update(
-        "maintable", 
-        data,
-        "WHERE id = :id"
-    )
+    async def update(tx: Transaction):
+        await tx.update("maintable", data, "WHERE id = :id")
+        # The flip's own pool member follows its links
+        await tx.execute(
+            """
+            UPDATE lnurlFlip.pool_members
+            SET wallet = :wallet, selectedLnurlp = :selectedLnurlp,
+            selectedLnurlw = :selectedLnurlw
+            WHERE id = :id
+            """,
+            {
+                "id": data.id,
+                "wallet": data.wallet,
+                "selectedLnurlp": data.selectedLnurlp,
+                "selectedLnurlw": data.selectedLnurlw,
+            }
+        )
+
+    try:
+        await write(update)
+    except IntegrityError as e:
+        raise_if_duplicate_name(e, data.name)
+        raise
     
     return data
 
-async def delete_lnurlFlip(lnurlflip_id: str) -> None:
-    """Delete a LnurlFlip."""
-    await db.execute(
-        "DELETE FROM maintable WHERE id = :id", 
-        {"id": lnurlflip_id}
-    )
+# Tables keyed by flip_id whose rows go with the flip; undelivered webhook
+# events are dropped too, so the dispatcher stops retrying them. Deleting the
+# comments fires the search index's delete trigger on SQLite.
+FLIP_OWNED_TABLES = (
+    "pool_members",
+    "flip_daily_stats",
+    "scan_counters",
+    "payment_ledger",
+    "webhook_outbox",
+    "invoice_comments",
+    "pending_withdrawals",  # Only finished ones, see delete_lnurlFlip
+)
 
-async def update_lnurlflip_atomic(
-    lnurlflip_id: str, 
-    amount_delta: int,
-    increment_uses: bool = False
-) -> Optional[LnurlFlip]:
+async def delete_lnurlFlip(lnurlflip_id: str) -> bool:
     """
-    Atomically update the balance and optionally increment uses.
-    This prevents race conditions by doing the math in the database.
-    
-    Args:
-        lnurlflip_id: The ID of the flip to update
-        amount_delta: The amount in msats to add (positive) or subtract (negative)
-        increment_uses: Whether to increment the uses counter
-    
+    Delete a LnurlFlip and the rows it owns, including its finished
+    withdrawals, in one transaction. The flip row is locked first on
+    Postgres, like in reserve_withdrawal, so no withdrawal is queued meanwhile.
+
     Returns:
-        The updated LnurlFlip object or None if not found
+        False (nothing deleted) while a withdrawal still holds a reservation
     """
-    logger.info(f"Atomic update for {lnurlflip_id}: delta={amount_delta}, increment_uses={increment_uses}")
-    
-    # Update balance and optionally increment uses
-    uses_increment = ", uses = uses + 1" if increment_uses else ""
-    
-    # Handle different database types
-    if db.type == "SQLITE":
-        # SQLite uses MAX instead of GREATEST
-        await db.execute(
-            f"""
-            UPDATE maintable
-            SET total_msat = MAX(0, total_msat + :amount_delta){uses_increment}
-            WHERE id = :id
-            """,
-            {"id": lnurlflip_id, "amount_delta": amount_delta}
+    lock = "" if db.type == "SQLITE" else "FOR UPDATE"
+    async def delete(tx: Transaction) -> bool:
+        await tx.fetchone(
+            f"SELECT id FROM lnurlFlip.maintable WHERE id = :id {lock}",
+            {"id": lnurlflip_id}
         )
-    else:
-        # PostgreSQL and CockroachDB use GREATEST
-        await db.execute(
+        reserved = await tx.fetchone(
             f"""
-            UPDATE maintable
-            SET total_msat = GREATEST(0, total_msat + :amount_delta){uses_increment}
-            WHERE id = :id
+            SELECT COUNT(*) AS n FROM lnurlFlip.pending_withdrawals
+            WHERE flip_id = :id AND status IN {RESERVED_STATUSES}
             """,
-            {"id": lnurlflip_id, "amount_delta": amount_delta}
+            {"id": lnurlflip_id}
         )
-    
-    # Return the updated record
-    updated = await get_lnurlFlip(lnurlflip_id)
-    if updated:
-        logger.debug(f"Balance updated: {updated.total_msat} msat")
-    
-    return updated
+        if reserved["n"]:
+            return False
+        for table in FLIP_OWNED_TABLES:
+            await tx.execute(
+                f"DELETE FROM lnurlFlip.{table} WHERE flip_id = :id",
+                {"id": lnurlflip_id}
+            )
+        await tx.execute(
+            "DELETE FROM lnurlFlip.maintable WHERE id = :id",
+            {"id": lnurlflip_id}
+        )
+        return True
+
+    return await write(delete)
 
 async def get_flip_comments(flip_id: str) -> List[dict]:
     """Get all comments for a flip"""
@@ -177,79 +440,981 @@ async def get_flip_comments(flip_id: str) -> List[dict]:
     )
     return [dict(row) for row in rows]
 
+def comment_search_query(text: str) -> Optional[str]:
+    """
+    Turn free text into a full-text query: every word must match, the last
+    one as a prefix. Only word characters are kept, so the result is always
+    valid FTS5 / tsquery syntax. None if there is nothing to search for.
+    """
+    words = re.findall(r"\w+", text.lower())[:COMMENT_SEARCH_MAX_WORDS]
+    if not words:
+        return None
+    if db.type == "SQLITE":
+        return " ".join(f'"{word}"' for word in words) + "*"
+    return " & ".join(words) + ":*"
 
-async def check_duplicate_name(name: str, wallet_id: str, exclude_id: Optional[str] = None) -> bool:
+async def search_comments(
+    wallet_ids: List[str], text: str, limit: int = 20, offset: int = 0
+) -> List[dict]:
     """
-    Check if a lnurlFlip with the given name already exists for the wallet.
-    
-    Args:
-        name: The name to check
-        wallet_id: The wallet ID to check within
-        exclude_id: Optional ID to exclude from the check (for updates)
-    
-    Returns:
-        True if a duplicate exists, False otherwise
+    Comments on the given wallets' flips matching `text`, best match first
+    (newest first among equals), through the full-text index from m009.
     """
-    if exclude_id:
-        result = await db.fetchone(
-            """
-            SELECT COUNT(*) as count
-            FROM maintable
-            WHERE LOWER(name) = LOWER(:name) 
-            AND wallet = :wallet_id
-            AND id != :exclude_id
-            """,
-            {"name": name, "wallet_id": wallet_id, "exclude_id": exclude_id}
-        )
+    query = comment_search_query(text)
+    if not wallet_ids or query is None:
+        return []
+    values = {f"wallet_{i}": wallet_id for i, wallet_id in enumerate(wallet_ids)}
+    placeholders = ",".join(f":{key}" for key in values)
+    values.update({"query": query, "limit": limit, "offset": offset})
+    if db.type == "SQLITE":
+        sql = f"""
+            SELECT c.id, c.flip_id, m.name AS flip_name, c.comment, c.timestamp, c.amount_msat
+            FROM lnurlFlip.invoice_comments_fts
+            JOIN lnurlFlip.invoice_comments c ON c.id = invoice_comments_fts.id
+            JOIN lnurlFlip.maintable m ON m.id = c.flip_id
+            WHERE invoice_comments_fts MATCH :query
+            AND m.wallet IN ({placeholders})
+            ORDER BY bm25(invoice_comments_fts), c.timestamp DESC
+            LIMIT :limit OFFSET :offset
+        """
     else:
-        result = await db.fetchone(
+        sql = f"""
+            SELECT c.id, c.flip_id, m.name AS flip_name, c.comment, c.timestamp, c.amount_msat
+            FROM lnurlFlip.invoice_comments c
+            JOIN lnurlFlip.maintable m ON m.id = c.flip_id
+            WHERE to_tsvector('simple', c.comment) @@ to_tsquery('simple', :query)
+            AND m.wallet IN ({placeholders})
+            ORDER BY ts_rank(to_tsvector('simple', c.comment), to_tsquery('simple', :query)) DESC,
+            c.timestamp DESC
+            LIMIT :limit OFFSET :offset
+        """
+    rows = await db.fetchall(sql, values)
+    return [dict(row) for row in rows]
+
+async def save_invoice_comment(flip_id: str, comment: str, amount_msat: int) -> str:
+    """Store a payer's LNURL comment against a flip."""
+    comment_id = urlsafe_short_hash()
+    await execute_write(
+        """
+        INSERT INTO lnurlFlip.invoice_comments
+        (id, flip_id, comment, timestamp, amount_msat)
+        VALUES (:id, :flip_id, :comment, :timestamp, :amount_msat)
+        """,
+        {
+            "id": comment_id,
+            "flip_id": flip_id,
+            "comment": comment,
+            "timestamp": int(time.time()),
+            "amount_msat": amount_msat  # Amount in msats from LNURL
+        }
+    )
+    return comment_id
+
+
+def stats_day(timestamp: Optional[float] = None) -> str:
+    """Return the UTC day bucket (YYYY-MM-DD) for a unix timestamp."""
+    moment = (
+        datetime.fromtimestamp(timestamp, timezone.utc)
+        if timestamp is not None
+        else datetime.now(timezone.utc)
+    )
+    return moment.strftime("%Y-%m-%d")
+
+def settle_update_sql(amount_delta: int, check_balance: bool = True, condition: str = "") -> str:
+    """
+    Build the UPDATE ... RETURNING that applies `amount_delta` to a flip. It
+    returns RECORD_COLUMNS, so the row builds a LnurlFlip on Postgres too.
+    For withdrawals the use counter and (optionally) the balance check are
+    decided in the same statement: a withdrawal that empties the flip counts as
+    a use, and one that would dip into reserved funds matches no row.
+    `condition` is ANDed onto the WHERE clause.
+    """
+    uses = ""
+    guard = ""
+    if amount_delta < 0:
+        uses = ", uses = uses + CASE WHEN total_msat + :amount_delta <= 0 THEN 1 ELSE 0 END"
+        if check_balance:
+            guard = f"""
+            AND total_msat + :amount_delta >= (
+                SELECT COALESCE(SUM(amount_msat), 0)
+                FROM lnurlFlip.pending_withdrawals
+                WHERE flip_id = :flip_id
+                AND status IN {RESERVED_STATUSES}
+            )
+            """
+    return f"""
+        UPDATE lnurlFlip.maintable
+        SET total_msat = {greatest()}(0, total_msat + :amount_delta){uses}
+        WHERE id = :flip_id {guard} {condition}
+        RETURNING {RECORD_COLUMNS}
+    """
+
+def settle_values(flip_id: str, amount_delta: int, timestamp: Optional[float] = None) -> dict:
+    """Parameters for settle_update_sql plus the matching daily rollup increment."""
+    is_withdrawal = amount_delta < 0
+    amount_msat = abs(amount_delta)
+    return {
+        "flip_id": flip_id,
+        "amount_delta": amount_delta,
+        "day": stats_day(timestamp),
+        "in_msat": 0 if is_withdrawal else amount_msat,
+        "out_msat": amount_msat if is_withdrawal else 0,
+        "payment_count": 0 if is_withdrawal else 1,
+        "withdrawal_count": 1 if is_withdrawal else 0,
+    }
+
+def pool_member_settle_sql() -> str:
+    """
+    Apply the settled amount to the pool member that took it. Flips without
+    a pool have no member rows, so this matches nothing for them.
+    """
+    return f"""
+        UPDATE lnurlFlip.pool_members
+        SET balance_msat = {greatest()}(0, balance_msat + :amount_delta)
+        WHERE id = :member_id AND flip_id = :flip_id
+    """
+
+async def enqueue_flip_events(
+    tx: Transaction, flip: LnurlFlip, amount_delta: int, reference: Optional[str]
+) -> None:
+    """
+    Queue webhook events for a settlement in the settlement's own transaction:
+    the payment or withdrawal itself, and mode_changed when the balance
+    crossed the withdrawable minimum.
+    """
+    if not flip.webhook_url:
+        return
+    now = int(time.time())
+    events = [(
+        "withdrawal" if amount_delta < 0 else "payment",
+        {"amount_msat": abs(amount_delta), "payment_hash": reference},
+    )]
+    could_withdraw = flip.total_msat - amount_delta >= MIN_WITHDRAWABLE_MSAT
+    can_withdraw = flip.total_msat >= MIN_WITHDRAWABLE_MSAT
+    if could_withdraw != can_withdraw:
+        events.append(("mode_changed", {"mode": "withdraw" if can_withdraw else "payment"}))
+    for event, data in events:
+        event_id = urlsafe_short_hash()
+        payload = {
+            "id": event_id,
+            "event": event,
+            "flip_id": flip.id,
+            "flip_name": flip.name,
+            "balance_msat": flip.total_msat,
+            "time": now,
+            **data,
+        }
+        await tx.execute(
             """
-            SELECT COUNT(*) as count
-            FROM maintable
-            WHERE LOWER(name) = LOWER(:name) 
-            AND wallet = :wallet_id
+            INSERT INTO lnurlFlip.webhook_outbox
+            (id, flip_id, url, event, payload, next_attempt_ms, created_time)
+            VALUES (:id, :flip_id, :url, :event, :payload, :next_attempt_ms, :created_time)
             """,
-            {"name": name, "wallet_id": wallet_id}
+            {
+                "id": event_id,
+                "flip_id": flip.id,
+                "url": flip.webhook_url,
+                "event": event,
+                "payload": json.dumps(payload),
+                "next_attempt_ms": now * 1000,
+                "created_time": now,
+            }
         )
-    
-    return result["count"] > 0 if result else False
 
-async def process_payment_with_lock(
+def flip_events_sql() -> str:
+    """
+    Postgres counterpart of enqueue_flip_events, as an INSERT ... SELECT over
+    the `flip` CTE of a settlement, so the events are queued in the same
+    statement. Takes its parameters from flip_event_values.
+    """
+    return """
+        INSERT INTO lnurlFlip.webhook_outbox
+        (id, flip_id, url, event, payload, next_attempt_ms, created_time)
+        SELECT e.id, flip.id, flip.webhook_url, e.event,
+        CAST(jsonb_build_object(
+            'id', e.id, 'event', e.event, 'flip_id', flip.id, 'flip_name', flip.name,
+            'balance_msat', flip.total_msat, 'time', CAST(:event_time AS BIGINT)
+        ) || e.data AS TEXT),
+        CAST(:event_time AS BIGINT) * 1000, CAST(:event_time AS BIGINT)
+        FROM flip JOIN (
+            SELECT CAST(:event_id AS TEXT) AS id, CAST(:event AS TEXT) AS event,
+            jsonb_build_object(
+                'amount_msat', CAST(:event_amount_msat AS BIGINT),
+                'payment_hash', CAST(:event_reference AS TEXT)
+            ) AS data,
+            TRUE AS due
+            FROM flip
+            UNION ALL
+            SELECT CAST(:mode_event_id AS TEXT), 'mode_changed',
+            jsonb_build_object('mode', CASE
+                WHEN total_msat >= :min_withdrawable THEN 'withdraw' ELSE 'payment'
+            END),
+            (total_msat - :amount_delta >= :min_withdrawable) <> (total_msat >= :min_withdrawable)
+            FROM flip
+        ) AS e ON e.due
+        WHERE flip.webhook_url IS NOT NULL
+    """
+
+def flip_event_values(amount_delta: int, reference: Optional[str]) -> dict:
+    """Parameters for flip_events_sql."""
+    return {
+        "event_time": int(time.time()),
+        "event_id": urlsafe_short_hash(),
+        "event": "withdrawal" if amount_delta < 0 else "payment",
+        "event_amount_msat": abs(amount_delta),
+        "event_reference": reference,
+        "mode_event_id": urlsafe_short_hash(),
+        "min_withdrawable": MIN_WITHDRAWABLE_MSAT,
+    }
+
+async def settle_flip_payment(
     lnurlflip_id: str,
     amount_delta: int,
-    increment_uses: bool = False,
-    operation_type: str = "payment"
+    timestamp: Optional[float] = None,
+    payment_hash: Optional[str] = None,
+    member_id: Optional[str] = None
 ) -> Optional[LnurlFlip]:
     """
-    Process payment operations atomically.
-    The database handles concurrency through atomic operations.
-    
+    Apply a settled payment (positive) or withdrawal (negative) to a flip and
+    its daily rollup.
+
+    With a payment_hash the settlement is recorded in payment_ledger first, in
+    the same transaction, and a hash that was already applied is skipped. The
+    listener and the reconciliation job can therefore both see a payment.
+
+    For a pooled flip the amount is also applied to the member that took the
+    payment (the flip's own member when none is given), so the members'
+    balances keep adding up to the flip's. Webhook events are queued in the
+    same transaction (see enqueue_flip_events).
+
+    On Postgres/CockroachDB all of that is one statement: the ledger insert,
+    rollup upsert, member update and outbox insert ride along the flip update
+    as data-modifying CTEs. Only when a recorded payment then could not be
+    applied does a second statement remove its ledger row. SQLite has no
+    data-modifying CTEs, so there it runs as separate statements in one
+    transaction: ledger insert, flip update, rollup upsert, member update and
+    one outbox insert per event (up to two, for flips with a webhook).
+
     Args:
         lnurlflip_id: The ID of the flip to update
         amount_delta: The amount in msats to add (positive) or subtract (negative)
-        increment_uses: Whether to increment the uses counter
-        operation_type: Type of operation ("payment" or "withdrawal")
-    
+        timestamp: Unix time of the settlement, defaults to now
+        payment_hash: Ledger key of the payment, if it has one
+        member_id: Pool member the payment went to, if any
+
     Returns:
-        The updated LnurlFlip object or None if not found
+        The updated LnurlFlip, or None if the flip does not exist, a
+        withdrawal exceeds the available balance, or the payment was already
+        applied
     """
-    try:
-        # For withdrawals, check balance first
-        if amount_delta < 0:  # Withdrawal
-            current_balance = await get_lnurlflip_balance(lnurlflip_id)
-            if current_balance < abs(amount_delta):
-                logger.error(f"Insufficient balance for withdrawal: {current_balance} < {abs(amount_delta)}")
-                raise HTTPException(status_code=400, detail="Insufficient balance")
-        
-        # Perform the atomic update - database handles concurrency
-        result = await update_lnurlflip_atomic(
-            lnurlflip_id=lnurlflip_id,
-            amount_delta=amount_delta,
-            increment_uses=increment_uses
+    values = settle_values(lnurlflip_id, amount_delta, timestamp)
+    values["payment_hash"] = payment_hash
+    values["time"] = int(timestamp if timestamp is not None else time.time())
+    values["member_id"] = member_id or lnurlflip_id
+
+    async def apply_sqlite(tx: Transaction) -> Tuple[Optional[LnurlFlip], bool]:
+        if payment_hash:
+            recorded = await tx.execute(LEDGER_INSERT, values)
+            if recorded.rowcount == 0:
+                return None, False
+        updated = await tx.fetchone(settle_update_sql(amount_delta), values, LnurlFlip)
+        if updated:
+            await tx.execute(
+                f"""
+                INSERT INTO lnurlFlip.flip_daily_stats {DAILY_STATS_COLUMNS}
+                {DAILY_STATS_SELECT} FROM lnurlFlip.maintable WHERE id = :flip_id
+                {DAILY_STATS_CONFLICT}
+                """,
+                values
+            )
+            await tx.execute(pool_member_settle_sql(), values)
+            await enqueue_flip_events(tx, updated, amount_delta, payment_hash)
+        return updated, bool(payment_hash)
+
+    async def apply_postgres(tx: Transaction) -> Tuple[Optional[LnurlFlip], bool]:
+        ledger = ""
+        condition = ""
+        result = "SELECT flip.*, 0 AS recorded FROM flip"
+        if payment_hash:
+            # The flip is only updated when the ledger row was new; a
+            # concurrent insert of the same hash waits on the unique index
+            ledger = f"ledger AS ({LEDGER_INSERT} RETURNING payment_hash),"
+            condition = "AND EXISTS (SELECT 1 FROM ledger)"
+            result = """
+                SELECT flip.*, (SELECT COUNT(*) FROM ledger) AS recorded
+                FROM (SELECT 1) AS one LEFT JOIN flip ON TRUE
+            """
+        row = await tx.fetchone(
+            f"""
+            WITH {ledger}
+            flip AS ({settle_update_sql(amount_delta, condition=condition)}),
+            stats AS (
+                INSERT INTO lnurlFlip.flip_daily_stats {DAILY_STATS_COLUMNS}
+                {DAILY_STATS_SELECT} FROM flip
+                {DAILY_STATS_CONFLICT}
+            ),
+            member AS (
+                UPDATE lnurlFlip.pool_members
+                SET balance_msat = GREATEST(0, balance_msat + :amount_delta)
+                FROM flip
+                WHERE pool_members.id = :member_id AND pool_members.flip_id = flip.id
+            ),
+            events AS ({flip_events_sql()})
+            -- flip's columns already carry the camelCase aliases (RETURNING)
+            {result}
+            """,
+            {**values, **flip_event_values(amount_delta, payment_hash)}
         )
-        
-        return result
-    except Exception as e:
-        logger.error(f"Error in process_payment_with_lock: {e}")
+        if not row:
+            return None, False
+        row = dict(row)
+        recorded = bool(row.pop("recorded"))
+        return (LnurlFlip(**row) if row["id"] else None), recorded
+
+    async def apply(tx: Transaction) -> Optional[LnurlFlip]:
+        settle = apply_sqlite if tx.type == "SQLITE" else apply_postgres
+        updated, recorded = await settle(tx)
+        if payment_hash and not recorded:
+            logger.debug(f"Payment {payment_hash[:8]}... already applied to flip {lnurlflip_id[:8]}...")
+        # Recorded but not applied, so it must not count as applied either.
+        # This undoes the ledger row alone rather than rolling back, since the
+        # transaction may be a batch shared with other writes (see writer.py)
+        if not updated and recorded:
+            await tx.execute(
+                "DELETE FROM lnurlFlip.payment_ledger WHERE payment_hash = :payment_hash",
+                values
+            )
+        return updated
+
+    return await write(apply)
+
+async def get_daily_stats(flip_id: str, start_day: str, end_day: str) -> List[FlipDailyStats]:
+    """
+    Get the daily rollups for a flip between two UTC days (inclusive).
+    Reads walk the (flip_id, day) primary key, so cost follows the date range
+    rather than the number of transactions.
+    """
+    return await db.fetchall(
+        """
+        SELECT flip_id, day, in_msat, out_msat, payment_count, withdrawal_count
+        FROM lnurlFlip.flip_daily_stats
+        WHERE flip_id = :flip_id
+        AND day >= :start_day
+        AND day <= :end_day
+        ORDER BY day ASC
+        """,
+        {"flip_id": flip_id, "start_day": start_day, "end_day": end_day},
+        FlipDailyStats
+    )
+
+
+async def reserve_withdrawal(
+    flip_id: str,
+    amount_msat: int,
+    payment_request: str,
+    payment_hash: str,
+    member_id: Optional[str] = None
+) -> Optional[str]:
+    """
+    Queue a withdrawal, reserving its amount against the flip balance (and
+    against the paying pool member's share, for pooled flips). The balance
+    checks and the insert share one transaction, and on Postgres the flip row
+    is locked first, so concurrent callbacks cannot both reserve the same funds.
+
+    Raises:
+        ValueError: the invoice was already submitted (unique payment_hash)
+
+    Returns:
+        The new withdrawal ID, or None if the available balance is too low
+    """
+    withdraw_id = urlsafe_short_hash()
+    lock = "" if db.type == "SQLITE" else "FOR UPDATE"
+    async def reserve(tx: Transaction) -> Optional[str]:
+        flip = await tx.fetchone(
+            f"SELECT total_msat FROM lnurlFlip.maintable WHERE id = :flip_id {lock}",
+            {"flip_id": flip_id}
+        )
+        if not flip:
+            return None
+        reserved = await tx.fetchone(
+            f"""
+            SELECT COALESCE(SUM(amount_msat), 0) as total
+            FROM lnurlFlip.pending_withdrawals
+            WHERE flip_id = :flip_id
+            AND status IN {RESERVED_STATUSES}
+            """,
+            {"flip_id": flip_id}
+        )
+        if flip["total_msat"] - reserved["total"] < amount_msat:
+            return None
+        if member_id:
+            member = await tx.fetchone(
+                f"""
+                SELECT balance_msat - (
+                    SELECT COALESCE(SUM(amount_msat), 0)
+                    FROM lnurlFlip.pending_withdrawals
+                    WHERE member_id = pool_members.id
+                    AND status IN {RESERVED_STATUSES}
+                ) AS available_msat
+                FROM lnurlFlip.pool_members
+                WHERE id = :member_id AND flip_id = :flip_id
+                """,
+                {"member_id": member_id, "flip_id": flip_id}
+            )
+            if not member or member["available_msat"] < amount_msat:
+                return None
+        await tx.execute(
+            """
+            INSERT INTO lnurlFlip.pending_withdrawals
+            (id, flip_id, amount_msat, status, created_time, payment_request, payment_hash, member_id)
+            VALUES (:id, :flip_id, :amount_msat, 'pending', :created_time, :payment_request, :payment_hash, :member_id)
+            """,
+            {
+                "id": withdraw_id,
+                "flip_id": flip_id,
+                "amount_msat": amount_msat,
+                "created_time": int(time.time()),
+                "payment_request": payment_request,
+                "payment_hash": payment_hash,
+                "member_id": member_id
+            }
+        )
+        return withdraw_id
+
+    try:
+        return await write(reserve)
+    except IntegrityError as e:
+        # Match the index (Postgres) or qualified column (SQLite) in the
+        # driver's message; str(e) also carries the INSERT statement
+        message = str(e.orig)
+        if (
+            "idx_pending_withdrawals_payment_hash" in message
+            or "pending_withdrawals.payment_hash" in message
+        ):
+            raise ValueError("Invoice already submitted") from e
         raise
 
+async def claim_withdrawals(limit: int = 1) -> List[PendingWithdrawal]:
+    """
+    Claim up to `limit` queued withdrawals for execution, oldest first.
+    Postgres skips rows another worker has locked; on SQLite the single
+    UPDATE already runs under the database write lock.
+    """
+    skip_locked = "" if db.type == "SQLITE" else "FOR UPDATE SKIP LOCKED"
+
+    async def claim(tx: Transaction) -> List[PendingWithdrawal]:
+        return await tx.fetchall(
+            f"""
+            UPDATE lnurlFlip.pending_withdrawals
+            SET status = 'processing', claimed_time = :now, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM lnurlFlip.pending_withdrawals
+                WHERE status = 'pending'
+                ORDER BY created_time
+                LIMIT :limit
+                {skip_locked}
+            )
+            RETURNING *
+            """,
+            {"now": int(time.time()), "limit": limit},
+            PendingWithdrawal
+        )
+
+    return await write(claim)
+
+async def complete_withdrawal(withdrawal: PendingWithdrawal) -> Optional[LnurlFlip]:
+    """
+    Mark a claimed withdrawal completed, debit the flip (and its paying pool
+    member) and roll it into the daily stats in one transaction, so the
+    reservation and the debit never both count (or both vanish).
+    """
+    values = settle_values(withdrawal.flip_id, -withdrawal.amount_msat)
+    values["member_id"] = withdrawal.member_id or withdrawal.flip_id
+    async def complete(tx: Transaction) -> Optional[LnurlFlip]:
+        marked = await tx.execute(
+            """
+            UPDATE lnurlFlip.pending_withdrawals
+            SET status = 'completed', completed_time = :now, error = NULL
+            WHERE id = :id AND status = 'processing'
+            """,
+            {"id": withdrawal.id, "now": int(time.time())}
+        )
+        if marked.rowcount == 0:
+            return None
+        await tx.execute(
+            LEDGER_INSERT,
+            {
+                **values,
+                "payment_hash": f"withdrawal:{withdrawal.id}",
+                "time": int(time.time())
+            }
+        )
+        # The reservation just ended, so there is nothing left to check against
+        updated = await tx.fetchone(
+            settle_update_sql(-withdrawal.amount_msat, check_balance=False),
+            values,
+            LnurlFlip
+        )
+        if updated:
+            await tx.execute(
+                f"""
+                INSERT INTO lnurlFlip.flip_daily_stats {DAILY_STATS_COLUMNS}
+                {DAILY_STATS_SELECT} FROM lnurlFlip.maintable WHERE id = :flip_id
+                {DAILY_STATS_CONFLICT}
+                """,
+                values
+            )
+            await tx.execute(pool_member_settle_sql(), values)
+            await enqueue_flip_events(
+                tx, updated, -withdrawal.amount_msat, withdrawal.payment_hash
+            )
+        return updated
+
+    return await write(complete)
+
+async def fail_withdrawal(withdrawal_id: str, error: str) -> None:
+    """Record a failed withdrawal; its reservation is released with it."""
+    await execute_write(
+        """
+        UPDATE lnurlFlip.pending_withdrawals
+        SET status = 'failed', completed_time = :now, error = :error
+        WHERE id = :id
+        """,
+        {"id": withdrawal_id, "now": int(time.time()), "error": error[:500]}
+    )
+
+async def requeue_withdrawal(withdrawal_id: str) -> None:
+    """Put a claimed withdrawal back on the queue."""
+    await execute_write(
+        """
+        UPDATE lnurlFlip.pending_withdrawals
+        SET status = 'pending', claimed_time = NULL
+        WHERE id = :id AND status = 'processing'
+        """,
+        {"id": withdrawal_id}
+    )
+
+async def get_stale_withdrawals(claimed_before: int) -> List[PendingWithdrawal]:
+    """Get withdrawals claimed before `claimed_before` that never reached an outcome."""
+    return await db.fetchall(
+        """
+        SELECT * FROM lnurlFlip.pending_withdrawals
+        WHERE status = 'processing'
+        AND claimed_time < :claimed_before
+        """,
+        {"claimed_before": claimed_before},
+        PendingWithdrawal
+    )
+
+
+async def get_job_state(name: str) -> Optional[str]:
+    """Get a persisted value for a background job (e.g. a watermark)."""
+    row = await db.fetchone(
+        "SELECT value FROM lnurlFlip.job_state WHERE name = :name",
+        {"name": name}
+    )
+    return row["value"] if row else None
+
+async def set_job_state(name: str, value: str) -> None:
+    """Persist a value for a background job, replacing the previous one."""
+    await execute_write(
+        """
+        INSERT INTO lnurlFlip.job_state (name, value, updated_time)
+        VALUES (:name, :value, :now)
+        ON CONFLICT (name) DO UPDATE SET
+            value = excluded.value,
+            updated_time = excluded.updated_time
+        """,
+        {"name": name, "value": value, "now": int(time.time())}
+    )
+
+async def get_ledger_drift(flip_ids: Optional[List[str]] = None) -> List[dict]:
+    """
+    Flips whose total_msat differs from the net of their ledger entries.
+    Pass flip_ids to check only those flips (the ledger is read through its
+    flip_id index); without them every flip is checked.
+    """
+    values: dict = {}
+    where = ""
+    if flip_ids is not None:
+        if not flip_ids:
+            return []
+        values = {f"flip_{i}": flip_id for i, flip_id in enumerate(flip_ids)}
+        where = f"WHERE id IN ({','.join(f':{key}' for key in values)})"
+    rows = await db.fetchall(
+        f"""
+        SELECT id AS flip_id, total_msat, ledger_msat
+        FROM (
+            SELECT id, total_msat,
+            (
+                SELECT COALESCE(SUM(amount_msat), 0)
+                FROM lnurlFlip.payment_ledger
+                WHERE flip_id = maintable.id
+            ) AS ledger_msat
+            FROM lnurlFlip.maintable
+            {where}
+        ) balances
+        WHERE total_msat <> ledger_msat
+        """,
+        values
+    )
+    return [dict(row) for row in rows]
+
+async def add_scan_counts(counts: Dict[str, dict]) -> None:
+    """
+    Add in-memory scan counts ({flip_id: {scans, pay_scans, withdraw_scans,
+    last_scan_time}}) to scan_counters with multi-row upserts. All chunks
+    commit together, so a failed flush can put every count back.
+    """
+    items = list(counts.items())
+
+    async def upsert(tx: Transaction):
+        for start in range(0, len(items), SCAN_UPSERT_CHUNK):
+            chunk = items[start:start + SCAN_UPSERT_CHUNK]
+            values: dict = {}
+            rows = []
+            for i, (flip_id, count) in enumerate(chunk):
+                rows.append(f"(:flip_{i}, :scans_{i}, :pay_{i}, :withdraw_{i}, :time_{i})")
+                values.update({
+                    f"flip_{i}": flip_id,
+                    f"scans_{i}": count["scans"],
+                    f"pay_{i}": count["pay_scans"],
+                    f"withdraw_{i}": count["withdraw_scans"],
+                    f"time_{i}": count["last_scan_time"],
+                })
+            await tx.execute(
+                f"""
+                INSERT INTO lnurlFlip.scan_counters
+                (flip_id, scans, pay_scans, withdraw_scans, last_scan_time)
+                VALUES {", ".join(rows)}
+                ON CONFLICT (flip_id) DO UPDATE SET
+                    scans = scan_counters.scans + excluded.scans,
+                    pay_scans = scan_counters.pay_scans + excluded.pay_scans,
+                    withdraw_scans = scan_counters.withdraw_scans + excluded.withdraw_scans,
+                    last_scan_time = {greatest()}(
+                        COALESCE(scan_counters.last_scan_time, 0), excluded.last_scan_time
+                    )
+                """,
+                values
+            )
+
+    await write(upsert)
+
+async def get_scan_counts(flip_id: str) -> dict:
+    """Get the flushed scan counters for a flip (zeros if it was never scanned)."""
+    row = await db.fetchone(
+        """
+        SELECT scans, pay_scans, withdraw_scans, last_scan_time
+        FROM lnurlFlip.scan_counters
+        WHERE flip_id = :flip_id
+        """,
+        {"flip_id": flip_id}
+    )
+    if not row:
+        return {"scans": 0, "pay_scans": 0, "withdraw_scans": 0, "last_scan_time": None}
+    return dict(row)
+
+async def acquire_lease(name: str, holder: str, ttl_ms: int) -> bool:
+    """
+    Take or renew the lease on a background job. Succeeds when nobody holds
+    it, the holder already has it, or the current lease has expired, and
+    extends it to ttl_ms from now. The check and the update are one statement,
+    so two nodes can never both succeed.
+    """
+    now = int(time.time() * 1000)
+
+    async def acquire(tx: Transaction):
+        return await tx.fetchone(
+            """
+            INSERT INTO lnurlFlip.job_leases (name, holder, expires_ms, acquired_ms)
+            VALUES (:name, :holder, :expires, :now)
+            ON CONFLICT (name) DO UPDATE SET
+                holder = excluded.holder,
+                expires_ms = excluded.expires_ms,
+                acquired_ms = CASE WHEN job_leases.holder = excluded.holder
+                    THEN job_leases.acquired_ms ELSE excluded.acquired_ms END
+            WHERE job_leases.holder = excluded.holder OR job_leases.expires_ms < :now
+            RETURNING holder
+            """,
+            {"name": name, "holder": holder, "expires": now + ttl_ms, "now": now}
+        )
+
+    return await write(acquire) is not None
+
+async def release_lease(name: str, holder: str) -> None:
+    """Give up a lease so another node can take the job over right away."""
+    await execute_write(
+        "DELETE FROM lnurlFlip.job_leases WHERE name = :name AND holder = :holder",
+        {"name": name, "holder": holder}
+    )
+
+async def get_lease_holder(name: str) -> Optional[str]:
+    """The node holding an unexpired lease on a job, if any."""
+    row = await db.fetchone(
+        """
+        SELECT holder FROM lnurlFlip.job_leases
+        WHERE name = :name AND expires_ms >= :now
+        """,
+        {"name": name, "now": int(time.time() * 1000)}
+    )
+    return row["holder"] if row else None
+
+
+POOL_MEMBERS_SELECT = f"""
+    SELECT {POOL_MEMBER_COLUMNS},
+    (
+        SELECT COALESCE(SUM(amount_msat), 0)
+        FROM lnurlFlip.pending_withdrawals
+        WHERE member_id = pool_members.id
+        AND status IN {RESERVED_STATUSES}
+    ) AS reserved_msat
+    FROM lnurlFlip.pool_members
+"""
+
+async def get_pool_members(flip_id: str) -> List[PoolMember]:
+    """A flip's pool members with their reserved withdrawals, in one query."""
+    return await db.fetchall(
+        f"{POOL_MEMBERS_SELECT} WHERE flip_id = :flip_id ORDER BY created_time, id",
+        {"flip_id": flip_id},
+        PoolMember
+    )
+
+async def get_pool_members_by_flip(flip_ids: List[str]) -> Dict[str, List[PoolMember]]:
+    """Pool members of many flips in one query, keyed by flip id (every id present)."""
+    members: Dict[str, List[PoolMember]] = {flip_id: [] for flip_id in flip_ids}
+    if not flip_ids:
+        return members
+    values = {f"flip_{i}": flip_id for i, flip_id in enumerate(flip_ids)}
+    placeholders = ",".join(f":{key}" for key in values)
+    rows = await db.fetchall(
+        f"{POOL_MEMBERS_SELECT} WHERE flip_id IN ({placeholders}) ORDER BY created_time, id",
+        values,
+        PoolMember
+    )
+    for member in rows:
+        members[member.flip_id].append(member)
+    return members
+
+async def get_pool_member(member_id: str) -> Optional[PoolMember]:
+    return await db.fetchone(
+        f"SELECT {POOL_MEMBER_COLUMNS} FROM lnurlFlip.pool_members WHERE id = :id",
+        {"id": member_id},
+        PoolMember
+    )
+
+async def set_pool_policy(flip_id: str, policy: Optional[str]) -> None:
+    """
+    Set or clear a flip's pool policy. The first time a pool is turned on
+    the flip's own wallet and links become its first member, holding the
+    whole current balance. Withdrawals queued without a pool are paid from
+    the flip's own wallet, so turning one on assigns them to the own member,
+    whose available balance then counts their reservations.
+    """
+    async def apply(tx: Transaction):
+        await tx.execute(
+            "UPDATE lnurlFlip.maintable SET pool_policy = :policy WHERE id = :id",
+            {"id": flip_id, "policy": policy}
+        )
+        if policy:
+            await tx.execute(
+                """
+                INSERT INTO lnurlFlip.pool_members
+                (id, flip_id, wallet, selectedLnurlp, selectedLnurlw, balance_msat, created_time)
+                SELECT id, id, wallet, selectedLnurlp, selectedLnurlw, total_msat, :now
+                FROM lnurlFlip.maintable WHERE id = :id
+                ON CONFLICT (id) DO NOTHING
+                """,
+                {"id": flip_id, "now": int(time.time())}
+            )
+            await tx.execute(
+                f"""
+                UPDATE lnurlFlip.pending_withdrawals SET member_id = flip_id
+                WHERE flip_id = :id AND member_id IS NULL
+                AND status IN {RESERVED_STATUSES}
+                """,
+                {"id": flip_id}
+            )
+
+    await write(apply)
+
+async def add_pool_member(flip_id: str, data: CreatePoolMemberData) -> PoolMember:
+    member = PoolMember(
+        id=urlsafe_short_hash(),
+        flip_id=flip_id,
+        wallet=data.wallet,
+        selectedLnurlp=data.selectedLnurlp,
+        selectedLnurlw=data.selectedLnurlw,
+        created_time=int(time.time()),
+    )
+    await execute_write(
+        """
+        INSERT INTO lnurlFlip.pool_members
+        (id, flip_id, wallet, selectedLnurlp, selectedLnurlw, balance_msat, created_time)
+        VALUES (:id, :flip_id, :wallet, :selectedLnurlp, :selectedLnurlw, 0, :created_time)
+        """,
+        member.dict(exclude={"balance_msat", "reserved_msat"})
+    )
+    return member
+
+async def remove_pool_member(flip_id: str, member_id: str) -> bool:
+    """
+    Remove a pool member that holds no balance and has no queued
+    withdrawals. The flip's own member cannot be removed.
+    """
+    result = await execute_write(
+        f"""
+        DELETE FROM lnurlFlip.pool_members
+        WHERE id = :member_id AND flip_id = :flip_id AND id != flip_id
+        AND balance_msat = 0
+        AND NOT EXISTS (
+            SELECT 1 FROM lnurlFlip.pending_withdrawals
+            WHERE member_id = :member_id AND status IN {RESERVED_STATUSES}
+        )
+        """,
+        {"member_id": member_id, "flip_id": flip_id}
+    )
+    return result.rowcount > 0
+
+
+async def get_backfill_progress() -> List[dict]:
+    """Progress of every backfill that has started."""
+    rows = await db.fetchall(
+        """
+        SELECT name, last_key, rows_done, done, updated_time
+        FROM lnurlFlip.backfill_progress ORDER BY name
+        """
+    )
+    return [dict(row, done=bool(row["done"])) for row in rows]
+
+async def save_backfill_progress(
+    name: str, last_key: Optional[str], rows_done: int, done: bool
+) -> None:
+    await execute_write(
+        """
+        INSERT INTO lnurlFlip.backfill_progress (name, last_key, rows_done, done, updated_time)
+        VALUES (:name, :last_key, :rows_done, :done, :now)
+        ON CONFLICT (name) DO UPDATE SET
+            last_key = excluded.last_key,
+            rows_done = excluded.rows_done,
+            done = excluded.done,
+            updated_time = excluded.updated_time
+        """,
+        {
+            "name": name,
+            "last_key": last_key,
+            "rows_done": rows_done,
+            "done": done,
+            "now": int(time.time()),
+        }
+    )
+
+async def get_withdrawals_without_hash(after_id: Optional[str], limit: int) -> List[dict]:
+    """Withdrawals queued before payment_hash was stored, in id order after `after_id`."""
+    rows = await db.fetchall(
+        """
+        SELECT id, payment_request FROM lnurlFlip.pending_withdrawals
+        WHERE payment_hash IS NULL AND id > :after_id
+        ORDER BY id
+        LIMIT :limit
+        """,
+        {"after_id": after_id or "", "limit": limit}
+    )
+    return [dict(row) for row in rows]
+
+async def set_withdrawal_payment_hashes(hashes: List[Tuple[str, str]]) -> int:
+    """
+    Store decoded payment hashes ([(withdrawal id, hash)]) in one transaction.
+    A hash another row already has is left out, as the unique index requires.
+    """
+    async def mutation(tx: Transaction) -> int:
+        updated = 0
+        for withdrawal_id, payment_hash in hashes:
+            result = await tx.execute(
+                """
+                UPDATE lnurlFlip.pending_withdrawals SET payment_hash = :payment_hash
+                WHERE id = :id AND payment_hash IS NULL
+                AND NOT EXISTS (
+                    SELECT 1 FROM lnurlFlip.pending_withdrawals
+                    WHERE payment_hash = :payment_hash
+                )
+                """,
+                {"id": withdrawal_id, "payment_hash": payment_hash}
+            )
+            updated += result.rowcount
+        return updated
+
+    return await write(mutation)
+
+
+async def claim_webhook_batch(limit: int, stale_before_ms: int) -> List[dict]:
+    """
+    Claim up to `limit` due webhook events, all for the endpoint with the
+    oldest due event, so they go out as one request. Events left 'sending'
+    by a node that died are due again once claimed before stale_before_ms.
+    """
+    skip_locked = "" if db.type == "SQLITE" else "FOR UPDATE SKIP LOCKED"
+    due = """(
+        (status = 'pending' AND next_attempt_ms <= :now)
+        OR (status = 'sending' AND claimed_ms < :stale_before)
+    )"""
+
+    async def claim(tx: Transaction) -> List[dict]:
+        rows = await tx.fetchall(
+            f"""
+            UPDATE lnurlFlip.webhook_outbox
+            SET status = 'sending', claimed_ms = :now, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM lnurlFlip.webhook_outbox
+                WHERE {due} AND url = (
+                    SELECT url FROM lnurlFlip.webhook_outbox
+                    WHERE {due}
+                    ORDER BY next_attempt_ms
+                    LIMIT 1
+                )
+                ORDER BY created_time
+                LIMIT :limit
+                {skip_locked}
+            )
+            RETURNING id, url, payload, attempts, created_time
+            """,
+            {"now": int(time.time() * 1000), "stale_before": stale_before_ms, "limit": limit}
+        )
+        return sorted((dict(row) for row in rows), key=lambda row: row["created_time"])
+
+    return await write(claim)
+
+async def delete_webhook_events(event_ids: List[str]) -> None:
+    """Drop delivered events."""
+    values = {f"id_{i}": event_id for i, event_id in enumerate(event_ids)}
+    placeholders = ",".join(f":{key}" for key in values)
+    await execute_write(
+        f"DELETE FROM lnurlFlip.webhook_outbox WHERE id IN ({placeholders})", values
+    )
+
+async def retry_webhook_events(
+    event_ids: List[str],
+    next_attempt_ms: int,
+    error: Optional[str],
+    max_attempts: int,
+    count_attempt: bool = True
+) -> None:
+    """
+    Put claimed events back for a later attempt. Events out of attempts are
+    kept as 'failed'. Without count_attempt (the endpoint was not even tried)
+    the claim does not use up an attempt.
+    """
+    values: dict = {f"id_{i}": event_id for i, event_id in enumerate(event_ids)}
+    placeholders = ",".join(f":{key}" for key in values)
+    values.update({"next": next_attempt_ms, "error": error, "max": max_attempts})
+    attempts = "attempts" if count_attempt else "attempts - 1"
+    await execute_write(
+        f"""
+        UPDATE lnurlFlip.webhook_outbox
+        SET attempts = {attempts},
+        status = CASE WHEN {attempts} >= :max THEN 'failed' ELSE 'pending' END,
+        next_attempt_ms = :next,
+        last_error = COALESCE(:error, last_error)
+        WHERE id IN ({placeholders})
+        """,
+        values
+    )
@@ -0,0 +1,245 @@
+"""
+Latency benchmark for the LNURL hot paths with a networked database.
+
+Drives the redirect, pay callback and withdraw callback endpoints through
+the ASGI app against a scratch SQLite database, with simulated round-trip
+latency added to every extension database checkout and to every LNbits core /
+lnurlp / withdraw lookup (FakeAdapter). Each endpoint is measured twice: with
+the concurrent lookups as shipped ("fanout") and with every asyncio.gather in
+views_api forced to await its arguments one by one ("serial"), which is how
+these paths ran before.
+
+Round trips are jittered (uniform 0.5x-1.5x) with an occasional slow one
+(--spike-rate at --spike-factor x), so the tail percentiles reflect queueing
+behind slow lookups.
+
+Usage:
+
+    python harness/bench_latency.py [--db-ms 5] [--ext-ms 5] [--requests 200]
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from contextlib import asynccontextmanager
+from statistics import quantiles
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from common import load_extension, migrate, prepare_scratch_env, quiet_logs
+
+
+class Latency:
+    """Jittered round-trip delays with occasional spikes."""
+
+    def __init__(self, mean_ms: float, spike_rate: float, spike_factor: float, seed: int):
+        self.mean_s = mean_ms / 1000
+        self.spike_rate = spike_rate
+        self.spike_factor = spike_factor
+        self.rng = random.Random(seed)
+
+    async def wait(self) -> None:
+        if not self.mean_s:
+            return
+        delay = self.mean_s * self.rng.uniform(0.5, 1.5)
+        if self.rng.random() < self.spike_rate:
+            delay *= self.spike_factor
+        await asyncio.sleep(delay)
+
+
+def make_adapter(latency: Latency, flips: List[dict]):
+    from lnurlFlip.adapters import FakeAdapter
+
+    class LatencyAdapter(FakeAdapter):
+        async def get_pay_link(self, link_id):
+            await latency.wait()
+            return await super().get_pay_link(link_id)
+
+        async def get_withdraw_link(self, link_id):
+            await latency.wait()
+            return await super().get_withdraw_link(link_id)
+
+        async def get_wallet(self, wallet_id):
+            await latency.wait()
+            return await super().get_wallet(wallet_id)
+
+        async def create_invoice(self, **kwargs):
+            await latency.wait()
+            return await super().create_invoice(**kwargs)
+
+    pay_links = {}
+    withdraw_links = {}
+    for flip in flips:
+        pay_links[flip["selectedLnurlp"]] = SimpleNamespace(
+            id=flip["selectedLnurlp"], wallet=flip["wallet"], description="bench",
+            min=1, max=100000, lnurl=None,
+        )
+        withdraw_links[flip["selectedLnurlw"]] = SimpleNamespace(
+            id=flip["selectedLnurlw"], wallet=flip["wallet"], title="bench",
+            min_withdrawable=1, max_withdrawable=100000, uses=1000, wait_time=0,
+            is_unique=False, unique_hash="", k1="", open_time=0, used=0,
+            usescsv="", webhook_url=None, custom_url=None,
+        )
+    wallets = {
+        "bench-wallet": SimpleNamespace(
+            id="bench-wallet", name="bench", balance_msat=10**12
+        )
+    }
+    return LatencyAdapter(pay_links, withdraw_links, wallets)
+
+
+def add_db_latency(db, latency: Latency) -> None:
+    """Charge one round trip per connection checkout, inside the DB lock."""
+    connect = db.connect
+
+    @asynccontextmanager
+    async def delayed_connect():
+        async with connect() as conn:
+            await latency.wait()
+            yield conn
+
+    db.connect = delayed_connect
+
+
+async def serial_gather(*aws, return_exceptions: bool = False):
+    results = []
+    for aw in aws:
+        try:
+            results.append(await aw)
+        except Exception as exc:
+            if not return_exceptions:
+                raise
+            results.append(exc)
+    return results
+
+
+async def create_flips(count: int) -> List[dict]:
+    from lnurlFlip.crud import create_lnurlflip, settle_flip_payment
+    from lnurlFlip.models import LnurlFlip
+
+    flips = []
+    for i in range(count):
+        flip = LnurlFlip(
+            id=f"bench{i:04d}",
+            name=f"bench {i}",
+            wallet="bench-wallet",
+            selectedLnurlp=f"lnurlp{i}",
+            selectedLnurlw=f"lnurlw{i}",
+        )
+        await create_lnurlflip(flip)
+        # Odd flips hold a balance, so the redirect resolves to withdraw mode
+        if i % 2:
+            await settle_flip_payment(flip.id, 10**9, payment_hash=f"{flip.id}-funding")
+        flips.append(flip.dict())
+    return flips
+
+
+async def make_invoices(count: int, amount_sat: int) -> List[str]:
+    from lnbits.wallets.fake import FakeWallet
+
+    wallet = FakeWallet()
+    return [
+        (await wallet.create_invoice(amount_sat)).payment_request for _ in range(count)
+    ]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    cuts = quantiles(samples, n=100)
+    return {
+        "p50": round(cuts[49] * 1000, 2),
+        "p95": round(cuts[94] * 1000, 2),
+        "p99": round(cuts[98] * 1000, 2),
+    }
+
+
+async def run(args) -> Dict[str, Dict[str, dict]]:
+    import httpx
+    from fastapi import FastAPI
+
+    from lnurlFlip import lnurlFlip_ext, views_api
+    from lnurlFlip.adapters import set_adapter
+    from lnurlFlip.crud import db
+
+    await migrate(db)
+    flips = await create_flips(args.flips)
+    withdraw_flips = [f for i, f in enumerate(flips) if i % 2]
+    invoices = await make_invoices(2 * args.requests, 1)
+
+    set_adapter(make_adapter(Latency(args.ext_ms, args.spike_rate, args.spike_factor, 1), flips))
+    add_db_latency(db, Latency(args.db_ms, args.spike_rate, args.spike_factor, 2))
+
+    app = FastAPI()
+    app.include_router(lnurlFlip_ext)
+    transport = httpx.ASGITransport(app=app)
+    rng = random.Random(args.seed)
+
+    def redirect():
+        return f"/lnurlFlip/api/v1/redirect/{rng.choice(flips)['id']}"
+
+    def pay_callback():
+        return f"/lnurlFlip/api/v1/lnurl/cb/{rng.choice(flips)['id']}?amount=1000&comment=bench"
+
+    def withdraw_callback():
+        flip = rng.choice(withdraw_flips)
+        return f"/lnurlFlip/api/v1/lnurl/withdraw/cb/{flip['id']}?k1=bench&pr={invoices.pop()}"
+
+    endpoints = {
+        "redirect": redirect,
+        "pay_callback": pay_callback,
+        "withdraw_callback": withdraw_callback,
+    }
+
+    results: Dict[str, Dict[str, dict]] = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for mode in ("serial", "fanout"):
+            views_api.asyncio = (
+                SimpleNamespace(gather=serial_gather) if mode == "serial" else asyncio
+            )
+            for name, make_url in endpoints.items():
+                samples: List[float] = []
+                semaphore = asyncio.Semaphore(args.concurrency)
+
+                async def one():
+                    async with semaphore:
+                        started = time.perf_counter()
+                        response = await client.get(make_url())
+                        samples.append(time.perf_counter() - started)
+                        body = response.json()
+                        if response.status_code != 200 or body.get("status") == "ERROR":
+                            raise RuntimeError(f"{name}: {response.status_code} {body}")
+
+                await asyncio.gather(*(one() for _ in range(args.requests)))
+                results.setdefault(name, {})[mode] = percentiles(samples)
+    views_api.asyncio = asyncio
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--db-ms", type=float, default=5.0, help="mean DB round trip")
+    parser.add_argument("--ext-ms", type=float, default=5.0, help="mean core/lnurlp/withdraw lookup")
+    parser.add_argument("--spike-rate", type=float, default=0.05)
+    parser.add_argument("--spike-factor", type=float, default=5.0)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and mode")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--flips", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    prepare_scratch_env()
+    load_extension()
+    quiet_logs()
+
+    results = asyncio.run(run(args))
+
+    print(f"{'endpoint':<18} {'mode':<7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, modes in results.items():
+        for mode, cuts in modes.items():
+            print(f"{name:<18} {mode:<7} {cuts['p50']:>8} {cuts['p95']:>8} {cuts['p99']:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Microbenchmark: row -> JSON response on the read hot paths.
+
+Compares the previous path (LnurlFlip(**row) -> .dict() -> FastAPI's
+jsonable_encoder + JSONResponse) with the LnurlFlipRecord + FastJSONResponse
+path, for the detail endpoint (one row) and the list endpoint (many rows).
+Reports CPU time and peak traced allocation per request.
+
+Usage:
+
+    python harness/bench_serialization.py [--rows 50] [--iterations 5000]
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from typing import Callable, List, Optional
+
+from common import load_extension, prepare_scratch_env
+
+
+def make_rows(count: int) -> List[dict]:
+    return [
+        {
+            "id": f"flip{i:06d}",
+            "name": f"Flip number {i}",
+            "wallet": "a" * 32,
+            "selectedLnurlp": f"lnurlp{i}",
+            "selectedLnurlw": f"lnurlw{i}",
+            "total_msat": i * 1000,
+            "uses": i % 7,
+            "pool_policy": "round_robin" if i % 4 == 0 else None,
+            "webhook_url": f"https://example.com/hooks/{i}" if i % 3 == 0 else None,
+        }
+        for i in range(count)
+    ]
+
+
+def measure(fn: Callable[[], object], iterations: int) -> dict:
+    fn()  # warm up
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    cpu_us = (time.process_time() - started) / iterations * 1e6
+
+    tracemalloc.start()
+    fn()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_us": round(cpu_us, 2), "peak_bytes": peak}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=50, help="rows in the list response")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    prepare_scratch_env()
+    load_extension()
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from lnurlFlip.models import LnurlFlip, LnurlFlipRecord
+    from lnurlFlip.utils import FastJSONResponse
+
+    rows = make_rows(args.rows)
+    row = rows[0]
+
+    def detail_model():
+        data = LnurlFlip(**row).dict()
+        data["balance"] = 0
+        data["comment_count"] = 0
+        return JSONResponse(jsonable_encoder(data)).body
+
+    def detail_record():
+        data = LnurlFlipRecord.from_row(row)._asdict()
+        data["balance"] = 0
+        data["comment_count"] = 0
+        return FastJSONResponse(data).body
+
+    def list_model():
+        result = []
+        for r in rows:
+            data = LnurlFlip(**r).dict()
+            data["comment_count"] = 0
+            result.append(data)
+        return JSONResponse(jsonable_encoder(result)).body
+
+    def list_record():
+        result = []
+        for r in rows:
+            data = LnurlFlipRecord.from_row(r)._asdict()
+            data["comment_count"] = 0
+            result.append(data)
+        return FastJSONResponse(result).body
+
+    list_iterations = max(1, args.iterations // 10)
+    results = {
+        "detail": (measure(detail_model, args.iterations), measure(detail_record, args.iterations)),
+        f"list[{args.rows}]": (measure(list_model, list_iterations), measure(list_record, list_iterations)),
+    }
+
+    print(f"{'case':<12} {'path':<8} {'cpu us/req':>12} {'peak bytes':>12}")
+    for case, (before, after) in results.items():
+        print(f"{case:<12} {'model':<8} {before['cpu_us']:>12} {before['peak_bytes']:>12}")
+        print(f"{case:<12} {'record':<8} {after['cpu_us']:>12} {after['peak_bytes']:>12}")
+        print(f"{'':<12} {'speedup':<8} {before['cpu_us'] / after['cpu_us']:>11.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
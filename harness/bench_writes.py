@@ -0,0 +1,153 @@
+"""
+Write-load benchmark for the single-writer mode (writer.py).
+
+Runs a concurrent burst of the extension's hot writes against a scratch
+SQLite file: listener settlements, pay-callback comment inserts and
+withdraw-callback reservations. The burst runs once with every write in its
+own transaction and once through the single writer, on separate flips in the
+same database. Reports throughput and latency percentiles, and checks that
+both modes end with the same balances and reservations and that the ledger
+has no drift.
+
+Usage:
+
+    python harness/bench_writes.py [--ops 3000] [--concurrency 32]
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from statistics import quantiles
+from typing import Callable, Dict, List, Optional
+
+from common import load_extension, migrate, prepare_scratch_env, quiet_logs
+
+FUNDED_MSAT = 10**9
+
+
+async def create_flips(prefix: str, count: int) -> List[str]:
+    from lnurlFlip.crud import create_lnurlflip, settle_flip_payment
+    from lnurlFlip.models import LnurlFlip
+
+    flip_ids = []
+    for i in range(count):
+        flip_id = f"{prefix}{i:04d}"
+        await create_lnurlflip(
+            LnurlFlip(
+                id=flip_id,
+                name=f"{prefix} {i}",
+                wallet="bench-wallet",
+                selectedLnurlp=f"lnurlp{i}",
+                selectedLnurlw=f"lnurlw{i}",
+            )
+        )
+        await settle_flip_payment(flip_id, FUNDED_MSAT, payment_hash=f"{flip_id}-funding")
+        flip_ids.append(flip_id)
+    return flip_ids
+
+
+def workload(prefix: str, flip_ids: List[str], ops: int, seed: int) -> List[Callable]:
+    """The same mix of writes for every mode, keyed by `prefix`."""
+    from lnurlFlip.crud import reserve_withdrawal, save_invoice_comment, settle_flip_payment
+
+    rng = random.Random(seed)
+    jobs = []
+    for i in range(ops):
+        index = rng.randrange(len(flip_ids))
+        flip_id = flip_ids[index]
+        kind = rng.random()
+        if kind < 0.6:
+            jobs.append(lambda f=flip_id, i=i: settle_flip_payment(
+                f, 1000, payment_hash=f"{prefix}-pay-{i}"
+            ))
+        elif kind < 0.9:
+            jobs.append(lambda f=flip_id: save_invoice_comment(f, "bench", 1000))
+        else:
+            jobs.append(lambda f=flip_id, i=i: reserve_withdrawal(
+                f, 1000, f"lnbench{prefix}{i}", f"{prefix}-withdraw-{i}"
+            ))
+    return jobs
+
+
+async def run_mode(jobs: List[Callable], concurrency: int) -> Dict[str, float]:
+    samples: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(job):
+        async with semaphore:
+            started = time.perf_counter()
+            await job()
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(job) for job in jobs))
+    elapsed = time.perf_counter() - started
+    cuts = quantiles(samples, n=100)
+    return {
+        "ops_per_s": round(len(jobs) / elapsed, 1),
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+    }
+
+
+async def outcome(flip_ids: List[str]) -> List[tuple]:
+    from lnurlFlip.crud import db
+
+    rows = []
+    for flip_id in flip_ids:
+        row = await db.fetchone(
+            """
+            SELECT total_msat,
+            (SELECT COUNT(*) FROM lnurlFlip.pending_withdrawals WHERE flip_id = :id) AS reserved,
+            (SELECT COUNT(*) FROM lnurlFlip.invoice_comments WHERE flip_id = :id) AS comments
+            FROM lnurlFlip.maintable WHERE id = :id
+            """,
+            {"id": flip_id},
+        )
+        rows.append((row["total_msat"], row["reserved"], row["comments"]))
+    return rows
+
+
+async def run(args) -> int:
+    from lnurlFlip.crud import db, get_ledger_drift, writer
+
+    await migrate(db)
+    results = {}
+    outcomes = {}
+    for mode in ("direct", "single_writer"):
+        writer.enabled = mode == "single_writer"
+        flip_ids = await create_flips(mode[:6], args.flips)
+        jobs = workload(mode, flip_ids, args.ops, args.seed)
+        results[mode] = await run_mode(jobs, args.concurrency)
+        outcomes[mode] = await outcome(flip_ids)
+    writer.enabled = False
+
+    print(f"{'mode':<14} {'ops/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, row in results.items():
+        print(f"{mode:<14} {row['ops_per_s']:>8} {row['p50_ms']:>8} {row['p99_ms']:>8}")
+    print(f"single writer: {writer.writes} writes in {writer.batches} batches")
+
+    drift = await get_ledger_drift()
+    same = outcomes["direct"] == outcomes["single_writer"]
+    print(f"same outcome: {same}, ledger drift: {len(drift)}")
+    return 0 if same and not drift else 1
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--ops", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--flips", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    prepare_scratch_env()
+    load_extension()
+    quiet_logs()
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Shared setup for the local harness scripts.
+
+The harness runs the extension outside a full LNbits server. It points LNbits
+at a scratch data folder *before* anything from lnbits is imported, loads
+this directory's parent as the `lnurlFlip` package (whatever the checkout is
+called) and applies the migrations to a fresh database.
+"""
+
+import importlib
+import importlib.util
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+EXT_DIR = Path(__file__).resolve().parent.parent
+
+
+def prepare_scratch_env(
+    data_folder: Optional[str] = None, database_url: Optional[str] = None
+) -> str:
+    """Point LNbits at a scratch database. Must run before importing lnbits."""
+    if "lnbits.settings" in sys.modules:
+        raise RuntimeError("prepare_scratch_env() must run before lnbits is imported")
+    data_folder = data_folder or tempfile.mkdtemp(prefix="lnurlflip-harness-")
+    os.makedirs(data_folder, exist_ok=True)
+    os.environ["LNBITS_DATA_FOLDER"] = data_folder
+    # An empty URL selects SQLite in the data folder.
+    os.environ["LNBITS_DATABASE_URL"] = database_url or ""
+    return data_folder
+
+
+def load_extension():
+    """Import the extension directory as the `lnurlFlip` package."""
+    if "lnurlFlip" in sys.modules:
+        return sys.modules["lnurlFlip"]
+    spec = importlib.util.spec_from_file_location(
+        "lnurlFlip", EXT_DIR / "__init__.py", submodule_search_locations=[str(EXT_DIR)]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["lnurlFlip"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+async def migrate(db) -> None:
+    """Apply every mNNN_* migration, in order, to a fresh database."""
+    migrations = importlib.import_module("lnurlFlip.migrations")
+    steps = sorted(
+        (name, fn)
+        for name, fn in vars(migrations).items()
+        if name[:1] == "m" and name[1:4].isdigit() and callable(fn)
+    )
+    for _name, fn in steps:
+        await fn(db)
+
+
+def quiet_logs(level: str = "WARNING") -> None:
+    """Drop per-payment log lines so they don't dominate timings."""
+    import logging
+
+    from loguru import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level=level)
+    # views_api also logs through the standard library
+    logging.disable(getattr(logging, level) - 1)
@@ -0,0 +1,246 @@
+"""
+Deterministic payment-event replay.
+
+Feeds a recorded or synthetic stream of paid-invoice events through
+tasks.on_invoice_paid against a scratch database as fast as possible, then
+reports throughput and the final per-flip balances, checked against expected
+values.
+
+Each event is one JSON object per line:
+
+    {"amount": 21000, "extra": {"tag": "ext_lnurlflip", "flip_id": "abc", ...}}
+
+`amount` is in msats; withdrawals carry `"lnurlwithdraw": true` in `extra`,
+exactly as api_withdraw_callback attaches it. Optional keys: `checking_id`,
+`wallet_id`.
+
+With --drop-ratio, that share of the pay events never reaches the listener
+(as if it was down) and tasks.reconcile_payments has to recover them from a
+FakeAdapter holding every paid invoice, including the ones already applied.
+
+Usage:
+
+    python harness/replay.py events.jsonl [--expected expected.json]
+    python harness/replay.py --synthetic 10000 --flips 20 --seed 1
+    python harness/replay.py --synthetic 10000 --drop-ratio 0.1
+
+Exits non-zero when any final balance differs from the expected value or the
+ledger has drifted from a balance.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
+
+from common import load_extension, migrate, prepare_scratch_env, quiet_logs
+
+
+def synthetic_events(
+    count: int, flips: int, withdraw_ratio: float = 0.3, seed: int = 0
+) -> List[dict]:
+    """Build a reproducible mix of pay and withdraw events across `flips` flips."""
+    rng = random.Random(seed)
+    flip_ids = [f"flip{i:04d}" for i in range(flips)]
+    events = []
+    for i in range(count):
+        flip_id = rng.choice(flip_ids)
+        amount = rng.randint(1, 500) * 1000
+        if rng.random() < withdraw_ratio:
+            extra = {
+                "tag": "ext_lnurlflip",
+                "lnurlwithdraw": True,
+                "flip_id": flip_id,
+                "selectedLnurlw": f"lnurlw-{flip_id}",
+                "withdraw_id": f"w{i}",
+            }
+        else:
+            extra = {
+                "tag": "ext_lnurlflip",
+                "flip_id": flip_id,
+                "selectedLnurlp": f"lnurlp-{flip_id}",
+                "link": f"lnurlp-{flip_id}",
+                "comment": None,
+            }
+        events.append({"amount": amount, "extra": extra})
+    return events
+
+
+def load_events(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def expected_balances(events: Iterable[dict]) -> Dict[str, dict]:
+    """
+    Model of the listener's settlement rules: payments add, withdrawals are
+    rejected when they exceed the balance, and a withdrawal that empties the
+    flip counts as a use.
+    """
+    flips: Dict[str, dict] = {}
+    for event in events:
+        flip_id = event["extra"].get("flip_id")
+        if not flip_id:
+            continue
+        flip = flips.setdefault(flip_id, {"total_msat": 0, "uses": 0})
+        amount = abs(event["amount"])
+        if event["extra"].get("lnurlwithdraw"):
+            if flip["total_msat"] < amount:
+                continue
+            flip["total_msat"] -= amount
+            if flip["total_msat"] == 0:
+                flip["uses"] += 1
+        else:
+            flip["total_msat"] += amount
+    return flips
+
+
+def to_payment(event: dict, index: int):
+    from lnbits.core.models import Payment
+
+    checking_id = event.get("checking_id") or hashlib.sha256(
+        f"replay-{index}".encode()
+    ).hexdigest()
+    amount = abs(event["amount"])
+    if event["extra"].get("lnurlwithdraw"):
+        amount = -amount
+    return Payment(
+        checking_id=checking_id,
+        payment_hash=checking_id,
+        wallet_id=event.get("wallet_id", "replay-wallet"),
+        amount=amount,
+        fee=0,
+        bolt11="",
+        status="success",
+        tag=event["extra"].get("tag"),
+        extra=event["extra"],
+    )
+
+
+async def create_flips(flip_ids: Iterable[str]) -> None:
+    from lnurlFlip.crud import create_lnurlflip
+    from lnurlFlip.models import LnurlFlip
+
+    for flip_id in flip_ids:
+        await create_lnurlflip(
+            LnurlFlip(
+                id=flip_id,
+                name=f"replay {flip_id}",
+                wallet="replay-wallet",
+                selectedLnurlp=f"lnurlp-{flip_id}",
+                selectedLnurlw=f"lnurlw-{flip_id}",
+            )
+        )
+
+
+async def replay(
+    events: List[dict],
+    expected: Optional[Dict[str, dict]] = None,
+    drop_ratio: float = 0.0,
+    seed: int = 0,
+) -> dict:
+    """Replay `events` through on_invoice_paid and compare the final balances."""
+    from lnurlFlip.adapters import FakeAdapter, set_adapter
+    from lnurlFlip.crud import db, get_ledger_drift, get_lnurlFlip
+    from lnurlFlip.tasks import on_invoice_paid, reconcile_payments
+
+    await migrate(db)
+    flip_ids = sorted({e["extra"]["flip_id"] for e in events if e["extra"].get("flip_id")})
+    await create_flips(flip_ids)
+
+    payments = [to_payment(event, i) for i, event in enumerate(events)]
+    rng = random.Random(seed)
+    dropped = {
+        i for i, event in enumerate(events)
+        if not event["extra"].get("lnurlwithdraw") and rng.random() < drop_ratio
+    }
+    errors = 0
+    started = time.perf_counter()
+    for i, payment in enumerate(payments):
+        if i in dropped:
+            continue
+        try:
+            await on_invoice_paid(payment)
+        except Exception:
+            # The listener logs and carries on; so does the replay.
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    reconciled = None
+    if dropped:
+        adapter = FakeAdapter()
+        adapter.incoming = [p for p in payments if p.amount > 0]
+        set_adapter(adapter)
+        reconciled = (await reconcile_payments(full_drift_check=True))["applied"]
+
+    if expected is None:
+        # Dropped payments land after everything the listener saw
+        order = [e for i, e in enumerate(events) if i not in dropped]
+        order += [events[i] for i in sorted(dropped)]
+        expected = expected_balances(order)
+    balances = {}
+    mismatches = {}
+    for flip_id in flip_ids:
+        flip = await get_lnurlFlip(flip_id)
+        actual = {"total_msat": flip.total_msat, "uses": flip.uses}
+        balances[flip_id] = actual
+        want = expected.get(flip_id)
+        if want is not None and any(actual[k] != want[k] for k in want):
+            mismatches[flip_id] = {"expected": want, "actual": actual}
+    drift = await get_ledger_drift()
+
+    return {
+        "events": len(events),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "events_per_s": round(len(events) / elapsed, 1) if elapsed else None,
+        "dropped": len(dropped),
+        "reconciled": reconciled,
+        "balances": balances,
+        "mismatches": mismatches,
+        "drift": drift,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("events", nargs="?", help="JSON-lines file of paid-invoice events")
+    parser.add_argument("--expected", help="JSON file of {flip_id: {total_msat, uses}}")
+    parser.add_argument("--synthetic", type=int, help="generate N synthetic events instead")
+    parser.add_argument("--flips", type=int, default=10)
+    parser.add_argument("--withdraw-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drop-ratio", type=float, default=0.0,
+                        help="share of pay events the listener misses")
+    parser.add_argument("--data-folder", help="scratch folder (default: a new temp dir)")
+    parser.add_argument("--database-url", help="replay against this database instead")
+    args = parser.parse_args(argv)
+
+    if not args.events and not args.synthetic:
+        parser.error("pass an events file or --synthetic N")
+
+    prepare_scratch_env(args.data_folder, args.database_url)
+    load_extension()
+    quiet_logs()
+
+    if args.synthetic:
+        events = synthetic_events(args.synthetic, args.flips, args.withdraw_ratio, args.seed)
+    else:
+        events = load_events(args.events)
+    expected = None
+    if args.expected:
+        with open(args.expected) as f:
+            expected = json.load(f)
+
+    report = asyncio.run(replay(events, expected, args.drop_ratio, args.seed))
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if report["mismatches"] or report["drift"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Multi-node simulation of the job leases (leases.py).
+
+Runs several simulated nodes in one process, each calling run_exclusive() on
+the same job against one scratch database, and walks through:
+
+1. steady state: exactly one node runs the job;
+2. graceful stop: the leader is stopped and releases its lease;
+3. crash: the leader dies without releasing (its database calls fail first);
+4. partition: the leader stays up but cannot reach the database, so it must
+   stop the job itself before another node may start it; then the partition
+   heals and it rejoins as a standby.
+
+Reports the failover time of each step and exits non-zero if the job ever ran
+on two nodes at once or a failover took longer than its bound.
+
+Usage:
+
+    python harness/simulate_leases.py [--nodes 5] [--ttl 1.0] [--heartbeat 0.2]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import Dict, List, Optional, Set
+
+from common import load_extension, migrate, prepare_scratch_env, quiet_logs
+
+JOB = "simulated_job"
+
+
+class Cluster:
+    def __init__(self, args):
+        self.args = args
+        self.nodes: Dict[str, asyncio.Task] = {}
+        self.partitioned: Set[str] = set()
+        self.running: Optional[str] = None
+        self.starts: List[tuple] = []  # (time, node)
+        self.overlaps = 0
+
+    def patch_leases(self, leases) -> None:
+        """Make a partitioned node's lease calls fail like an unreachable database."""
+        acquire, release = leases.acquire_lease, leases.release_lease
+
+        async def partitioned_acquire(name, holder, ttl_ms):
+            if holder in self.partitioned:
+                raise ConnectionError("database unreachable")
+            return await acquire(name, holder, ttl_ms)
+
+        async def partitioned_release(name, holder):
+            if holder in self.partitioned:
+                raise ConnectionError("database unreachable")
+            return await release(name, holder)
+
+        leases.acquire_lease = partitioned_acquire
+        leases.release_lease = partitioned_release
+
+    async def job(self, node: str) -> None:
+        if self.running is not None:
+            self.overlaps += 1
+            print(f"  OVERLAP: {node} started while {self.running} was running")
+        self.running = node
+        self.starts.append((time.monotonic(), node))
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+        finally:
+            if self.running == node:
+                self.running = None
+
+    def start_node(self, node: str) -> None:
+        from lnurlFlip.leases import run_exclusive
+
+        self.nodes[node] = asyncio.create_task(
+            run_exclusive(
+                JOB,
+                lambda: self.job(node),
+                holder=node,
+                ttl_seconds=self.args.ttl,
+                heartbeat_seconds=self.args.heartbeat,
+            )
+        )
+
+    async def stop_node(self, node: str) -> None:
+        task = self.nodes.pop(node)
+        task.cancel()
+        await asyncio.wait({task})
+
+    async def wait_for_new_leader(self, previous: str, started: float, limit: float):
+        """Seconds until a node other than `previous` starts the job, or None."""
+        deadline = started + limit
+        while time.monotonic() < deadline:
+            for at, node in self.starts:
+                if at >= started and node != previous:
+                    return at - started, node
+            await asyncio.sleep(0.005)
+        return None, None
+
+
+async def run(args) -> int:
+    from lnurlFlip import leases
+    from lnurlFlip.crud import db, get_lease_holder
+
+    await migrate(db)
+    cluster = Cluster(args)
+    cluster.patch_leases(leases)
+    for i in range(args.nodes):
+        cluster.start_node(f"node-{i}")
+
+    failures = 0
+    rows = []
+
+    await asyncio.sleep(args.steady)
+    leaders = {node for _, node in cluster.starts}
+    holder = await get_lease_holder(JOB)
+    ok = len(leaders) == 1 and holder == cluster.running
+    failures += not ok
+    rows.append(("steady state", f"{len(leaders)} leader(s)", "1 leader", ok))
+
+    # Bounds: a standby polls every heartbeat; after a crash the lease must
+    # also run out, and the renewing leader's last write may be a heartbeat late
+    bounds = {
+        "graceful stop": 2 * args.heartbeat + 0.1,
+        "crash": args.ttl + 2 * args.heartbeat + 0.1,
+        "partition": args.ttl + 2 * args.heartbeat + 0.1,
+    }
+    for step, limit in bounds.items():
+        leader = cluster.running
+        started = time.monotonic()
+        if step == "graceful stop":
+            await cluster.stop_node(leader)
+        elif step == "crash":
+            cluster.partitioned.add(leader)
+            await cluster.stop_node(leader)
+        else:
+            cluster.partitioned.add(leader)
+        took, new_leader = await cluster.wait_for_new_leader(leader, started, limit + 1)
+        ok = took is not None and took <= limit and cluster.overlaps == 0
+        failures += not ok
+        shown = f"{took:.3f}s -> {new_leader}" if took is not None else "no failover"
+        rows.append((step, shown, f"<= {limit:.2f}s", ok))
+
+    # Heal the partition: the old leader must come back as a standby
+    partitioned_leader = next(n for n in cluster.partitioned if n in cluster.nodes)
+    cluster.partitioned.discard(partitioned_leader)
+    leader_before = cluster.running
+    await asyncio.sleep(args.ttl + 2 * args.heartbeat)
+    ok = cluster.running == leader_before and cluster.overlaps == 0
+    failures += not ok
+    rows.append(("partition healed", f"leader {cluster.running}", f"leader {leader_before}", ok))
+
+    for node in list(cluster.nodes):
+        await cluster.stop_node(node)
+
+    print(f"{'step':<18} {'result':<26} {'expected':<18} ok")
+    for step, result, expected, ok in rows:
+        print(f"{step:<18} {result:<26} {expected:<18} {'yes' if ok else 'NO'}")
+    print(f"overlapping runs: {cluster.overlaps}")
+    return 1 if failures or cluster.overlaps else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--ttl", type=float, default=1.0, help="lease TTL in seconds")
+    parser.add_argument("--heartbeat", type=float, default=0.2, help="renew/poll interval")
+    parser.add_argument("--steady", type=float, default=2.0, help="seconds of steady state")
+    args = parser.parse_args(argv)
+    if args.nodes < 4:
+        parser.error("--nodes must be at least 4 (three leaders are removed)")
+
+    prepare_scratch_env()
+    load_extension()
+    quiet_logs("ERROR")
+
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
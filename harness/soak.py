@@ -0,0 +1,381 @@
+"""
+Soak test: hours of mixed pay/withdraw traffic, checked for drift.
+
+Runs the extension's background jobs (invoice listener, withdrawal workers,
+stale sweep, reconciliation, scan-counter flush) and drives open-loop traffic
+through the ASGI app against a scratch database: redirects, pay callbacks
+whose invoices are then "paid" onto the listener queue, and withdraw
+callbacks with real FakeWallet invoices that the workers pay out.
+
+Every --interval it records process RSS, live asyncio tasks, GC-tracked
+objects, the listener queue's high-water mark, the withdrawal backlog and
+per-endpoint latency percentiles. After the warm-up, it fails when a resource
+series grows (nearly) monotonically by more than its tolerance, or when an
+endpoint's p95 in the last third of the run exceeds the first third by more
+than --max-latency-drift. With --tracemalloc it also lists the source lines
+whose allocations grew most, to attribute a leak.
+
+Usage:
+
+    python harness/soak.py --duration 4h --interval 60 --rate 20
+    python harness/soak.py --duration 2m --interval 5 --tracemalloc
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from collections import deque
+from statistics import median
+from typing import Dict, List, Optional
+
+from common import load_extension, migrate, prepare_scratch_env, quiet_logs
+
+ENDPOINTS = ("redirect", "pay", "withdraw")
+
+
+def parse_duration(text: str) -> float:
+    """Seconds from "90", "90s", "15m" or "4h"."""
+    units = {"s": 1, "m": 60, "h": 3600}
+    if text[-1:] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    # Peak rather than current RSS where /proc is unavailable (macOS reports bytes)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+
+class Window:
+    """What happened during one interval."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.errors = 0
+        self.shed = 0
+        self.queue_max = 0
+
+
+def monotonic_growth(values: List[float], tolerance: float, ratio: float) -> Optional[str]:
+    """Describe the growth if `values` (nearly) only ever rise and grew past tolerance."""
+    if len(values) < 4:
+        return None
+    rises = sum(later >= earlier for earlier, later in zip(values, values[1:]))
+    growth = values[-1] - values[0]
+    if rises / (len(values) - 1) >= ratio and growth > tolerance:
+        return f"grew {values[0]:g} -> {values[-1]:g} over {len(values)} samples"
+    return None
+
+
+def latency_drift(series: List[float], max_ratio: float, min_ms: float) -> Optional[str]:
+    series = [value for value in series if value is not None]
+    if len(series) < 6:
+        return None
+    third = len(series) // 3
+    early, late = median(series[:third]), median(series[-third:])
+    if late > early * max_ratio and late - early > min_ms:
+        return f"p95 {early:g}ms -> {late:g}ms"
+    return None
+
+
+async def run(args) -> int:
+    import httpx
+    from fastapi import FastAPI
+    from lnbits.core.models import Payment
+    from lnbits.wallets.fake import FakeWallet
+
+    import bench_latency
+    from lnurlFlip import lnurlFlip_ext, tasks
+    from lnurlFlip.adapters import set_adapter
+    from lnurlFlip.crud import db, get_ledger_drift
+    from lnurlFlip.leases import run_exclusive
+
+    # Capture the listener's queue instead of registering it with LNbits core
+    listener_queues: List[asyncio.Queue] = []
+    tasks.register_invoice_listener = lambda queue, name: listener_queues.append(queue)
+
+    await migrate(db)
+    flips = await bench_latency.create_flips(args.flips)
+    withdraw_flips = [flip for i, flip in enumerate(flips) if i % 2]
+    adapter = bench_latency.make_adapter(bench_latency.Latency(args.ext_ms, 0, 1, 1), flips)
+    # The fake keeps a history for assertions; bound it so it doesn't count as a leak
+    adapter.invoices = deque(maxlen=1000)
+    adapter.payments = deque(maxlen=1000)
+    issued: Dict[str, object] = {}
+    create_invoice = adapter.create_invoice
+
+    async def create_and_remember(**kwargs):
+        invoice = await create_invoice(**kwargs)
+        issued[invoice.bolt11] = invoice
+        return invoice
+
+    adapter.create_invoice = create_and_remember
+    set_adapter(adapter)
+
+    background = [asyncio.create_task(tasks.wait_for_paid_invoices())]
+    background += [
+        asyncio.create_task(tasks.run_withdrawal_worker())
+        for _ in range(tasks.WITHDRAWAL_WORKERS)
+    ]
+    background += [
+        asyncio.create_task(run_exclusive("withdraw_sweep", tasks.resolve_stale_withdrawals)),
+        asyncio.create_task(run_exclusive("reconcile", tasks.run_reconciliation)),
+        asyncio.create_task(tasks.run_scan_counter_flush()),
+    ]
+    while not listener_queues:
+        await asyncio.sleep(0.01)
+    listener_queue = listener_queues[0]
+
+    app = FastAPI()
+    app.include_router(lnurlFlip_ext)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://soak")
+    wallet = FakeWallet()
+    rng = random.Random(args.seed)
+    weights = [args.redirect_share, args.pay_share, args.withdraw_share]
+    window = Window()
+
+    async def redirect():
+        flip = rng.choice(flips)
+        response = await client.get(f"/lnurlFlip/api/v1/redirect/{flip['id']}")
+        return response.status_code == 200
+
+    async def pay():
+        flip = rng.choice(flips)
+        response = await client.get(
+            f"/lnurlFlip/api/v1/lnurl/cb/{flip['id']}?amount=1000&comment=soak"
+        )
+        invoice = issued.pop(response.json().get("pr"), None)
+        if response.status_code != 200 or invoice is None:
+            return False
+        listener_queue.put_nowait(
+            Payment(
+                checking_id=invoice.payment_hash,
+                payment_hash=invoice.payment_hash,
+                wallet_id=invoice.wallet_id,
+                amount=invoice.amount * 1000,
+                fee=0,
+                bolt11=invoice.bolt11,
+                status="success",
+                tag="ext_lnurlflip",
+                extra=invoice.extra,
+            )
+        )
+        return True
+
+    async def withdraw():
+        flip = rng.choice(withdraw_flips)
+        pr = (await wallet.create_invoice(1)).payment_request
+        response = await client.get(
+            f"/lnurlFlip/api/v1/lnurl/withdraw/cb/{flip['id']}?k1=soak&pr={pr}"
+        )
+        return response.status_code == 200 and response.json().get("status") == "OK"
+
+    calls = {"redirect": redirect, "pay": pay, "withdraw": withdraw}
+    inflight = asyncio.Semaphore(args.max_inflight)
+    requests = set()
+
+    async def one(name: str):
+        async with inflight:
+            started = time.perf_counter()
+            try:
+                ok = await calls[name]()
+            except Exception:
+                ok = False
+            window.latencies[name].append(time.perf_counter() - started)
+            window.errors += not ok
+
+    async def traffic(until: float):
+        while time.monotonic() < until:
+            await asyncio.sleep(rng.expovariate(args.rate))
+            if inflight.locked():
+                window.shed += 1
+                continue
+            name = rng.choices(ENDPOINTS, weights)[0]
+            request = asyncio.create_task(one(name))
+            requests.add(request)
+            request.add_done_callback(requests.discard)
+
+    async def watch_queue(until: float):
+        while time.monotonic() < until:
+            window.queue_max = max(window.queue_max, listener_queue.qsize())
+            await asyncio.sleep(0.25)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.monotonic()
+    until = started + args.duration
+    generator = asyncio.create_task(traffic(until))
+    watcher = asyncio.create_task(watch_queue(until))
+
+    samples = []
+    baseline = None
+    print(
+        f"{'t s':>7} {'rss MB':>8} {'tasks':>6} {'objects':>9} {'queue':>6} "
+        f"{'backlog':>8} {'reqs':>6} {'errs':>5} {'shed':>5} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}"
+    )
+    while time.monotonic() < until:
+        await asyncio.sleep(min(args.interval, max(0, until - time.monotonic())))
+        current, window = window, Window()
+        gc.collect()
+        backlog = await db.fetchone(
+            """
+            SELECT COUNT(*) AS count FROM lnurlFlip.pending_withdrawals
+            WHERE status IN ('pending', 'processing')
+            """
+        )
+        everything = [s for name in ENDPOINTS for s in current.latencies[name]]
+        sample = {
+            "t": round(time.monotonic() - started, 1),
+            "rss_mb": round(rss_mb(), 1),
+            "tasks": len(asyncio.all_tasks()) - len(requests),
+            "objects": len(gc.get_objects()),
+            "queue_max": current.queue_max,
+            "backlog": backlog["count"],
+            "requests": len(everything),
+            "errors": current.errors,
+            "shed": current.shed,
+            "p50_ms": percentile(everything, 0.50),
+            "p95_ms": percentile(everything, 0.95),
+            "p99_ms": percentile(everything, 0.99),
+            "p95_by_endpoint": {
+                name: percentile(current.latencies[name], 0.95) for name in ENDPOINTS
+            },
+        }
+        if args.tracemalloc:
+            sample["traced_mb"] = round(tracemalloc.get_traced_memory()[0] / 2**20, 1)
+            if baseline is None and sample["t"] >= args.warmup:
+                baseline = tracemalloc.take_snapshot()
+        samples.append(sample)
+        print(
+            f"{sample['t']:>7} {sample['rss_mb']:>8} {sample['tasks']:>6} {sample['objects']:>9} "
+            f"{sample['queue_max']:>6} {sample['backlog']:>8} {sample['requests']:>6} "
+            f"{sample['errors']:>5} {sample['shed']:>5} {sample['p50_ms']!s:>7} "
+            f"{sample['p95_ms']!s:>7} {sample['p99_ms']!s:>7}",
+            flush=True,
+        )
+
+    await asyncio.gather(generator, watcher)
+    if requests:
+        await asyncio.wait(requests)
+    growth_sites = []
+    if args.tracemalloc:
+        if baseline is not None:
+            stats = tracemalloc.take_snapshot().compare_to(baseline, "lineno")
+            growth_sites = [str(stat) for stat in stats[: args.top]]
+        tracemalloc.stop()
+    for task in background:
+        task.cancel()
+    _, stuck = await asyncio.wait(background, timeout=10)
+    if stuck:
+        print(f"warning: {len(stuck)} background task(s) did not stop within 10s of cancel")
+    await client.aclose()
+    drift = await get_ledger_drift()
+
+    steady = [s for s in samples if s["t"] >= args.warmup]
+    failures = []
+    tolerances = {
+        "rss_mb": args.max_rss_growth_mb,
+        "tasks": args.max_task_growth,
+        "objects": max(5000, 0.05 * steady[0]["objects"]) if steady else 0,
+        "queue_max": args.max_queue_growth,
+        "backlog": args.max_queue_growth,
+    }
+    for metric, tolerance in tolerances.items():
+        found = monotonic_growth([s[metric] for s in steady], tolerance, args.monotonic_ratio)
+        if found:
+            failures.append(f"{metric} {found}")
+    for name in ENDPOINTS:
+        found = latency_drift(
+            [s["p95_by_endpoint"][name] for s in steady],
+            args.max_latency_drift,
+            args.min_latency_drift_ms,
+        )
+        if found:
+            failures.append(f"{name} latency drifted: {found}")
+    if drift:
+        failures.append(f"ledger drift on {len(drift)} flips")
+    if len(steady) < 6:
+        print(f"warning: only {len(steady)} samples after warm-up, drift checks need 6")
+
+    if growth_sites:
+        print("\nlargest allocation growth since the end of warm-up:")
+        for line in growth_sites:
+            print(f"  {line}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"samples": samples, "failures": failures, "growth_sites": growth_sites}, f, indent=2)
+    print()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"OK: no monotonic growth or latency drift over {len(steady)} samples")
+    return 1 if failures else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--duration", type=parse_duration, default=parse_duration("1h"),
+                        help="how long to run, e.g. 600, 30m, 4h")
+    parser.add_argument("--interval", type=parse_duration, default=60.0,
+                        help="seconds between samples")
+    parser.add_argument("--warmup", type=parse_duration, default=None,
+                        help="samples before this are not checked (default: 10%% of the run)")
+    parser.add_argument("--rate", type=float, default=20.0, help="requests per second")
+    parser.add_argument("--max-inflight", type=int, default=200,
+                        help="arrivals beyond this many open requests are shed")
+    parser.add_argument("--redirect-share", type=float, default=0.5)
+    parser.add_argument("--pay-share", type=float, default=0.3)
+    parser.add_argument("--withdraw-share", type=float, default=0.2)
+    parser.add_argument("--flips", type=int, default=20)
+    parser.add_argument("--ext-ms", type=float, default=1.0,
+                        help="mean latency of core/lnurlp/withdraw lookups")
+    parser.add_argument("--monotonic-ratio", type=float, default=0.8,
+                        help="share of non-decreasing steps that counts as monotonic")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=16.0)
+    parser.add_argument("--max-task-growth", type=int, default=2)
+    parser.add_argument("--max-queue-growth", type=int, default=50)
+    parser.add_argument("--max-latency-drift", type=float, default=1.5,
+                        help="allowed late/early p95 ratio")
+    parser.add_argument("--min-latency-drift-ms", type=float, default=5.0,
+                        help="p95 increases smaller than this are never drift")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="trace allocations and report where memory grew")
+    parser.add_argument("--top", type=int, default=10, help="growth sites to list")
+    parser.add_argument("--json", help="write every sample to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-folder", help="scratch folder (default: a new temp dir)")
+    parser.add_argument("--database-url", help="soak against this database instead")
+    args = parser.parse_args(argv)
+    if args.warmup is None:
+        args.warmup = args.duration / 10
+
+    prepare_scratch_env(args.data_folder, args.database_url)
+    load_extension()
+    quiet_logs("ERROR")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
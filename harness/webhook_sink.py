@@ -0,0 +1,259 @@
+"""
+Local HTTP stand-in for webhook receivers, and an end-to-end delivery check.
+
+With --serve it only runs the sink and prints every batch it receives, so a
+flip on a real LNbits can point its webhook_url at it.
+
+Without --serve it drives the outbox (webhooks.py) against a scratch
+database:
+
+1. Flips point at several sink endpoints and at one dead endpoint (nothing
+   listening). One sink endpoint has an outage for the first --outage
+   seconds, and every sink endpoint fails --fail-ratio of requests.
+2. --events settlements are applied through settle_flip_payment. This
+   queues their events in the same transaction.
+3. The delivery workers run until every live endpoint has received its
+   events or --timeout passes.
+
+Reports requests, events per request, duplicates and enqueue-to-delivery
+latency per endpoint, and how few attempts the dead endpoint got once its
+circuit opened. Exits non-zero if a live endpoint missed any event.
+
+Usage:
+
+    python harness/webhook_sink.py [--events 2000] [--endpoints 3] [--fail-ratio 0.1]
+    python harness/webhook_sink.py --serve [--port 8765]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from common import load_extension, migrate, prepare_scratch_env, quiet_logs
+
+
+class Sink:
+    """Records every event POSTed to it, by path; can fail on purpose."""
+
+    def __init__(self, fail_ratio: float = 0.0, outage_path: Optional[str] = None,
+                 outage_seconds: float = 0.0, verbose: bool = False):
+        self.fail_ratio = fail_ratio
+        self.outage_path = outage_path
+        self.outage_until = time.monotonic() + outage_seconds
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.failed: Counter = Counter()
+        self.received = defaultdict(list)  # path -> [(event id, payment hash, receive time)]
+
+    def handle(self, path: str, body: bytes) -> int:
+        with self.lock:
+            self.requests[path] += 1
+            if path == self.outage_path and time.monotonic() < self.outage_until:
+                self.failed[path] += 1
+                return 503
+            if random.random() < self.fail_ratio:
+                self.failed[path] += 1
+                return 500
+            events = json.loads(body)["events"]
+            now = time.time()
+            self.received[path].extend(
+                (event["id"], event.get("payment_hash"), now) for event in events
+            )
+        if self.verbose:
+            print(f"{path}: {json.dumps(events, indent=2)}")
+        return 200
+
+    def serve(self, port: int = 0) -> ThreadingHTTPServer:
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status = sink.handle(self.path, body)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run(args) -> int:
+    from lnurlFlip import webhooks
+    from lnurlFlip.crud import create_lnurlflip, db, settle_flip_payment
+    from lnurlFlip.models import MIN_WITHDRAWABLE_MSAT, LnurlFlip
+
+    # Shrink the timings so a run takes seconds
+    webhooks.WEBHOOK_BACKOFF_BASE_SECONDS = args.backoff
+    webhooks.WEBHOOK_POLL_SECONDS = 0.1
+    webhooks.WEBHOOK_CLAIM_TIMEOUT_SECONDS = 5
+    webhooks.circuits.open_seconds = args.circuit_open
+
+    await migrate(db)
+    sink = Sink(args.fail_ratio, "/endpoint-0", args.outage)
+    server = sink.serve()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    dead_url = f"http://127.0.0.1:{free_port()}/dead"
+
+    urls = [f"{base}/endpoint-{i}" for i in range(args.endpoints)] + [dead_url]
+    flips = []
+    path_of = {}
+    for i, url in enumerate(urls):
+        for j in range(args.flips_per_endpoint):
+            flip = LnurlFlip(
+                id=f"flip{i:02d}{j:02d}", name=f"flip {i}/{j}", wallet="wallet",
+                selectedLnurlp="lnurlp", selectedLnurlw="lnurlw", webhook_url=url,
+            )
+            await create_lnurlflip(flip)
+            flips.append(flip)
+            path_of[flip.id] = url[len(base):] if url != dead_url else None
+
+    workers = [asyncio.create_task(webhooks.run_webhook_worker()) for _ in range(args.workers)]
+
+    # Every settlement is a payment event; a flip's first crossing of the
+    # withdrawable minimum is one mode_changed event
+    expected = defaultdict(set)  # path -> payment hashes
+    mode_changes = Counter()  # path -> mode_changed events
+    totals = Counter()
+    queued_at = {}  # payment hash -> when its settlement committed
+    settle_times = []
+    rng = random.Random(args.seed)
+    for n in range(args.events):
+        flip = rng.choice(flips)
+        amount_msat = rng.randint(1, 100) * 1000
+        began = time.perf_counter()
+        await settle_flip_payment(flip.id, amount_msat, payment_hash=f"hash{n}")
+        settle_times.append(time.perf_counter() - began)
+        queued_at[f"hash{n}"] = time.time()
+        webhooks.notify_webhooks_queued()
+        path = path_of[flip.id]
+        expected[path].add(f"hash{n}")
+        if totals[flip.id] < MIN_WITHDRAWABLE_MSAT <= totals[flip.id] + amount_msat:
+            mode_changes[path] += 1
+        totals[flip.id] += amount_msat
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+
+    def delivered(path: str) -> bool:
+        received = sink.received[path]
+        hashes = {payment_hash for _, payment_hash, _ in received}
+        changes = {event_id for event_id, payment_hash, _ in received if payment_hash is None}
+        return expected[path] <= hashes and len(changes) >= mode_changes[path]
+
+    live = [url[len(base):] for url in urls if url != dead_url]
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        with sink.lock:
+            if all(delivered(path) for path in live):
+                break
+        await asyncio.sleep(0.05)
+
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await webhooks.close_client()
+    server.shutdown()
+
+    dead = await db.fetchone(
+        "SELECT COUNT(*) AS events, MAX(attempts) AS attempts FROM lnurlFlip.webhook_outbox WHERE url = :url",
+        {"url": dead_url}
+    )
+
+    failures = 0
+    print(f"{'endpoint':<14} {'events':>7} {'got':>7} {'dups':>5} {'reqs':>6} {'failed':>6} {'ev/req':>7} {'p50 s':>7} {'p95 s':>7}")
+    for path in live:
+        received = sink.received[path]
+        got = [event_id for event_id, _, _ in received]
+        unique = set(got)
+        ok = delivered(path)
+        failures += not ok
+        first_seen = {}
+        for _, payment_hash, at in received:
+            if payment_hash and payment_hash not in first_seen:
+                first_seen[payment_hash] = at
+        latencies = sorted(at - queued_at[h] for h, at in first_seen.items())
+        ok_requests = sink.requests[path] - sink.failed[path]
+        p50 = statistics.median(latencies) if latencies else 0
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+        print(
+            f"{path:<14} {len(expected[path]) + mode_changes[path]:>7} {len(unique):>7} {len(got) - len(unique):>5} "
+            f"{sink.requests[path]:>6} {sink.failed[path]:>6} "
+            f"{len(got) / max(ok_requests, 1):>7.1f} {p50:>7.2f} {p95:>7.2f}"
+            + ("" if ok else "  MISSING EVENTS")
+        )
+    print(
+        f"dead endpoint: {dead['events']} events kept, at most {dead['attempts']} attempt(s) each "
+        f"(circuit opens after {webhooks.circuits.failures} failures)"
+    )
+    settle_times.sort()
+    print(
+        f"settle with webhook enqueue: p50 {statistics.median(settle_times) * 1000:.2f} ms, "
+        f"p99 {settle_times[int(len(settle_times) * 0.99) - 1] * 1000:.2f} ms"
+    )
+    return 1 if failures else 0
+
+
+async def serve_forever(port: int) -> int:
+    server = Sink(verbose=True).serve(port)
+    print(f"Webhook sink listening on http://127.0.0.1:{server.server_address[1]}/ (Ctrl-C to stop)")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        server.shutdown()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--serve", action="store_true", help="only run the sink")
+    parser.add_argument("--port", type=int, default=8765, help="port for --serve")
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--endpoints", type=int, default=3, help="live sink endpoints")
+    parser.add_argument("--flips-per-endpoint", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--fail-ratio", type=float, default=0.1)
+    parser.add_argument("--outage", type=float, default=2.0, help="seconds endpoint-0 is down at start")
+    parser.add_argument("--rate", type=float, default=0, help="settlements per second (0 = flat out)")
+    parser.add_argument("--backoff", type=float, default=0.05, help="backoff base in seconds")
+    parser.add_argument("--circuit-open", type=float, default=0.5, help="seconds a circuit stays open")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        try:
+            return asyncio.run(serve_forever(args.port))
+        except KeyboardInterrupt:
+            return 0
+
+    # The sink listens on 127.0.0.1, which webhooks refuse by default
+    os.environ["LNURLFLIP_WEBHOOK_ALLOW_PRIVATE"] = "1"
+    prepare_scratch_env()
+    load_extension()
+    quiet_logs("ERROR")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
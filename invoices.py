@@ -0,0 +1,201 @@
+"""
+Pre-minted invoices for fixed-amount pay links.
+
+Creating an invoice waits on the funding source, which is usually the
+slowest part of api_lnurl_callback. When a flip's pay link has min == max,
+every payer asks for the same invoice, so it can be made ahead of time.
+The first callback for such a flip registers it, and from then on
+tasks.run_invoice_refill keeps INVOICE_POOL_SIZE unused invoices ready for
+it. Later callbacks pop one off a deque instead of waiting on create_invoice.
+
+Invoices are minted with an explicit INVOICE_EXPIRY_SECONDS and handed out
+only while at least INVOICE_REFRESH_MARGIN_SECONDS of that remain, so the
+payer always has time to pay. Older ones are dropped and replaced. Every
+invoice is handed out once. A flip that takes no callback for
+INVOICE_POOL_IDLE_SECONDS stops being refilled, and its leftover invoices
+just expire.
+
+Each invoice remembers the wallet, pay link and amount it was made for. If
+the flip (or its pool member) has moved to another wallet or link since, or
+the payer asks for another amount, the callback mints a fresh invoice instead.
+Before handing one out the callback also re-checks the pay link itself,
+cached for PAY_LINK_CACHE_SECONDS: a deleted link, a link that no longer has
+a fixed amount and a changed description all drop the flip's invoices.
+Payments with a comment are always minted on demand, because the comment is
+part of the memo.
+
+The pool is per node and kept in memory. A restart loses the unused invoices,
+which LNbits then expires.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .adapters import get_adapter
+
+INVOICE_POOL_SIZE = 5  # Ready invoices kept per fixed-amount flip
+INVOICE_EXPIRY_SECONDS = 3600
+INVOICE_REFRESH_MARGIN_SECONDS = 600  # Replace invoices with less time left than this
+INVOICE_POOL_IDLE_SECONDS = 3600  # Stop refilling flips without callbacks for this long
+PAY_LINK_CACHE_SECONDS = 30  # How stale a pay link may be when handing out its invoices
+
+PoolKey = Tuple[str, Optional[str]]  # (flip id, pool member id)
+
+
+class PremintedInvoice:
+    __slots__ = ("bolt11", "payment_hash", "wallet", "pay_link_id", "amount_msat", "expires_at")
+
+    def __init__(self, bolt11, payment_hash, wallet, pay_link_id, amount_msat, expires_at):
+        self.bolt11 = bolt11
+        self.payment_hash = payment_hash
+        self.wallet = wallet
+        self.pay_link_id = pay_link_id
+        self.amount_msat = amount_msat
+        self.expires_at = expires_at
+
+
+class InvoiceSpec:
+    """What to mint for one flip: the invoice create_invoice would make on callback."""
+
+    __slots__ = ("wallet", "pay_link_id", "amount_msat", "memo", "extra", "last_used")
+
+    def __init__(self, wallet, pay_link_id, amount_msat, memo, extra):
+        self.wallet = wallet
+        self.pay_link_id = pay_link_id
+        self.amount_msat = amount_msat
+        self.memo = memo
+        self.extra = extra
+        self.last_used = time.monotonic()
+
+
+class InvoicePool:
+    def __init__(
+        self,
+        size: int = INVOICE_POOL_SIZE,
+        expiry: int = INVOICE_EXPIRY_SECONDS,
+        margin: int = INVOICE_REFRESH_MARGIN_SECONDS,
+    ):
+        self.size = size
+        self.expiry = expiry
+        self.margin = margin
+        self._ready: Dict[PoolKey, Deque[PremintedInvoice]] = {}
+        self._specs: Dict[PoolKey, InvoiceSpec] = {}
+        self._links: Dict[str, Tuple[float, Any]] = {}
+        self.refill_due = asyncio.Event()
+
+    def watching(self, flip_id: str, member_id: Optional[str]) -> bool:
+        return (flip_id, member_id) in self._specs
+
+    async def pay_link(self, link_id: str) -> Optional[Any]:
+        """The pay link, fetched at most every PAY_LINK_CACHE_SECONDS."""
+        cached = self._links.get(link_id)
+        if cached and time.monotonic() - cached[0] < PAY_LINK_CACHE_SECONDS:
+            return cached[1]
+        link = await get_adapter().get_pay_link(link_id)
+        self._links[link_id] = (time.monotonic(), link)
+        return link
+
+    def take(
+        self,
+        flip_id: str,
+        member_id: Optional[str],
+        wallet: str,
+        pay_link_id: str,
+        amount_msat: int,
+        memo: str,
+    ) -> Optional[PremintedInvoice]:
+        """Pop a ready invoice matching the flip's current wallet, link, amount and memo."""
+        key = (flip_id, member_id)
+        ready = self._ready.get(key)
+        spec = self._specs.get(key)
+        if spec:
+            if spec.memo != memo:
+                # The link's description changed; the ready invoices carry the old one
+                self.discard(flip_id)
+                return None
+            spec.last_used = time.monotonic()
+        deadline = time.time() + self.margin
+        while ready:
+            invoice = ready.popleft()
+            if invoice.expires_at <= deadline:
+                continue  # Too close to expiry to hand out
+            if (invoice.wallet, invoice.pay_link_id) != (wallet, pay_link_id):
+                # The flip moved to another wallet or link; everything here is stale
+                self.discard(flip_id)
+                break
+            if invoice.amount_msat != amount_msat:
+                ready.appendleft(invoice)
+                break
+            self.refill_due.set()
+            return invoice
+        return None
+
+    def watch(self, flip_id: str, member_id: Optional[str], spec: InvoiceSpec) -> None:
+        """Keep invoices matching `spec` ready for a fixed-amount flip."""
+        key = (flip_id, member_id)
+        current = self._specs.get(key)
+        if current and (current.wallet, current.pay_link_id, current.amount_msat, current.memo) == (
+            spec.wallet, spec.pay_link_id, spec.amount_msat, spec.memo
+        ):
+            current.last_used = time.monotonic()
+            return
+        self._specs[key] = spec
+        self._ready[key] = deque()
+        self.refill_due.set()
+
+    def discard(self, flip_id: str) -> None:
+        """Forget a flip's invoices and stop refilling them (flip edited or deleted)."""
+        for key in [key for key in self._specs if key[0] == flip_id]:
+            self._specs.pop(key, None)
+            self._ready.pop(key, None)
+
+    def shortfall(self) -> List[Tuple[PoolKey, InvoiceSpec, int]]:
+        """
+        Drop stale invoices and idle flips; return how many invoices each
+        watched flip is missing.
+        """
+        now = time.monotonic()
+        deadline = time.time() + self.margin
+        self._links = {
+            link_id: cached for link_id, cached in self._links.items()
+            if now - cached[0] < PAY_LINK_CACHE_SECONDS
+        }
+        missing = []
+        for key, spec in list(self._specs.items()):
+            if now - spec.last_used > INVOICE_POOL_IDLE_SECONDS:
+                self._specs.pop(key, None)
+                self._ready.pop(key, None)
+                continue
+            ready = self._ready.setdefault(key, deque())
+            fresh = deque(invoice for invoice in ready if invoice.expires_at > deadline)
+            if len(fresh) != len(ready):
+                self._ready[key] = fresh
+            if len(fresh) < self.size:
+                missing.append((key, spec, self.size - len(fresh)))
+        return missing
+
+    async def mint(self, key: PoolKey, spec: InvoiceSpec) -> None:
+        minted = time.time()
+        payment = await get_adapter().create_invoice(
+            wallet_id=spec.wallet,
+            amount=spec.amount_msat // 1000,
+            memo=spec.memo,
+            expiry=self.expiry,
+            extra=spec.extra,
+        )
+        if self._specs.get(key) is not spec:
+            return  # Flip changed or went idle while minting; let this one expire
+        self._ready[key].append(
+            PremintedInvoice(
+                payment.bolt11,
+                payment.payment_hash,
+                spec.wallet,
+                spec.pay_link_id,
+                spec.amount_msat,
+                minted + self.expiry,
+            )
+        )
+
+invoice_pool = InvoicePool()
@@ -0,0 +1,103 @@
+"""
+Leader election for background jobs through leases in the database.
+
+Every node runs lnurlFlip_start, so with several LNbits nodes on one database
+each periodic job would otherwise run once per node. run_exclusive(name, job)
+runs `job` only while this node holds the job_leases row for `name`:
+
+- Standby nodes try to take the lease every heartbeat. The attempt is an
+  upsert that only succeeds if the lease is free, already theirs or expired.
+- The leader renews the lease every heartbeat. If it cannot confirm the lease
+  (lost to another node, or the database is unreachable), it cancels the job
+  one heartbeat before the lease could expire. That way it has stopped before
+  anyone else is allowed to start.
+- A leader that stops releases the lease so a standby takes over within one
+  heartbeat. If it dies instead, a standby takes over once the TTL passes.
+
+Leases are compared using each node's wall clock, so node clocks must agree
+to well within a heartbeat.
+"""
+
+import asyncio
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+
+from lnbits.helpers import urlsafe_short_hash
+from loguru import logger
+
+from .crud import acquire_lease, release_lease
+
+LEASE_TTL_SECONDS = 30
+LEASE_HEARTBEAT_SECONDS = 5  # Must be well under half the TTL
+
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}:{urlsafe_short_hash()[:6]}"
+
+
+async def run_exclusive(
+    name: str,
+    job: Callable[[], Awaitable],
+    holder: Optional[str] = None,
+    ttl_seconds: float = LEASE_TTL_SECONDS,
+    heartbeat_seconds: float = LEASE_HEARTBEAT_SECONDS,
+) -> None:
+    """Run `job` on whichever single node holds the lease `name`, forever."""
+    holder = holder or NODE_ID
+    while True:
+        attempted = time.monotonic()
+        try:
+            acquired = await acquire_lease(name, holder, int(ttl_seconds * 1000))
+        except Exception as e:
+            logger.warning(f"Could not acquire lease {name}: {str(e)}")
+            acquired = False
+        if acquired:
+            logger.info(f"{holder} took the lease on {name}")
+            await _lead(name, job, holder, ttl_seconds, heartbeat_seconds, attempted)
+        await asyncio.sleep(heartbeat_seconds)
+
+
+async def _lead(
+    name: str,
+    job: Callable[[], Awaitable],
+    holder: str,
+    ttl_seconds: float,
+    heartbeat_seconds: float,
+    confirmed: float,
+) -> None:
+    """Run the job while renewing the lease; stop it once the lease is in doubt."""
+    # The lease runs until at least confirmed + ttl; stop a heartbeat before
+    fence = confirmed + ttl_seconds - heartbeat_seconds
+    task = asyncio.create_task(job())
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=heartbeat_seconds)
+            if task in done:
+                if not task.cancelled() and task.exception():
+                    logger.error(f"Job {name} failed: {str(task.exception())}")
+                return
+            attempted = time.monotonic()
+            try:
+                renewed = await asyncio.wait_for(
+                    acquire_lease(name, holder, int(ttl_seconds * 1000)),
+                    timeout=max(fence - attempted, 0.001),
+                )
+            except Exception as e:
+                logger.warning(f"Could not renew lease {name}: {str(e) or type(e).__name__}")
+                renewed = None
+            if renewed:
+                fence = attempted + ttl_seconds - heartbeat_seconds
+            elif renewed is False:
+                logger.warning(f"{holder} lost the lease on {name}")
+                return
+            if time.monotonic() >= fence:
+                logger.warning(f"{holder} could not confirm the lease on {name}, stopping it")
+                return
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.wait({task})
+        try:
+            await release_lease(name, holder)
+        except Exception as e:
+            logger.debug(f"Could not release lease {name}: {str(e)}")
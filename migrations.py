@@ -1,5 +1,7 @@
 # Migration file for lnurlFlip extension
 
+import time
+
 async def m001_initial(db):
     """
     Create initial tables with complete schema
@@ -55,4 +57,323 @@ async def m001_initial(db):
     )
     await db.execute(
         f"CREATE INDEX idx_invoice_comments_flip_id ON {db.references_schema}invoice_comments(flip_id)"
-    )
\ No newline at end of file
+    )
+
+
+async def m002_daily_stats(db):
+    """
+    Per-flip daily rollups, maintained incrementally on every settlement
+    """
+    await db.execute(
+        f"""
+        CREATE TABLE {db.references_schema}flip_daily_stats (
+            flip_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            in_msat {db.big_int} NOT NULL DEFAULT 0,
+            out_msat {db.big_int} NOT NULL DEFAULT 0,
+            payment_count INTEGER NOT NULL DEFAULT 0,
+            withdrawal_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (flip_id, day)
+        );
+        """
+    )
+
+
+async def m003_withdrawal_queue(db):
+    """
+    Track execution of queued withdrawals on pending_withdrawals.
+    Status moves pending -> processing -> completed | failed; pending and
+    processing rows both hold a reservation against the flip balance.
+    """
+    await db.execute(
+        f"ALTER TABLE {db.references_schema}pending_withdrawals ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+    )
+    await db.execute(
+        f"ALTER TABLE {db.references_schema}pending_withdrawals ADD COLUMN claimed_time {db.big_int}"
+    )
+    await db.execute(
+        f"ALTER TABLE {db.references_schema}pending_withdrawals ADD COLUMN completed_time {db.big_int}"
+    )
+    await db.execute(
+        f"ALTER TABLE {db.references_schema}pending_withdrawals ADD COLUMN error TEXT"
+    )
+
+
+async def m004_unique_wallet_names(db):
+    """
+    Enforce case-insensitive unique names per wallet with an index instead of
+    a pre-check query. The index leads with wallet, so it also serves the
+    wallet IN (...) lookups.
+    """
+    # Rename existing duplicates first so the unique index can be built
+    rows = await db.fetchall(
+        f"SELECT id, wallet, name FROM {db.references_schema}maintable ORDER BY id"
+    )
+    seen = set()
+    for row in rows:
+        key = (row["wallet"], row["name"].lower())
+        if key in seen:
+            await db.execute(
+                f"UPDATE {db.references_schema}maintable SET name = :name WHERE id = :id",
+                {"id": row["id"], "name": f"{row['name']} ({row['id']})"}
+            )
+        seen.add(key)
+
+    await db.execute(
+        f"""
+        CREATE UNIQUE INDEX idx_maintable_wallet_name
+        ON {db.references_schema}maintable (wallet, LOWER(name))
+        """
+    )
+
+
+async def m005_payment_ledger(db):
+    """
+    Key every applied balance change so settlement is exactly-once, and keep
+    persisted state (watermarks) for background jobs. Existing balances are
+    carried over as one opening entry per flip, so the ledger net matches
+    total_msat from the start. Payments before that point are already in the
+    opening entries, so the ledger start time is recorded (and the reconcile
+    watermark starts there) and reconciliation never scans before it.
+    """
+    await db.execute(
+        f"""
+        CREATE TABLE {db.references_schema}payment_ledger (
+            payment_hash TEXT PRIMARY KEY,
+            flip_id TEXT NOT NULL,
+            amount_msat {db.big_int} NOT NULL,
+            time {db.big_int} NOT NULL
+        );
+        """
+    )
+    await db.execute(
+        f"CREATE INDEX idx_payment_ledger_flip_id ON {db.references_schema}payment_ledger(flip_id)"
+    )
+    await db.execute(
+        f"""
+        INSERT INTO {db.references_schema}payment_ledger (payment_hash, flip_id, amount_msat, time)
+        SELECT 'opening:' || id, id, total_msat, 0
+        FROM {db.references_schema}maintable
+        WHERE total_msat <> 0
+        """
+    )
+
+    await db.execute(
+        f"""
+        CREATE TABLE {db.references_schema}job_state (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_time {db.big_int} NOT NULL
+        );
+        """
+    )
+    now = int(time.time())
+    for name in ("ledger_started", "reconcile_watermark"):
+        await db.execute(
+            f"""
+            INSERT INTO {db.references_schema}job_state (name, value, updated_time)
+            VALUES (:name, :value, :now)
+            """,
+            {"name": name, "value": str(now), "now": now}
+        )
+
+
+async def m006_withdrawal_payment_hash(db):
+    """
+    Key withdrawals by the invoice's payment hash. The unique index rejects the
+    same invoice being submitted twice. Rows queued before this migration keep
+    a NULL hash (NULLs don't collide) and are resolved from the bolt11.
+    """
+    await db.execute(
+        f"ALTER TABLE {db.references_schema}pending_withdrawals ADD COLUMN payment_hash TEXT"
+    )
+    await db.execute(
+        f"""
+        CREATE UNIQUE INDEX idx_pending_withdrawals_payment_hash
+        ON {db.references_schema}pending_withdrawals (payment_hash)
+        """
+    )
+
+
+async def m007_scan_counters(db):
+    """
+    Per-flip QR scan counters, flushed in bulk from memory rather than
+    written on every redirect.
+    """
+    await db.execute(
+        f"""
+        CREATE TABLE {db.references_schema}scan_counters (
+            flip_id TEXT PRIMARY KEY,
+            scans {db.big_int} NOT NULL DEFAULT 0,
+            pay_scans {db.big_int} NOT NULL DEFAULT 0,
+            withdraw_scans {db.big_int} NOT NULL DEFAULT 0,
+            last_scan_time {db.big_int}
+        );
+        """
+    )
+
+
+async def m008_job_leases(db):
+    """
+    Leases for background jobs that must run on one node at a time when
+    several nodes share the database.
+    """
+    await db.execute(
+        f"""
+        CREATE TABLE {db.references_schema}job_leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_ms {db.big_int} NOT NULL,
+            acquired_ms {db.big_int} NOT NULL
+        );
+        """
+    )
+
+
+async def m009_comment_search(db):
+    """
+    Full-text index over payment comments: an FTS5 table kept in sync by
+    triggers on SQLite, a GIN index over the comment's tsvector on Postgres.
+    The FTS5 table stores its own copy of each comment keyed by the comment
+    id, since invoice_comments has no stable rowid (VACUUM may renumber it).
+    """
+    if db.type == "SQLITE":
+        await db.execute(
+            """
+            CREATE VIRTUAL TABLE invoice_comments_fts USING fts5(
+                id UNINDEXED, comment
+            );
+            """
+        )
+        await db.execute(
+            """
+            CREATE TRIGGER invoice_comments_fts_insert AFTER INSERT ON invoice_comments
+            BEGIN
+                INSERT INTO invoice_comments_fts (id, comment)
+                VALUES (new.id, new.comment);
+            END;
+            """
+        )
+        await db.execute(
+            """
+            CREATE TRIGGER invoice_comments_fts_delete AFTER DELETE ON invoice_comments
+            BEGIN
+                DELETE FROM invoice_comments_fts WHERE id = old.id;
+            END;
+            """
+        )
+        await db.execute(
+            """
+            CREATE TRIGGER invoice_comments_fts_update AFTER UPDATE ON invoice_comments
+            BEGIN
+                DELETE FROM invoice_comments_fts WHERE id = old.id;
+                INSERT INTO invoice_comments_fts (id, comment)
+                VALUES (new.id, new.comment);
+            END;
+            """
+        )
+        # Index the comments stored before this migration
+        await db.execute(
+            """
+            INSERT INTO invoice_comments_fts (id, comment)
+            SELECT id, comment FROM invoice_comments
+            """
+        )
+    else:
+        await db.execute(
+            f"""
+            CREATE INDEX idx_invoice_comments_search
+            ON {db.references_schema}invoice_comments
+            USING GIN (to_tsvector('simple', comment))
+            """
+        )
+
+
+async def m010_flip_pools(db):
+    """
+    Optional pools of wallets and links behind one flip. pool_policy NULL
+    keeps the flip on its own wallet and links. Each member tracks the share
+    of the flip's balance it holds, and withdrawals record the member that
+    pays them.
+    """
+    await db.execute(
+        f"ALTER TABLE {db.references_schema}maintable ADD COLUMN pool_policy TEXT"
+    )
+    await db.execute(
+        f"""
+        CREATE TABLE {db.references_schema}pool_members (
+            id TEXT PRIMARY KEY,
+            flip_id TEXT NOT NULL,
+            wallet TEXT NOT NULL,
+            selectedLnurlp TEXT NOT NULL,
+            selectedLnurlw TEXT NOT NULL,
+            balance_msat {db.big_int} NOT NULL DEFAULT 0,
+            created_time {db.big_int} NOT NULL
+        );
+        """
+    )
+    await db.execute(
+        f"CREATE INDEX idx_pool_members_flip_id ON {db.references_schema}pool_members (flip_id)"
+    )
+    await db.execute(
+        f"ALTER TABLE {db.references_schema}pending_withdrawals ADD COLUMN member_id TEXT"
+    )
+    await db.execute(
+        f"""
+        CREATE INDEX idx_pending_withdrawals_member_id
+        ON {db.references_schema}pending_withdrawals (member_id)
+        """
+    )
+
+
+async def m011_backfill_progress(db):
+    """
+    Progress of online backfills (see backfills.py): the last key each one
+    has processed, so a backfill resumes where it stopped after a restart or
+    a change of leader.
+    """
+    await db.execute(
+        f"""
+        CREATE TABLE {db.references_schema}backfill_progress (
+            name TEXT PRIMARY KEY,
+            last_key TEXT,
+            rows_done {db.big_int} NOT NULL DEFAULT 0,
+            done BOOLEAN NOT NULL DEFAULT FALSE,
+            updated_time {db.big_int} NOT NULL
+        );
+        """
+    )
+
+
+async def m012_webhook_outbox(db):
+    """
+    Optional webhook_url per flip, and a durable outbox of the events to POST
+    to it. Events are written in the same transaction as the settlement that
+    caused them, and removed once delivered (see webhooks.py).
+    """
+    await db.execute(
+        f"ALTER TABLE {db.references_schema}maintable ADD COLUMN webhook_url TEXT"
+    )
+    await db.execute(
+        f"""
+        CREATE TABLE {db.references_schema}webhook_outbox (
+            id TEXT PRIMARY KEY,
+            flip_id TEXT NOT NULL,
+            url TEXT NOT NULL,
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_ms {db.big_int} NOT NULL,
+            claimed_ms {db.big_int},
+            created_time {db.big_int} NOT NULL,
+            last_error TEXT
+        );
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE INDEX idx_webhook_outbox_due
+        ON {db.references_schema}webhook_outbox (status, next_attempt_ms)
+        """
+    )
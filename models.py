@@ -1,8 +1,19 @@
 # Data models for your extension
 
-from typing import Optional
+from typing import List, NamedTuple, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, validator
+
+from .profiler import MAX_PROFILE_SECONDS
+from .utils import webhook_url_error
+
+# How a pooled flip picks the member serving a scan (see pools.py)
+POOL_POLICIES = ("round_robin", "least_recently_used", "most_liquid")
+
+RESOLVE_BATCH_MAX = 200  # Flips per batch mode-resolution request
+
+# Balance constants (in millisatoshis)
+MIN_WITHDRAWABLE_MSAT = 50000       # 50 sats minimum withdrawable amount
 
 
 class CreateLnurlFlipData(BaseModel):
@@ -10,6 +21,16 @@ class CreateLnurlFlipData(BaseModel):
     wallet: Optional[str] = None
     selectedLnurlp: str
     selectedLnurlw: str
+    webhook_url: Optional[str] = None
+
+    @validator("webhook_url")
+    def http_url(cls, url):
+        if not url:
+            return None
+        error = webhook_url_error(url)
+        if error:
+            raise ValueError(error)
+        return url
 
 
 class LnurlFlip(BaseModel):
@@ -20,3 +41,104 @@ class LnurlFlip(BaseModel):
     selectedLnurlw: str
     total_msat: int = 0  # Total balance in msats
     uses: int = 0  # Number of completed transactions
+    pool_policy: Optional[str] = None  # One of POOL_POLICIES when the flip has a pool
+    webhook_url: Optional[str] = None  # Receives the flip's events (see webhooks.py)
+
+
+class LnurlFlipRecord(NamedTuple):
+    """
+    Read-only, tuple-backed view of a maintable row for hot-path reads.
+    Rows come straight from the database, so no validation is repeated here;
+    LnurlFlip/CreateLnurlFlipData stay the models at the write boundaries.
+    """
+
+    id: str
+    name: str
+    wallet: str
+    selectedLnurlp: str
+    selectedLnurlw: str
+    total_msat: int = 0
+    uses: int = 0
+    pool_policy: Optional[str] = None
+    webhook_url: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row) -> "LnurlFlipRecord":
+        return cls(
+            row["id"],
+            row["name"],
+            row["wallet"],
+            row["selectedLnurlp"],
+            row["selectedLnurlw"],
+            row["total_msat"],
+            row["uses"],
+            row["pool_policy"],
+            row["webhook_url"],
+        )
+
+
+class FlipDailyStats(BaseModel):
+    flip_id: str
+    day: str  # UTC date, YYYY-MM-DD
+    in_msat: int = 0  # Incoming payments in msats
+    out_msat: int = 0  # Withdrawals in msats
+    payment_count: int = 0
+    withdrawal_count: int = 0
+
+
+class PendingWithdrawal(BaseModel):
+    id: str
+    flip_id: str
+    amount_msat: int  # Amount in msats
+    status: str = "pending"  # pending -> processing -> completed | failed
+    created_time: int
+    payment_request: str
+    payment_hash: Optional[str] = None  # NULL for rows queued before it was stored
+    member_id: Optional[str] = None  # Pool member paying it, for pooled flips
+    attempts: int = 0
+    claimed_time: Optional[int] = None
+    completed_time: Optional[int] = None
+    error: Optional[str] = None
+
+
+class StartProfilerData(BaseModel):
+    routes: List[str] = []  # Route names or paths, "*" for every route
+    listener: bool = False  # Also profile the invoice listener
+    sample_percent: float = Field(10, gt=0, le=100)
+    duration_seconds: int = Field(60, gt=0, le=MAX_PROFILE_SECONDS)
+    interval_ms: int = Field(10, ge=1, le=1000)
+
+
+class PoolMember(BaseModel):
+    id: str  # The flip's own wallet and links are the member with id == flip_id
+    flip_id: str
+    wallet: str
+    selectedLnurlp: str
+    selectedLnurlw: str
+    balance_msat: int = 0  # Share of the flip's balance held in this member's wallet
+    created_time: int
+    reserved_msat: int = 0  # Queued withdrawals against this member (not stored)
+
+    @property
+    def available_msat(self) -> int:
+        return max(0, self.balance_msat - self.reserved_msat)
+
+
+class CreatePoolMemberData(BaseModel):
+    wallet: str
+    selectedLnurlp: str
+    selectedLnurlw: str
+
+
+class SetPoolPolicyData(BaseModel):
+    policy: Optional[str] = None  # None turns the pool off
+
+    @validator("policy")
+    def known_policy(cls, policy):
+        if policy is not None and policy not in POOL_POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(POOL_POLICIES)}")
+        return policy
+
+
+class ResolveFlipsData(BaseModel):
+    ids: List[str] = Field(..., min_items=1, max_items=RESOLVE_BATCH_MAX)
@@ -0,0 +1,137 @@
+"""
+Pools of wallets and links behind one flip.
+
+A flip with a pool_policy spreads its scans over its pool members (wallets,
+each with its own lnurlp and lnurlw link). The flip's own wallet and links
+are always a member. The redirect picks the member for each scan, and the
+callback URL it hands out carries that member, so the invoice is created on
+(or the withdrawal paid from) the same wallet. Settlements credit and debit
+the member's balance_msat alongside the flip's total_msat.
+
+Members and their balances are cached per flip for POOL_CACHE_SECONDS, so
+picking a member costs no query. Local settlements and reservations adjust
+the cache as they happen. Changes made on other nodes show up within the TTL,
+and the reservation re-checks the member's balance in the database. Selection
+state (the round-robin cursor, last-used times) is kept per node. It is
+dropped with the cache on invalidate, removed members are pruned on reload,
+and flips not served for POOL_STATE_IDLE_SECONDS are forgotten, so deleted
+flips and members do not accumulate.
+
+Policies:
+- round_robin: members in turn.
+- least_recently_used: the member this node used longest ago.
+- most_liquid: withdrawals are paid by the member holding the most, and
+  payments go to the member holding the least, which evens balances out.
+"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .crud import get_pool_members, get_pool_members_by_flip
+from .models import PoolMember
+
+POOL_CACHE_SECONDS = 30
+POOL_STATE_IDLE_SECONDS = 3600
+
+
+class PoolSelector:
+    def __init__(self, ttl: float = POOL_CACHE_SECONDS):
+        self.ttl = ttl
+        self._members: Dict[str, Tuple[float, List[PoolMember]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._last_used: Dict[str, Dict[str, float]] = {}  # flip id -> member id -> time
+        self._swept = time.monotonic()
+
+    async def members(self, flip_id: str) -> List[PoolMember]:
+        cached = self._members.get(flip_id)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        members = await get_pool_members(flip_id)
+        self._cache(flip_id, members)
+        self._forget_idle()
+        return members
+
+    async def preload(self, flip_ids: List[str]) -> None:
+        """Load the members of every flip not freshly cached, in one query."""
+        now = time.monotonic()
+        stale = [
+            flip_id for flip_id in flip_ids
+            if flip_id not in self._members or now - self._members[flip_id][0] >= self.ttl
+        ]
+        if not stale:
+            return
+        for flip_id, members in (await get_pool_members_by_flip(stale)).items():
+            self._cache(flip_id, members)
+        self._forget_idle()
+
+    def _cache(self, flip_id: str, members: List[PoolMember]) -> None:
+        self._members[flip_id] = (time.monotonic(), members)
+        last_used = self._last_used.get(flip_id)
+        if last_used:
+            current = {member.id for member in members}
+            for member_id in [m for m in last_used if m not in current]:
+                del last_used[member_id]
+
+    def _forget_idle(self) -> None:
+        now = time.monotonic()
+        if now - self._swept < self.ttl:
+            return
+        self._swept = now
+        for flip_id, (loaded, _) in list(self._members.items()):
+            if now - loaded > POOL_STATE_IDLE_SECONDS:
+                self.invalidate(flip_id)
+
+    async def member(self, flip_id: str, member_id: str) -> Optional[PoolMember]:
+        for member in await self.members(flip_id):
+            if member.id == member_id:
+                return member
+        return None
+
+    def invalidate(self, flip_id: str) -> None:
+        """Drop a flip's cached members and selection state after its pool changed or it was deleted."""
+        self._members.pop(flip_id, None)
+        self._cursor.pop(flip_id, None)
+        self._last_used.pop(flip_id, None)
+
+    def adjust(
+        self, flip_id: str, member_id: str, balance_msat: int = 0, reserved_msat: int = 0
+    ) -> None:
+        """Apply a local settlement or reservation to the cached member."""
+        cached = self._members.get(flip_id)
+        for member in cached[1] if cached else []:
+            if member.id == member_id:
+                member.balance_msat = max(0, member.balance_msat + balance_msat)
+                member.reserved_msat = max(0, member.reserved_msat + reserved_msat)
+
+    async def select(
+        self, flip_id: str, policy: str, mode: str, min_available_msat: int = 0
+    ) -> Optional[PoolMember]:
+        """
+        Pick the member to serve a scan in `mode` ("payment" or "withdraw").
+        For withdrawals only members with at least min_available_msat
+        available are candidates; None when there are none.
+        """
+        members = await self.members(flip_id)
+        if mode == "withdraw":
+            members = [m for m in members if m.available_msat >= min_available_msat]
+        if not members:
+            return None
+
+        if policy == "most_liquid":
+            if mode == "withdraw":
+                chosen = max(members, key=lambda m: m.available_msat)
+            else:
+                chosen = min(members, key=lambda m: m.balance_msat)
+        elif policy == "least_recently_used":
+            last_used = self._last_used.get(flip_id, {})
+            chosen = min(members, key=lambda m: last_used.get(m.id, 0.0))
+        else:
+            position = self._cursor.get(flip_id, 0)
+            self._cursor[flip_id] = position + 1
+            chosen = members[position % len(members)]
+
+        self._last_used.setdefault(flip_id, {})[chosen.id] = time.monotonic()
+        return chosen
+
+
+pool_selector = PoolSelector()
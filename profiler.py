@@ -0,0 +1,238 @@
+"""
+Admin-triggered sampling profiler.
+
+An admin starts a profiling session for some routes of this extension
+(matched by route name or path) and/or the invoice listener, with a sample
+percentage and a time limit. Every matching request or paid invoice is
+tracked with that probability. A background thread wakes every interval and
+records, for each tracked task, either the stack it is executing on the event
+loop thread or, while it waits, the chain of coroutines it is suspended in
+(ending in an "[await ...]" frame). The result is a wall-clock profile per
+route, aggregated as collapsed stacks ("frame;frame;frame count"), which
+flamegraph.pl, speedscope and similar tools read directly.
+
+Sessions switch themselves off when their time runs out. The profiler is
+per process: with several workers, each one profiles only its own traffic.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from loguru import logger
+
+LISTENER_TARGET = "listener"
+MAX_PROFILE_SECONDS = 300
+MIN_INTERVAL_MS = 1
+MAX_STACKS = 10000  # Distinct stacks kept per session; the rest are counted as truncated
+TRUNCATED_STACK = "[truncated]"
+
+
+def _frame_label(frame) -> str:
+    if isinstance(frame, _AwaitFrame):
+        return frame.name
+    code = frame.f_code
+    filename = os.path.join(*code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({filename}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._tasks: Dict[asyncio.Task, Tuple[str, object]] = {}
+        self._stacks: Counter = Counter()
+        self.targets: List[str] = []
+        self.sample_percent = 0.0
+        self.interval = 0.01
+        self.started_at = 0.0
+        self.expires_at = 0.0
+        self.samples = 0
+        self.tracked = 0
+
+    @property
+    def active(self) -> bool:
+        return not self._stop.is_set() and time.monotonic() < self.expires_at
+
+    def start(
+        self,
+        targets: List[str],
+        sample_percent: float,
+        duration_seconds: int,
+        interval_ms: int,
+    ) -> dict:
+        """Start a new session, replacing any running one and its results."""
+        self.stop()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._stacks = Counter()
+            self._tasks = {}
+            self._stop = threading.Event()
+            self.targets = list(targets)
+            self.sample_percent = sample_percent
+            self.interval = max(interval_ms, MIN_INTERVAL_MS) / 1000
+            self.started_at = time.monotonic()
+            self.expires_at = self.started_at + min(duration_seconds, MAX_PROFILE_SECONDS)
+            self.samples = 0
+            self.tracked = 0
+        self._thread = threading.Thread(
+            target=self._sample_loop,
+            args=(loop, threading.get_ident(), self._stop),
+            name="lnurlFlip-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+        logger.info(
+            f"Profiler started for {', '.join(self.targets)} at {sample_percent}% "
+            f"for {int(self.expires_at - self.started_at)}s"
+        )
+        return self.status()
+
+    def stop(self) -> None:
+        """Stop sampling, keeping the results of the session."""
+        self._stop.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=1)
+        self._thread = None
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active,
+                "targets": self.targets,
+                "sample_percent": self.sample_percent,
+                "interval_ms": round(self.interval * 1000),
+                "remaining_seconds": max(0, round(self.expires_at - time.monotonic()))
+                if self.active
+                else 0,
+                "tracked": self.tracked,
+                "samples": self.samples,
+                "stacks": len(self._stacks),
+            }
+
+    def collapsed(self) -> str:
+        """The session's profile in collapsed-stack format, hottest stacks first."""
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self._stacks.most_common()]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def wants(self, name: str, path: Optional[str] = None) -> bool:
+        """Whether to track this request (or paid invoice) in the running session."""
+        if not self.active:
+            return False
+        matched = any(
+            target == "*" and name != LISTENER_TARGET
+            or target == name
+            or (path is not None and path.endswith(target))
+            for target in self.targets
+        )
+        return matched and random.random() * 100 < self.sample_percent
+
+    @contextmanager
+    def track(self, label: str):
+        """Attribute samples of the current task to `label` while the block runs."""
+        task = asyncio.current_task()
+        # Stacks start at the function that opened this block (past contextlib)
+        self._tasks[task] = (label, sys._getframe(2).f_code)
+        self.tracked += 1
+        try:
+            yield
+        finally:
+            self._tasks.pop(task, None)
+
+    def _sample_loop(self, loop, loop_thread_id: int, stop: threading.Event) -> None:
+        while not stop.wait(self.interval):
+            if time.monotonic() >= self.expires_at:
+                logger.info("Profiler time limit reached, switching off")
+                stop.set()
+                break
+            try:
+                self._sample(loop, loop_thread_id)
+            except Exception as e:
+                # The loop thread changes these structures under us; skip the tick
+                logger.debug(f"Profiler sample skipped: {str(e)}")
+
+    def _sample(self, loop, loop_thread_id: int) -> None:
+        tasks = list(self._tasks.items())
+        if not tasks:
+            return
+        running = asyncio.current_task(loop)
+        thread_frame = sys._current_frames().get(loop_thread_id)
+        stacks = []
+        for task, (label, root) in tasks:
+            if task is running and thread_frame is not None:
+                frames = _running_stack(thread_frame)
+            else:
+                frames = _await_stack(task)
+            for i, frame in enumerate(frames):
+                if frame.f_code is root:
+                    frames = frames[i:]
+                    break
+            stacks.append(";".join([label] + [_frame_label(f) for f in frames]))
+        with self._lock:
+            for stack in stacks:
+                if stack not in self._stacks and len(self._stacks) >= MAX_STACKS:
+                    stack = TRUNCATED_STACK
+                self._stacks[stack] += 1
+                self.samples += 1
+
+
+def _running_stack(frame) -> list:
+    """The loop thread's frames, outermost first."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+class _AwaitFrame:
+    """Stand-in frame for the object a suspended coroutine chain waits on."""
+
+    f_code = None
+
+    def __init__(self, awaitable):
+        self.name = f"[await {type(awaitable).__name__}]"
+
+
+def _await_stack(task: asyncio.Task) -> list:
+    """The frames of the coroutines a suspended task is awaiting in, outermost first."""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            frames.append(_AwaitFrame(awaitable))
+            break
+        frames.append(frame)
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(
+            awaitable, "gi_yieldfrom", None
+        )
+    return frames
+
+
+profiler = SamplingProfiler()
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose requests can be picked up by the running profiler session."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            if not profiler.wants(self.name, self.path):
+                return await handler(request)
+            with profiler.track(self.name):
+                return await handler(request)
+
+        return profiled_handler
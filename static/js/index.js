@@ -51,6 +51,8 @@ window.app = Vue.createApp({
           rowsPerPage: 10
         }
       },
+      payLinks: [],
+      withdrawLinks: [],
       lnurlpOptions: [],
       lnurlwOptions: [],
       formDialog: {
@@ -72,96 +74,48 @@ window.app = Vue.createApp({
   methods: {
     async getFlips() {
       try {
+        // One round trip: flips with balances, plus the links for the form
         const response = await LNbits.api.request(
           'GET',
-          '/lnurlFlip/api/v1/lnurlflip?all_wallets=true',
+          '/lnurlFlip/api/v1/dashboard',
           this.g.user.wallets[0].inkey
         )
         
-        // Fetch balance for each flip
-        const flipsWithBalance = await Promise.all(
-          response.data.map(async (flip) => {
-            try {
-              const balanceResponse = await LNbits.api.request(
-                'GET',
-                `/lnurlFlip/api/v1/balance/${flip.id}`,
-                this.g.user.wallets[0].inkey
-              )
-              return {
-                ...mapLnurlFlip(flip),
-                balance: balanceResponse.data.balance || 0
-              }
-            } catch (error) {
-              console.error(`Error fetching balance for ${flip.id}:`, error)
-              return {
-                ...mapLnurlFlip(flip),
-                balance: 0
-              }
-            }
-          })
-        )
-        
-        this.flips = flipsWithBalance
+        this.flips = response.data.flips.map(mapLnurlFlip)
+        this.payLinks = response.data.pay_links || []
+        this.withdrawLinks = response.data.withdraw_links || []
+        this.setLinkOptions()
       } catch (error) {
         console.error('Error fetching flips:', error)
         LNbits.utils.notifyApiError(error)
       }
     },
 
-    async getLnurlPayLinks() {
-      try {
-        const response = await LNbits.api.request(
-          'GET',
-          '/lnurlp/api/v1/links',
-          this.g.user.wallets[0].inkey
-        )
-        
-        if (Array.isArray(response.data)) {
-          this.lnurlpOptions = response.data.map(link => ({
-            label: `${link.description} (${link.min === link.max ? link.min : `${link.min} - ${link.max}`} sats)`,
-            value: link.id,
-            lnurl: link.lnurl
-          }))
-        }
-      } catch (error) {
-        console.error('Error fetching LNURL pay links:', error)
-        LNbits.utils.notifyApiError(error)
-      }
-    },
+    setLinkOptions() {
+      const wallet = this.formDialog.data.wallet
+      const inWallet = link => !wallet || link.wallet === wallet
 
-    async getLnurlWithdrawLinks() {
-      try {
-        const response = await LNbits.api.request(
-          'GET',
-          '/withdraw/api/v1/links?all_wallets=true&limit=10&offset=0',
-          this.g.user.wallets[0].adminkey
-        )
-        
-        if (response.data && response.data.data) {
-          const filteredLinks = this.formDialog.data.wallet 
-            ? response.data.data.filter(link => link.wallet === this.formDialog.data.wallet)
-            : response.data.data
+      this.lnurlpOptions = this.payLinks.filter(inWallet).map(link => ({
+        label: `${link.description} (${link.min === link.max ? link.min : `${link.min} - ${link.max}`} sats)`,
+        value: link.id,
+        lnurl: link.lnurl
+      }))
 
-          this.lnurlwOptions = filteredLinks.map(link => {
-            const minSats = link.min_withdrawable || 0
-            const maxSats = link.max_withdrawable || 0
-            const amountDisplay = minSats === maxSats 
-              ? `${minSats} sats` 
-              : `${minSats} - ${maxSats} sats`
-            
-            return {
-              label: `${link.title || 'Untitled'} (${amountDisplay})`,
-              value: link.id,
-              lnurl: link.lnurl,
-              min: link.min_withdrawable || 0,
-              max: link.max_withdrawable || 0
-            }
-          })
+      this.lnurlwOptions = this.withdrawLinks.filter(inWallet).map(link => {
+        const minSats = link.min_withdrawable || 0
+        const maxSats = link.max_withdrawable || 0
+        const amountDisplay = minSats === maxSats 
+          ? `${minSats} sats` 
+          : `${minSats} - ${maxSats} sats`
+        
+        return {
+          label: `${link.title || 'Untitled'} (${amountDisplay})`,
+          value: link.id,
+          lnurl: link.lnurl,
+          min: minSats,
+          max: maxSats
         }
-      } catch (error) {
-        console.error('Error fetching LNURL withdraw links:', error)
-        LNbits.utils.notifyApiError(error)
-      }
+      })
     },
 
     openFormDialog() {
@@ -169,7 +123,8 @@ window.app = Vue.createApp({
         name: '',
         wallet: this.g.user.wallets[0]?.id || null,
         selectedLnurlp: null,
-        selectedLnurlw: null
+        selectedLnurlw: null,
+        webhook_url: null
       }
       this.formDialog.show = true
     },
@@ -369,17 +324,16 @@ window.app = Vue.createApp({
             wallet: this.g.user.wallets[0]?.id || null,
             lnurlwithdrawamount: null,
             selectedLnurlp: null,
-            selectedLnurlw: null
+            selectedLnurlw: null,
+            webhook_url: null
           }
         }
-        this.getLnurlPayLinks()
-        this.getLnurlWithdrawLinks()
+        this.setLinkOptions()
       }
     },
     'formDialog.data.wallet': function(newVal) {
       if (newVal) {
-        this.getLnurlPayLinks()
-        this.getLnurlWithdrawLinks()
+        this.setLinkOptions()
       }
     }
   },
@@ -1,10 +1,69 @@
 import asyncio
+import json
+import socket
+import time
+from typing import Dict, Optional, Tuple
 
+from lnbits.bolt11 import decode as decode_bolt11
 from lnbits.core.models import Payment
 from lnbits.tasks import register_invoice_listener
 from loguru import logger
 
-from .crud import get_lnurlFlip, process_payment_with_lock
+from .adapters import get_adapter
+from .counters import scan_counters
+from .crud import (
+    claim_withdrawals,
+    complete_withdrawal,
+    fail_withdrawal,
+    get_job_state,
+    get_ledger_drift,
+    get_lnurlFlip,
+    get_pool_member,
+    get_stale_withdrawals,
+    requeue_withdrawal,
+    set_job_state,
+    settle_flip_payment,
+)
+from .invoices import invoice_pool
+from .models import PendingWithdrawal
+from .pools import pool_selector
+from .profiler import LISTENER_TARGET, profiler
+from .utils import wait_for_event
+from .webhooks import notify_webhooks_queued
+
+# Withdrawal queue settings
+WITHDRAWAL_WORKERS = 4  # Payments executed concurrently per node
+WITHDRAWAL_POLL_SECONDS = 5  # Fallback poll when no wake-up arrives
+STALE_WITHDRAWAL_SECONDS = 300  # Claimed jobs older than this get resolved by the sweep
+WITHDRAWAL_MAX_ATTEMPTS = 5  # Claims before a job that never reaches LNbits is failed
+
+# Reconciliation settings
+RECONCILE_INTERVAL_SECONDS = 300
+# LNbits filters payments on creation time, so each pass re-reads this much
+# before the watermark to catch invoices paid late (LNbits' default expiry)
+RECONCILE_OVERLAP_SECONDS = 3600
+RECONCILE_PAGE_SIZE = 100
+RECONCILE_WATERMARK = "reconcile_watermark"
+# Written by m005: earlier payments are in the ledger's opening entries
+LEDGER_STARTED = "ledger_started"
+
+# Scan counters are flushed at least this often (see counters.py)
+SCAN_FLUSH_SECONDS = 10
+
+# Pre-minted invoices are checked for expiry at least this often (see invoices.py)
+INVOICE_REFILL_SECONDS = 60
+
+# Stop lets the listener finish queued payments for this long (see drain_invoice_listener)
+LISTENER_DRAIN_SECONDS = 10
+# Per host, so the checkpoint survives the restart of this node's process
+LISTENER_CHECKPOINT = f"listener_checkpoint:{socket.gethostname()}"
+
+withdrawal_wakeup = asyncio.Event()
+
+# Module level rather than owned by the listener task, so stop can drain what
+# is queued and payments forwarded during an in-process restart wait here
+invoice_queue: asyncio.Queue = asyncio.Queue()
+in_flight_payments: Dict[str, Payment] = {}
 
 #######################################
 ########## RUN YOUR TASKS HERE ########
@@ -14,7 +73,6 @@ from .crud import get_lnurlFlip, process_payment_with_lock
 
 
 async def wait_for_paid_invoices():
-    invoice_queue = asyncio.Queue()
     extension_name = "ext_lnurlflip"
     logger.info(f"Starting invoice listener for extension: {extension_name}")
     
@@ -22,15 +80,108 @@ async def wait_for_paid_invoices():
     logger.info("Invoice listener registered successfully")
     
     while True:
+        payment = await invoice_queue.get()
+        # Stays recorded if the listener is cancelled mid-payment (see listener_checkpoint)
+        in_flight_payments[payment.checking_id] = payment
         try:
-            payment = await invoice_queue.get()
             logger.info(f"Received payment: {payment.checking_id}")
             if payment.extra and isinstance(payment.extra, dict):
                 logger.debug(f"Payment extra data: {payment.extra}")
             
-            await on_invoice_paid(payment)
+            if profiler.wants(LISTENER_TARGET):
+                with profiler.track(LISTENER_TARGET):
+                    await on_invoice_paid(payment)
+            else:
+                await on_invoice_paid(payment)
         except Exception as e:
             logger.error(f"Error processing payment: {str(e)}")
+        in_flight_payments.pop(payment.checking_id, None)
+        invoice_queue.task_done()
+
+
+# Graceful stop and resume of the listener
+
+async def drain_invoice_listener(timeout: float = LISTENER_DRAIN_SECONDS) -> bool:
+    """
+    Wait up to `timeout` seconds for the listener to finish every queued and
+    in-flight payment. Returns whether it did.
+    """
+    if invoice_queue.empty() and not in_flight_payments:
+        return True
+    logger.info(f"Draining {invoice_queue.qsize() + len(in_flight_payments)} queued payments")
+    try:
+        await asyncio.wait_for(invoice_queue.join(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def listener_checkpoint() -> dict:
+    """
+    What the stopped listener left unapplied: the payments still queued or
+    cut off mid-way, and the creation time to reconcile from on next start.
+    Queued payments stay in the queue for an in-process restart. Payments cut
+    off mid-way are handed to the checkpoint: they are forgotten and marked
+    done on the queue, so a later drain does not wait on them. Only call this
+    once the listener has stopped.
+    """
+    left = list(in_flight_payments.values())
+    for _ in left:
+        invoice_queue.task_done()
+    in_flight_payments.clear()
+    queued = []
+    while not invoice_queue.empty():
+        queued.append(invoice_queue.get_nowait())
+        invoice_queue.task_done()
+    for payment in queued:
+        invoice_queue.put_nowait(payment)
+    left += queued
+
+    stopped_at = int(time.time())
+    times = [
+        int(payment.time.timestamp()) if getattr(payment, "time", None)
+        else stopped_at - RECONCILE_OVERLAP_SECONDS
+        for payment in left
+    ]
+    return {
+        "stopped_at": stopped_at,
+        "drained": not left,
+        "undrained": len(left),
+        # `since` excludes the second it names
+        "resume_from": min(times) - 1 if times else None,
+    }
+
+
+async def save_listener_checkpoint() -> dict:
+    checkpoint = listener_checkpoint()
+    await set_job_state(LISTENER_CHECKPOINT, json.dumps(checkpoint))
+    if checkpoint["drained"]:
+        logger.info("Invoice listener drained, checkpoint saved")
+    else:
+        logger.warning(f"Invoice listener stopped with {checkpoint['undrained']} payments unapplied, they are reconciled on next start")
+    return checkpoint
+
+
+async def resume_invoice_listener() -> Optional[dict]:
+    """
+    Catch up on start from the last stop's checkpoint, without waiting for
+    the periodic reconciliation: nothing after a clean drain, the payments
+    left behind after a timed-out drain, or everything since the reconcile
+    watermark after a crash (the checkpoint still says running).
+
+    The checkpoint is only replaced by the running marker once the replay
+    has returned, so if it raises the restarted task retries from the same
+    point instead of falling back to the watermark.
+    """
+    stored = await get_job_state(LISTENER_CHECKPOINT)
+    checkpoint = json.loads(stored) if stored else None
+    report = None
+    if checkpoint and not checkpoint.get("drained"):
+        since = checkpoint.get("resume_from")  # None after a crash: use the watermark
+        report = await reconcile_payments(since=since)
+        logger.info(f"Listener resume applied {report['applied']} of {report['scanned']} payments since its checkpoint")
+    await set_job_state(LISTENER_CHECKPOINT, json.dumps({"running_since": int(time.time())}))
+    return report
 
 
 # Do somethhing when an invoice related top this extension is paid
@@ -43,11 +194,6 @@ async def on_invoice_paid(payment: Payment) -> None:
         logger.warning(f"Payment missing flip_id: {payment}")
         return
 
-    lnurlflip = await get_lnurlFlip(lnurlflip_id)
-    if not lnurlflip:
-        logger.error(f"Flip not found for id: {lnurlflip_id}")
-        return
-
     # Check if this is a withdrawal
     is_withdrawal = payment.extra.get('lnurlwithdraw', False)
     logger.debug(f"Payment details - withdrawal: {is_withdrawal}, wallet: {payment.wallet_id}, status: {payment.status}")
@@ -55,31 +201,271 @@ async def on_invoice_paid(payment: Payment) -> None:
     # Calculate amount delta based on payment type
     # payment.amount is already in millisatoshis
     amount_msat = abs(payment.amount)
-    if is_withdrawal:
-        amount_delta = -amount_msat  # Make negative for withdrawals
-    else:
-        # For incoming payments, amount is positive
-        amount_delta = amount_msat
-
-    # Determine if we need to increment uses
-    # This happens when a withdrawal brings the balance to exactly 0
-    increment_uses = False
-    if is_withdrawal:
-        current = await get_lnurlFlip(lnurlflip_id)
-        if current and current.total_msat + amount_delta == 0:
-            increment_uses = True
-
-    # Perform locked payment processing to prevent race conditions
-    operation_type = "withdrawal" if is_withdrawal else "payment"
-    updated = await process_payment_with_lock(
-        lnurlflip_id=lnurlflip_id,
-        amount_delta=amount_delta,
-        increment_uses=increment_uses,
-        operation_type=operation_type
+    amount_delta = -amount_msat if is_withdrawal else amount_msat
+
+    # One transaction records the payment in the ledger and settles the
+    # balance, the use counter and the daily rollup
+    member_id = payment.extra.get("member_id")
+    updated = await settle_flip_payment(
+        lnurlflip_id, amount_delta, payment_hash=payment.payment_hash, member_id=member_id
     )
 
     if updated:
+        if updated.pool_policy:
+            pool_selector.adjust(lnurlflip_id, member_id or lnurlflip_id, balance_msat=amount_delta)
+        if updated.webhook_url:
+            notify_webhooks_queued()
         operation = "withdrawal" if is_withdrawal else "payment"
-        logger.info(f"Processed {operation} for flip {lnurlflip_id[:8]}... amount: {abs(amount_delta) // 1000} sats, new balance: {updated.total_msat // 1000} sats")
+        logger.info(f"Processed {operation} for flip {lnurlflip_id[:8]}... amount: {amount_msat // 1000} sats, new balance: {updated.total_msat // 1000} sats")
     else:
-        logger.error(f"Failed to update flip {lnurlflip_id}")
+        logger.error(f"Failed to update flip {lnurlflip_id}: not found, insufficient balance or already applied")
+
+
+# Catch up on payments the listener missed (e.g. while it was down)
+
+async def scan_missed_payments(since: int, flip_ids: set) -> Tuple[int, int, int]:
+    """
+    Settle the flip payments created after `since` that were never applied,
+    adding the flips seen to flip_ids. Returns (scanned, applied, newest
+    payment time).
+    """
+    adapter = get_adapter()
+    scanned = applied = 0
+    newest = since
+    offset = 0
+    while True:
+        page = await adapter.get_tagged_payments(
+            "ext_lnurlflip", since=since, limit=RECONCILE_PAGE_SIZE, offset=offset
+        )
+        for payment in page:
+            scanned += 1
+            paid_at = payment.time.timestamp()
+            newest = max(newest, int(paid_at))
+            extra = payment.extra or {}
+            flip_id = extra.get("flip_id")
+            # Withdrawals are settled by the withdrawal queue, not from here
+            if not flip_id or extra.get("lnurlwithdraw"):
+                continue
+            flip_ids.add(flip_id)
+            updated = await settle_flip_payment(
+                flip_id, abs(payment.amount), paid_at,
+                payment_hash=payment.payment_hash, member_id=extra.get("member_id")
+            )
+            if updated:
+                applied += 1
+                if updated.webhook_url:
+                    notify_webhooks_queued()
+                logger.warning(f"Reconciled missed payment {payment.payment_hash[:8]}... for flip {flip_id[:8]}... amount: {abs(payment.amount) // 1000} sats")
+        if len(page) < RECONCILE_PAGE_SIZE:
+            break
+        offset += len(page)
+    return scanned, applied, newest
+
+
+async def reconcile_payments(full_drift_check: bool = False, since: Optional[int] = None) -> dict:
+    """
+    Apply settled flip payments created since the persisted watermark that
+    were never applied, then advance the watermark. The payment ledger makes
+    applying a payment the listener already handled a no-op. Drift between
+    the ledger and total_msat is reported for the flips seen in this pass, or
+    for all flips with full_drift_check. An explicit `since` (a listener
+    checkpoint) scans from there and leaves the watermark to the periodic job.
+
+    The scan never reaches back before the ledger started, since those
+    payments are counted in its opening entries. Without a watermark there is
+    no safe point to start from, so nothing is scanned.
+    """
+    stored = await get_job_state(RECONCILE_WATERMARK)
+    started = await get_job_state(LEDGER_STARTED)
+    scanned = applied = 0
+    watermark = int(stored) if stored else None
+    flip_ids = set()
+
+    if watermark is None or started is None:
+        logger.error("No reconcile watermark or ledger start recorded, skipping the payment scan")
+    else:
+        advance_watermark = since is None
+        if since is None:
+            since = watermark - RECONCILE_OVERLAP_SECONDS
+        scanned, applied, newest = await scan_missed_payments(max(since, int(started)), flip_ids)
+        if advance_watermark:
+            watermark = max(watermark, newest)
+            await set_job_state(RECONCILE_WATERMARK, str(watermark))
+
+    drift = await get_ledger_drift(None if full_drift_check else sorted(flip_ids))
+    for row in drift:
+        logger.error(f"Balance drift on flip {row['flip_id']}: total_msat={row['total_msat']} ledger_msat={row['ledger_msat']}")
+
+    return {"scanned": scanned, "applied": applied, "watermark": watermark, "drift": drift}
+
+
+async def run_reconciliation():
+    full_drift_check = True  # Check every flip once at start
+    while True:
+        try:
+            report = await reconcile_payments(full_drift_check)
+            full_drift_check = False
+            if report["applied"]:
+                logger.info(f"Reconciliation applied {report['applied']} of {report['scanned']} payments")
+        except Exception as e:
+            logger.error(f"Error reconciling payments: {str(e)}")
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+
+
+# Execute queued withdrawals (see api_withdraw_callback)
+
+def notify_withdrawal_queued() -> None:
+    """Wake the withdrawal workers after a callback enqueued a job."""
+    withdrawal_wakeup.set()
+
+
+async def run_withdrawal_worker():
+    while True:
+        withdrawal_wakeup.clear()
+        jobs = await claim_withdrawals(limit=1)
+        if not jobs:
+            await wait_for_event(withdrawal_wakeup, WITHDRAWAL_POLL_SECONDS)
+            continue
+        try:
+            await execute_withdrawal(jobs[0])
+        except Exception as e:
+            # Leave the job claimed; the stale sweep settles it from the payment record
+            logger.error(f"Error executing withdrawal {jobs[0].id}: {str(e)}")
+
+
+async def execute_withdrawal(job: PendingWithdrawal) -> None:
+    flip = await get_lnurlFlip(job.flip_id)
+    if not flip:
+        await fail_withdrawal(job.id, "Flip not found")
+        return
+
+    # Pooled withdrawals are paid from the member that reserved them
+    wallet_id, selected_lnurlw = flip.wallet, flip.selectedLnurlw
+    if job.member_id:
+        member = await get_pool_member(job.member_id)
+        if not member:
+            await release_withdrawal(job, "Pool member not found")
+            return
+        wallet_id, selected_lnurlw = member.wallet, member.selectedLnurlw
+
+    try:
+        payment = await get_adapter().pay_invoice(
+            wallet_id=wallet_id,
+            payment_request=job.payment_request,
+            extra={
+                "tag": "ext_lnurlflip",
+                "lnurlwithdraw": True,
+                "flip_id": flip.id,
+                "selectedLnurlw": selected_lnurlw,
+                "withdraw_id": job.id,
+                "member_id": job.member_id
+            }
+        )
+    except Exception as e:
+        # LNbits reports the outcome on PaymentError.status: only "failed"
+        # means no money left the wallet
+        error = getattr(e, "message", None) or str(e)
+        status = getattr(e, "status", None)
+        if status == "failed":
+            logger.error(f"Withdrawal failed: {error} flip_id={flip.id} amount_msat={job.amount_msat}")
+            await release_withdrawal(job, error)
+        elif status == "success":
+            # "Payment already paid": the money is gone, settle it
+            logger.info(f"Withdrawal {job.id} was already paid: {error}")
+            await settle_withdrawal(job)
+        else:
+            # Possibly in flight; the reservation holds until the stale sweep sees an outcome
+            logger.warning(f"Withdrawal {job.id} outcome unknown, leaving it to the stale sweep: {error}")
+        return
+
+    status = getattr(payment, "status", "success")
+    if status == "pending":
+        # Still routing; the reservation holds until the stale sweep sees an outcome
+        logger.info(f"Withdrawal {job.id} in flight for flip {flip.id[:8]}...")
+        return
+    if status == "failed":
+        await release_withdrawal(job, "Payment failed")
+        return
+
+    await settle_withdrawal(job)
+
+
+async def settle_withdrawal(job: PendingWithdrawal) -> None:
+    updated = await complete_withdrawal(job)
+    if updated:
+        if updated.webhook_url:
+            notify_webhooks_queued()
+        if job.member_id:
+            pool_selector.adjust(
+                job.flip_id, job.member_id,
+                balance_msat=-job.amount_msat, reserved_msat=-job.amount_msat
+            )
+        logger.info(f"Processed withdrawal for flip {job.flip_id[:8]}... amount: {job.amount_msat // 1000} sats, new balance: {updated.total_msat // 1000} sats")
+
+
+async def release_withdrawal(job: PendingWithdrawal, error: str) -> None:
+    await fail_withdrawal(job.id, error)
+    if job.member_id:
+        pool_selector.adjust(job.flip_id, job.member_id, reserved_msat=-job.amount_msat)
+
+
+async def resolve_stale_withdrawal(job: PendingWithdrawal) -> None:
+    """Settle, release or requeue one withdrawal from what LNbits recorded for it."""
+    # Rows queued before payment_hash was stored only have the bolt11
+    payment_hash = job.payment_hash or decode_bolt11(job.payment_request).payment_hash
+    payment = await get_adapter().get_standalone_payment(payment_hash)
+    if not payment:
+        # Never reached LNbits: safe to try again, unless it keeps failing
+        # before that and would hold its reservation forever
+        if job.attempts >= WITHDRAWAL_MAX_ATTEMPTS:
+            logger.error(f"Withdrawal {job.id} never reached LNbits after {job.attempts} attempts, failing it")
+            await release_withdrawal(job, f"Gave up after {job.attempts} attempts")
+        else:
+            await requeue_withdrawal(job.id)
+            notify_withdrawal_queued()
+    elif payment.status == "success":
+        await settle_withdrawal(job)
+    elif payment.status == "failed":
+        await release_withdrawal(job, "Payment failed")
+
+
+async def resolve_stale_withdrawals():
+    """
+    Settle withdrawals stuck in 'processing' (in flight, or claimed by a node
+    that died) from what LNbits recorded for the invoice.
+    """
+    while True:
+        stale = await get_stale_withdrawals(int(time.time()) - STALE_WITHDRAWAL_SECONDS)
+        for job in stale:
+            try:
+                await resolve_stale_withdrawal(job)
+            except Exception as e:
+                logger.error(f"Error resolving withdrawal {job.id}: {str(e)}")
+        await asyncio.sleep(60)
+
+
+# Persist the write-behind scan counters
+
+async def run_scan_counter_flush():
+    while True:
+        await wait_for_event(scan_counters.flush_due, SCAN_FLUSH_SECONDS)
+        scan_counters.flush_due.clear()
+        try:
+            await scan_counters.flush()
+        except Exception as e:
+            # The counts were put back and go out with the next flush
+            logger.error(f"Error flushing scan counters: {str(e)}")
+
+
+async def run_invoice_refill():
+    while True:
+        await wait_for_event(invoice_pool.refill_due, INVOICE_REFILL_SECONDS)
+        invoice_pool.refill_due.clear()
+        for key, spec, count in invoice_pool.shortfall():
+            results = await asyncio.gather(
+                *(invoice_pool.mint(key, spec) for _ in range(count)), return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    # Callbacks mint on demand meanwhile; the next pass tries again
+                    logger.warning(f"Could not pre-mint invoice for flip {key[0][:8]}...: {str(result)}")
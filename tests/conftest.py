@@ -0,0 +1,71 @@
+"""
+Shared fixtures. The extension is loaded as the `lnurlFlip` package against a
+scratch SQLite database, the same way the harness scripts do (see
+harness/common.py), migrated once per session. A FakeAdapter stands in for
+LNbits core and the lnurlp / withdraw extensions.
+
+The database is shared by the whole session, so tests create their own flips
+(see make_flip) rather than relying on empty tables.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "harness"))
+
+from common import load_extension, migrate, prepare_scratch_env  # noqa: E402
+
+# Must run before anything imports lnbits
+prepare_scratch_env()
+load_extension()
+
+from lnbits.helpers import urlsafe_short_hash  # noqa: E402
+from lnurlFlip.adapters import FakeAdapter, set_adapter  # noqa: E402
+from lnurlFlip.crud import (  # noqa: E402
+    create_lnurlflip,
+    db,
+    get_lnurlFlip,
+    settle_flip_payment,
+)
+from lnurlFlip.models import LnurlFlip  # noqa: E402
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session", autouse=True)
+async def database():
+    await migrate(db)
+    return db
+
+
+@pytest.fixture
+def adapter():
+    fake = FakeAdapter()
+    previous = set_adapter(fake)
+    yield fake
+    set_adapter(previous)
+
+
+@pytest.fixture
+def make_flip():
+    """Create a flip on a fresh wallet, funded with `balance_msat` through the ledger."""
+
+    async def make(balance_msat: int = 0, wallet: str = None) -> LnurlFlip:
+        flip_id = urlsafe_short_hash()
+        await create_lnurlflip(
+            LnurlFlip(
+                id=flip_id,
+                name=f"flip {flip_id}",
+                wallet=wallet or f"wallet-{flip_id}",
+                selectedLnurlp=f"lnurlp-{flip_id}",
+                selectedLnurlw=f"lnurlw-{flip_id}",
+            )
+        )
+        if balance_msat:
+            return await settle_flip_payment(
+                flip_id, balance_msat, payment_hash=f"funding:{flip_id}"
+            )
+        return await get_lnurlFlip(flip_id)
+
+    return make
@@ -0,0 +1,62 @@
+import pytest
+
+from lnurlFlip.crud import (
+    FLIP_OWNED_TABLES,
+    add_scan_counts,
+    db,
+    delete_lnurlFlip,
+    execute_write,
+    fail_withdrawal,
+    get_lnurlFlip,
+    reserve_withdrawal,
+    save_invoice_comment,
+    search_comments,
+    set_pool_policy,
+    settle_flip_payment,
+)
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def rows_left(flip_id: str) -> dict:
+    counts = {}
+    for table in FLIP_OWNED_TABLES:
+        row = await db.fetchone(
+            f"SELECT COUNT(*) AS n FROM lnurlFlip.{table} WHERE flip_id = :id", {"id": flip_id}
+        )
+        counts[table] = row["n"]
+    return counts
+
+
+async def test_delete_removes_everything_the_flip_owns(make_flip):
+    flip = await make_flip(100_000)
+    await execute_write(
+        "UPDATE lnurlFlip.maintable SET webhook_url = :url WHERE id = :id",
+        {"id": flip.id, "url": "https://hooks.example.com/flip"},
+    )
+    await set_pool_policy(flip.id, "round_robin")
+    await settle_flip_payment(flip.id, 5_000, payment_hash=f"paid-{flip.id}")
+    await add_scan_counts(
+        {flip.id: {"scans": 1, "pay_scans": 1, "withdraw_scans": 0, "last_scan_time": 1}}
+    )
+    await save_invoice_comment(flip.id, f"cascade {flip.id}", 5_000)
+    withdrawal_id = await reserve_withdrawal(flip.id, 1_000, f"lnfake-{flip.id}", f"hash-{flip.id}")
+    await fail_withdrawal(withdrawal_id, "no route")
+    assert all((await rows_left(flip.id)).values())
+    assert len(await search_comments([flip.wallet], f"cascade {flip.id}")) == 1
+
+    assert await delete_lnurlFlip(flip.id) is True
+
+    assert await get_lnurlFlip(flip.id) is None
+    assert not any((await rows_left(flip.id)).values())
+    assert await search_comments([flip.wallet], f"cascade {flip.id}") == []
+
+
+async def test_delete_refused_while_a_withdrawal_is_queued(make_flip):
+    flip = await make_flip(100_000)
+    await reserve_withdrawal(flip.id, 1_000, f"lnfake-{flip.id}", f"hash-{flip.id}")
+
+    assert await delete_lnurlFlip(flip.id) is False
+
+    assert (await get_lnurlFlip(flip.id)).total_msat == 100_000
+    assert (await rows_left(flip.id))["pending_withdrawals"] == 1
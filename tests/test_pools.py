@@ -0,0 +1,100 @@
+import pytest
+
+from lnurlFlip.crud import (
+    add_pool_member,
+    get_pool_members,
+    reserve_withdrawal,
+    set_pool_policy,
+    settle_flip_payment,
+)
+from lnurlFlip.models import CreatePoolMemberData
+from lnurlFlip.pools import PoolSelector
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def make_pool(make_flip, policy: str, balance_msat: int = 0, extra_members: int = 2):
+    """
+    A pooled flip with its own member plus `extra_members` empty ones. The
+    members come back in pool order, which among members created in the same
+    second is by id, so the own member is not necessarily first.
+    """
+    flip = await make_flip(balance_msat)
+    await set_pool_policy(flip.id, policy)
+    for i in range(extra_members):
+        await add_pool_member(
+            flip.id,
+            CreatePoolMemberData(
+                wallet=f"{flip.wallet}-{i}",
+                selectedLnurlp=f"{flip.selectedLnurlp}-{i}",
+                selectedLnurlw=f"{flip.selectedLnurlw}-{i}",
+            ),
+        )
+    return flip, await get_pool_members(flip.id)
+
+
+async def test_own_member_takes_the_balance(make_flip):
+    flip, members = await make_pool(make_flip, "round_robin", 80_000)
+
+    assert {m.id: m.balance_msat for m in members} == {
+        flip.id: 80_000, **{m.id: 0 for m in members if m.id != flip.id}
+    }
+
+
+async def test_round_robin_takes_members_in_turn(make_flip):
+    flip, members = await make_pool(make_flip, "round_robin")
+    selector = PoolSelector()
+
+    picked = [
+        (await selector.select(flip.id, "round_robin", "payment")).id for _ in range(4)
+    ]
+
+    assert picked == [m.id for m in members] + [members[0].id]
+
+
+async def test_least_recently_used_skips_recent_members(make_flip):
+    flip, members = await make_pool(make_flip, "least_recently_used")
+    selector = PoolSelector()
+
+    picked = {
+        (await selector.select(flip.id, "least_recently_used", "payment")).id
+        for _ in range(len(members))
+    }
+
+    assert picked == {m.id for m in members}
+
+
+async def test_most_liquid_evens_out_balances(make_flip):
+    flip, members = await make_pool(make_flip, "most_liquid", 80_000)
+    first, second = [m for m in members if m.id != flip.id]
+    await settle_flip_payment(flip.id, 30_000, member_id=first.id)
+    await settle_flip_payment(flip.id, 10_000, member_id=second.id)
+    selector = PoolSelector()
+
+    assert (await selector.select(flip.id, "most_liquid", "payment")).id == second.id
+    assert (await selector.select(flip.id, "most_liquid", "withdraw")).id == flip.id
+
+
+async def test_withdrawals_only_use_members_with_enough_available(make_flip):
+    flip, members = await make_pool(make_flip, "round_robin", 80_000)
+    other = next(m for m in members if m.id != flip.id)
+    await settle_flip_payment(flip.id, 30_000, member_id=other.id)
+    selector = PoolSelector()
+
+    picked = {
+        (await selector.select(flip.id, "round_robin", "withdraw", 50_000)).id
+        for _ in range(3)
+    }
+
+    assert picked == {flip.id}
+    assert await selector.select(flip.id, "round_robin", "withdraw", 100_000) is None
+
+
+async def test_withdrawals_queued_before_the_pool_count_against_own_member(make_flip):
+    flip = await make_flip(100_000)
+    await reserve_withdrawal(flip.id, 60_000, f"lnfake-{flip.id}", f"hash-{flip.id}")
+
+    await set_pool_policy(flip.id, "round_robin")
+
+    [own] = await get_pool_members(flip.id)
+    assert (own.reserved_msat, own.available_msat) == (60_000, 40_000)
@@ -0,0 +1,56 @@
+import pytest
+
+from lnurlFlip.crud import (
+    comment_search_query,
+    db,
+    execute_write,
+    save_invoice_comment,
+    search_comments,
+)
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def test_every_word_must_match_last_as_prefix(make_flip):
+    flip = await make_flip()
+    coffee = await save_invoice_comment(flip.id, "Thanks for the coffee!", 1_000)
+    await save_invoice_comment(flip.id, "coffee beans", 2_000)
+    await save_invoice_comment(flip.id, "tea please", 3_000)
+
+    found = await search_comments([flip.wallet], "thanks COF")
+
+    assert [row["id"] for row in found] == [coffee]
+    assert found[0]["flip_name"] == flip.name
+
+
+async def test_search_is_limited_to_the_given_wallets(make_flip):
+    mine = await make_flip()
+    theirs = await make_flip()
+    await save_invoice_comment(mine.id, "walletscope mine", 1_000)
+    await save_invoice_comment(theirs.id, "walletscope theirs", 1_000)
+
+    found = await search_comments([mine.wallet], "walletscope")
+
+    assert [row["flip_id"] for row in found] == [mine.id]
+
+
+async def test_index_follows_updates_and_vacuum(make_flip):
+    flip = await make_flip()
+    comment_id = await save_invoice_comment(flip.id, "original wording", 1_000)
+    await save_invoice_comment(flip.id, "padding comment", 1_000)
+    await execute_write(
+        "UPDATE lnurlFlip.invoice_comments SET comment = 'reworded text' WHERE id = :id",
+        {"id": comment_id},
+    )
+    # VACUUM may renumber rowids; the index is keyed on the comment id
+    await db.execute("VACUUM")
+
+    assert await search_comments([flip.wallet], "original") == []
+    assert [row["id"] for row in await search_comments([flip.wallet], "reworded")] == [
+        comment_id
+    ]
+
+
+async def test_query_keeps_only_words():
+    assert comment_search_query('say "hi" OR -x*') == '"say" "hi" "or" "x"*'
+    assert comment_search_query("  ?!  ") is None
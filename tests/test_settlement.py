@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from lnbits.helpers import urlsafe_short_hash
+
+from lnurlFlip.crud import (
+    db,
+    get_daily_stats,
+    get_job_state,
+    get_ledger_drift,
+    get_lnurlFlip,
+    settle_flip_payment,
+    stats_day,
+)
+from lnurlFlip.tasks import LEDGER_STARTED, reconcile_payments
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+def paid(flip_id: str, amount_msat: int, at: float, payment_hash: str = None):
+    """An incoming payment as FakeAdapter.get_tagged_payments returns it."""
+    return SimpleNamespace(
+        payment_hash=payment_hash or urlsafe_short_hash(),
+        tag="ext_lnurlflip",
+        status="success",
+        amount=amount_msat,
+        time=datetime.fromtimestamp(at, timezone.utc),
+        extra={"tag": "ext_lnurlflip", "flip_id": flip_id},
+    )
+
+
+async def ledger_rows(flip_id: str) -> list:
+    rows = await db.fetchall(
+        "SELECT payment_hash, amount_msat FROM lnurlFlip.payment_ledger WHERE flip_id = :id",
+        {"id": flip_id},
+    )
+    return [dict(row) for row in rows]
+
+
+async def test_settle_same_payment_once(make_flip):
+    flip = await make_flip()
+
+    first = await settle_flip_payment(flip.id, 21_000, payment_hash="hash-once")
+    again = await settle_flip_payment(flip.id, 21_000, payment_hash="hash-once")
+
+    assert first.total_msat == 21_000
+    assert again is None
+    assert (await get_lnurlFlip(flip.id)).total_msat == 21_000
+    assert await ledger_rows(flip.id) == [{"payment_hash": "hash-once", "amount_msat": 21_000}]
+    [stats] = await get_daily_stats(flip.id, stats_day(), stats_day())
+    assert (stats.in_msat, stats.payment_count) == (21_000, 1)
+
+
+async def test_unapplied_withdrawal_leaves_no_ledger_row(make_flip):
+    flip = await make_flip(10_000)
+
+    assert await settle_flip_payment(flip.id, -20_000, payment_hash="too-much") is None
+    assert (await get_lnurlFlip(flip.id)).total_msat == 10_000
+    assert [row["payment_hash"] for row in await ledger_rows(flip.id)] == [f"funding:{flip.id}"]
+    # Not recorded, so a later attempt is not mistaken for a replay
+    assert await settle_flip_payment(flip.id, 5_000, payment_hash="too-much") is not None
+
+
+async def test_reconcile_applies_only_missed_payments(adapter, make_flip):
+    flip = await make_flip()
+    started = int(await get_job_state(LEDGER_STARTED))
+    seen = paid(flip.id, 1_000, started + 1)
+    missed = paid(flip.id, 2_000, started + 2)
+    await settle_flip_payment(flip.id, seen.amount, payment_hash=seen.payment_hash)
+    adapter.incoming = [seen, missed]
+
+    report = await reconcile_payments(since=started)
+
+    assert report["applied"] == 1
+    assert (await get_lnurlFlip(flip.id)).total_msat == 3_000
+    assert await get_ledger_drift([flip.id]) == []
+
+
+async def test_reconcile_skips_payments_from_before_the_ledger(adapter, make_flip):
+    # Counted in the flip's opening ledger entry when m005 ran
+    flip = await make_flip()
+    started = int(await get_job_state(LEDGER_STARTED))
+    adapter.incoming = [paid(flip.id, 5_000, started - 10)]
+
+    report = await reconcile_payments(since=started - 3600)
+
+    assert report["applied"] == 0
+    assert (await get_lnurlFlip(flip.id)).total_msat == 0
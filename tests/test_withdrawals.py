@@ -0,0 +1,130 @@
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+from lnbits.helpers import urlsafe_short_hash
+
+from lnurlFlip.crud import (
+    claim_withdrawals,
+    db,
+    execute_write,
+    fail_withdrawal,
+    get_lnurlFlip,
+    get_lnurlflip_balance,
+    reserve_withdrawal,
+)
+from lnurlFlip.models import PendingWithdrawal
+from lnurlFlip.tasks import (
+    WITHDRAWAL_MAX_ATTEMPTS,
+    execute_withdrawal,
+    resolve_stale_withdrawal,
+)
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+@pytest_asyncio.fixture(loop_scope="session", autouse=True)
+async def empty_queue():
+    # claim_withdrawals takes the oldest jobs of any flip
+    await execute_write("DELETE FROM lnurlFlip.pending_withdrawals")
+
+
+async def queue(flip_id: str, amount_msat: int) -> str:
+    """Reserve a withdrawal whose hash matches what FakeAdapter.pay_invoice records."""
+    payment_request = f"lnfake{urlsafe_short_hash()}"
+    payment_hash = hashlib.sha256(payment_request.encode()).hexdigest()
+    return await reserve_withdrawal(flip_id, amount_msat, payment_request, payment_hash)
+
+
+async def get_withdrawal(withdrawal_id: str) -> PendingWithdrawal:
+    return await db.fetchone(
+        "SELECT * FROM lnurlFlip.pending_withdrawals WHERE id = :id",
+        {"id": withdrawal_id},
+        PendingWithdrawal,
+    )
+
+
+async def test_reserve_holds_balance(make_flip):
+    flip = await make_flip(100_000)
+
+    assert await queue(flip.id, 60_000)
+    assert await get_lnurlflip_balance(flip.id) == 40_000
+    assert await queue(flip.id, 60_000) is None
+
+
+async def test_reserve_rejects_same_invoice(make_flip):
+    flip = await make_flip(100_000)
+    await reserve_withdrawal(flip.id, 10_000, "lnfake-dup", "dup-hash")
+
+    with pytest.raises(ValueError, match="already submitted"):
+        await reserve_withdrawal(flip.id, 10_000, "lnfake-dup", "dup-hash")
+
+
+async def test_claim_and_complete(adapter, make_flip):
+    flip = await make_flip(100_000)
+    withdrawal_id = await queue(flip.id, 30_000)
+
+    [job] = await claim_withdrawals(limit=5)
+    assert (job.id, job.status, job.attempts) == (withdrawal_id, "processing", 1)
+    assert await claim_withdrawals(limit=5) == []
+
+    await execute_withdrawal(job)
+
+    assert (await get_withdrawal(withdrawal_id)).status == "completed"
+    assert [p.wallet_id for p in adapter.payments] == [flip.wallet]
+    assert (await get_lnurlFlip(flip.id)).total_msat == 70_000
+    assert await get_lnurlflip_balance(flip.id) == 70_000
+
+
+async def test_fail_releases_reservation(make_flip):
+    flip = await make_flip(100_000)
+    withdrawal_id = await queue(flip.id, 30_000)
+    await claim_withdrawals()
+
+    await fail_withdrawal(withdrawal_id, "no route")
+
+    withdrawal = await get_withdrawal(withdrawal_id)
+    assert (withdrawal.status, withdrawal.error) == ("failed", "no route")
+    assert (await get_lnurlFlip(flip.id)).total_msat == 100_000
+    assert await get_lnurlflip_balance(flip.id) == 100_000
+
+
+async def test_stale_job_without_payment_is_requeued(adapter, make_flip):
+    flip = await make_flip(100_000)
+    withdrawal_id = await queue(flip.id, 30_000)
+    [job] = await claim_withdrawals()
+
+    await resolve_stale_withdrawal(job)
+
+    assert (await get_withdrawal(withdrawal_id)).status == "pending"
+    assert await get_lnurlflip_balance(flip.id) == 70_000
+
+
+async def test_stale_job_gives_up_after_max_attempts(adapter, make_flip):
+    flip = await make_flip(100_000)
+    withdrawal_id = await queue(flip.id, 30_000)
+    [job] = await claim_withdrawals()
+    job.attempts = WITHDRAWAL_MAX_ATTEMPTS
+
+    await resolve_stale_withdrawal(job)
+
+    assert (await get_withdrawal(withdrawal_id)).status == "failed"
+    assert await get_lnurlflip_balance(flip.id) == 100_000
+
+
+@pytest.mark.parametrize(
+    "outcome, status, total_msat",
+    [("success", "completed", 70_000), ("failed", "failed", 100_000)],
+)
+async def test_stale_job_follows_lnbits_outcome(adapter, make_flip, outcome, status, total_msat):
+    flip = await make_flip(100_000)
+    withdrawal_id = await queue(flip.id, 30_000)
+    [job] = await claim_withdrawals()
+    adapter.payments.append(SimpleNamespace(payment_hash=job.payment_hash, status=outcome))
+
+    await resolve_stale_withdrawal(job)
+
+    assert (await get_withdrawal(withdrawal_id)).status == status
+    assert (await get_lnurlFlip(flip.id)).total_msat == total_msat
+    assert await get_lnurlflip_balance(flip.id) == total_msat
@@ -1,9 +1,90 @@
-from lnbits.extensions.withdraw.crud import get_withdraw_link
+import asyncio
+import ipaddress
+import json
+import os
+from typing import Any, Optional
+from urllib.parse import urlsplit
+
+from fastapi.responses import JSONResponse
+
+from .adapters import get_adapter
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response for hot read endpoints. Routes return it directly with
+    plain dicts/lists, which skips FastAPI's response-model validation and
+    jsonable_encoder pass; orjson is used when installed.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+WEBHOOK_ALLOW_PRIVATE_ENV = "LNURLFLIP_WEBHOOK_ALLOW_PRIVATE"
+INTERNAL_HOST_SUFFIXES = (".localhost", ".local", ".internal")
+
+
+def private_webhooks_allowed() -> bool:
+    """Whether the operator opted in to webhooks on loopback/private networks."""
+    return os.getenv(WEBHOOK_ALLOW_PRIVATE_ENV, "").lower() in {"1", "true", "yes"}
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    return ip.is_global and not ip.is_multicast
+
+
+def webhook_url_error(url: str) -> Optional[str]:
+    """
+    Why a webhook URL may not be used, or None. Any invoice-key holder can
+    set one and the node POSTs to it, so loopback, private, link-local and
+    metadata addresses are refused unless WEBHOOK_ALLOW_PRIVATE_ENV is set.
+    Names are only checked here; webhooks.py checks what they resolve to.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return "webhook_url must be an http(s) URL"
+    try:
+        parts.port
+    except ValueError:
+        return "webhook_url has an invalid port"
+    if private_webhooks_allowed():
+        return None
+    host = parts.hostname.rstrip(".").lower()
+    if host == "localhost" or host.endswith(INTERNAL_HOST_SUFFIXES):
+        return "webhook_url must not point at a local host"
+    try:
+        public = is_public_address(host)
+    except ValueError:
+        return None  # A name
+    return None if public else "webhook_url must not point at a private address"
+
+
+async def wait_for_event(event: asyncio.Event, timeout: float) -> bool:
+    """
+    Wait until `event` is set or `timeout` passes; return whether it is set.
+    asyncio.wait_for on Python 3.11 can swallow a cancel that arrives in the
+    same tick as the event, which leaves a background loop running after stop.
+    """
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        await asyncio.wait({waiter}, timeout=timeout)
+    finally:
+        waiter.cancel()
+    return event.is_set()
 
 
 async def get_withdraw_link_info(withdraw_id: str):
     try:
-        withdraw_link = await get_withdraw_link(withdraw_id)
+        withdraw_link = await get_adapter().get_withdraw_link(withdraw_id)
         if withdraw_link:
             return {
                 "id": withdraw_link.id,
@@ -1,3 +1,4 @@
+import mimetypes
 from http import HTTPStatus
 
 from fastapi import APIRouter, Depends, Request
@@ -6,16 +7,19 @@ from lnbits.decorators import check_user_exists
 from lnbits.helpers import template_renderer
 from lnbits.settings import settings
 from starlette.exceptions import HTTPException
-from starlette.responses import HTMLResponse
+from starlette.responses import FileResponse, HTMLResponse
 
-from .crud import get_lnurlFlip
+from .assets import asset_url, hashed_asset_path
+from .crud import get_lnurlflip_record
 from lnurl import encode as lnurl_encode
 
 lnurlFlip_generic_router = APIRouter()
 
 
 def lnurlFlip_renderer():
-    return template_renderer(["lnurlFlip/templates"])
+    renderer = template_renderer(["lnurlFlip/templates"])
+    renderer.env.globals["lnurlflip_asset"] = asset_url
+    return renderer
 
 
 #######################################
@@ -33,12 +37,38 @@ async def index(request: Request, user: User = Depends(check_user_exists)):
     )
 
 
+# Fingerprinted static assets (see assets.py), cacheable forever
+
+
+@lnurlFlip_generic_router.get("/assets/{path:path}")
+async def assets(request: Request, path: str):
+    asset = hashed_asset_path(path)
+    if not asset or not asset.is_file():
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Not found")
+
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept-Encoding",
+    }
+    media_type = mimetypes.guess_type(asset.name)[0] or "application/octet-stream"
+    accepted = {
+        part.split(";")[0].strip()
+        for part in request.headers.get("accept-encoding", "").split(",")
+    }
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        variant = asset.with_name(asset.name + suffix)
+        if encoding in accepted and variant.is_file():
+            headers["Content-Encoding"] = encoding
+            return FileResponse(variant, media_type=media_type, headers=headers)
+    return FileResponse(asset, media_type=media_type, headers=headers)
+
+
 # Frontend shareable page
 
 
 @lnurlFlip_generic_router.get("/{lnurlFlip_id}")
 async def lnurlFlip(request: Request, lnurlFlip_id):
-    lnurlFlip = await get_lnurlFlip(lnurlFlip_id)
+    lnurlFlip = await get_lnurlflip_record(lnurlFlip_id)
     if not lnurlFlip:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND, detail="LnurlFlip does not exist."
@@ -66,7 +96,7 @@ async def lnurlFlip(request: Request, lnurlFlip_id):
 
 @lnurlFlip_generic_router.get("/manifest/{lnurlFlip_id}.webmanifest")
 async def manifest(lnurlFlip_id: str):
-    lnurlFlip = await get_lnurlFlip(lnurlFlip_id)
+    lnurlFlip = await get_lnurlflip_record(lnurlFlip_id)
     if not lnurlFlip:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND, detail="LnurlFlip does not exist."
@@ -1,50 +1,82 @@
+import asyncio
 from http import HTTPStatus
 from fastapi import APIRouter, Depends, Query, Request, HTTPException
-from fastapi.responses import Response
+from fastapi.responses import PlainTextResponse, Response
 from lnbits.core.crud import get_user
 from lnbits.core.models import User
-from lnbits.decorators import WalletTypeInfo, check_user_exists
-from lnbits.core.services import create_invoice, pay_invoice
-from lnbits.core.crud import get_wallet
-from lnbits.extensions.lnurlp.crud import get_pay_link
+from lnbits.core.models import Account
+from lnbits.decorators import WalletTypeInfo, check_admin, check_user_exists
 from lnbits.bolt11 import decode as decode_bolt11
 from loguru import logger
-from typing import Optional
+from typing import Optional, Tuple
 from lnbits.decorators import require_admin_key, require_invoice_key
 from lnbits.helpers import urlsafe_short_hash
 from lnurl import encode as lnurl_encode
 
-# Balance constants (in millisatoshis)
-MIN_WITHDRAWABLE_MSAT = 50000       # 50 sats minimum withdrawable amount
-
 from .crud import (
+    add_pool_member,
     create_lnurlflip,
     delete_lnurlFlip,
     get_lnurlFlip,
-    get_lnurlFlips,
+    get_lnurlflip_record,
+    get_lnurlflip_summaries,
     update_lnurlFlip,
     get_lnurlflip_balance,
+    get_lnurlflip_with_balance,
+    get_lnurlflips_with_balance,
+    get_backfill_progress,
     get_flip_comments,
-    check_duplicate_name,
-    process_payment_with_lock,
+    get_pool_members,
+    get_scan_counts,
+    save_invoice_comment,
+    search_comments,
+    remove_pool_member,
+    reserve_withdrawal,
+    set_pool_policy,
+    get_daily_stats,
+    stats_day,
     db
 )
-from .models import CreateLnurlFlipData, LnurlFlip
-from .utils import get_withdraw_link_info
-import time
+from .adapters import get_adapter
+from .counters import scan_counters
+from .models import (
+    CreateLnurlFlipData,
+    CreatePoolMemberData,
+    FlipDailyStats,
+    LnurlFlip,
+    LnurlFlipRecord,
+    MIN_WITHDRAWABLE_MSAT,
+    PoolMember,
+    ResolveFlipsData,
+    SetPoolPolicyData,
+    StartProfilerData,
+)
+from .invoices import InvoiceSpec, invoice_pool
+from .pools import pool_selector
+from .profiler import LISTENER_TARGET, ProfiledRoute, profiler
+from .tasks import notify_withdrawal_queued
+from .utils import FastJSONResponse, get_withdraw_link_info
 import logging
+from datetime import date, timedelta
 
-lnurlFlip_api_router = APIRouter()
+lnurlFlip_api_router = APIRouter(route_class=ProfiledRoute)
 
 logging.basicConfig(level=logging.INFO)
 
 
-async def create_payment_response(request: Request, lnurlflip_id: str, pay_link) -> dict:
+def member_query(member: Optional[PoolMember]) -> str:
+    """Carries the chosen pool member from the redirect to the callback."""
+    return f"?member={member.id}" if member else ""
+
+
+async def create_payment_response(
+    request: Request, lnurlflip_id: str, pay_link, member: Optional[PoolMember] = None
+) -> dict:
     """Create a standardized LNURL payment response."""
     callback_url = str(request.url_for(
         "lnurlFlip.api_lnurl_callback",
         lnurlflip_id=lnurlflip_id
-    ))
+    )) + member_query(member)
     
     return {
         "tag": "payRequest",
@@ -55,6 +87,108 @@ async def create_payment_response(request: Request, lnurlflip_id: str, pay_link)
     }
 
 
+def pay_callback_response(bolt11: str) -> dict:
+    return {
+        "pr": bolt11,
+        "successAction": {
+            "tag": "message",
+            "message": "Payment received!"
+        },
+        "routes": []
+    }
+
+
+def is_fixed_amount(pay_link, amount_msat: int) -> bool:
+    """Whether every payer of this link asks for the same sat amount."""
+    return (
+        pay_link.min == pay_link.max
+        and not getattr(pay_link, "currency", None)
+        and amount_msat == int(pay_link.min) * 1000
+    )
+
+
+def resolve_mode(flip_balance_msat: int, wallet_balance_msat: int) -> str:
+    """
+    Decide which side of the flip a scan lands on. Use withdraw mode only if
+    the flip has a withdrawable balance and the wallet can cover it.
+    """
+    can_withdraw = (
+        flip_balance_msat >= MIN_WITHDRAWABLE_MSAT and  # Has minimum withdrawable balance
+        wallet_balance_msat >= flip_balance_msat  # Wallet can cover the withdrawal
+    )
+    return "withdraw" if can_withdraw else "payment"
+
+
+def withdraw_limits(
+    withdraw_min_sat: int, withdraw_max_sat: int, flip_balance_msat: int, wallet_balance_msat: int
+) -> Tuple[int, int]:
+    """
+    A withdraw link's limits (configured in sats) in msats, with the maximum
+    capped by the flip balance and then by what the wallet can pay.
+    """
+    effective_max_msat = min(withdraw_max_sat * 1000, flip_balance_msat)
+    if effective_max_msat > wallet_balance_msat:
+        effective_max_msat = max(0, wallet_balance_msat)
+    return withdraw_min_sat * 1000, effective_max_msat
+
+
+def with_member(lnurlflip: LnurlFlipRecord, member: PoolMember) -> LnurlFlipRecord:
+    """The flip as served by one of its pool members."""
+    return lnurlflip._replace(
+        wallet=member.wallet,
+        selectedLnurlp=member.selectedLnurlp,
+        selectedLnurlw=member.selectedLnurlw,
+    )
+
+
+async def select_pool_member(
+    lnurlflip: LnurlFlipRecord, flip_balance_msat: int
+) -> Tuple[LnurlFlipRecord, Optional[PoolMember], int]:
+    """
+    Pick the member of a pooled flip that serves a scan, from the cached
+    pool: one that can pay out a withdrawal if the flip has a withdrawable
+    balance, otherwise one to take the payment. Returns the flip with the
+    member's wallet and links, the member and the balance it can pay out.
+    """
+    policy = lnurlflip.pool_policy
+    member = None
+    if flip_balance_msat >= MIN_WITHDRAWABLE_MSAT:
+        member = await pool_selector.select(
+            lnurlflip.id, policy, "withdraw", MIN_WITHDRAWABLE_MSAT
+        )
+    if member is None:
+        member = await pool_selector.select(lnurlflip.id, policy, "payment")
+    if member is None:
+        return lnurlflip, None, flip_balance_msat
+    return (
+        with_member(lnurlflip, member),
+        member,
+        min(flip_balance_msat, member.available_msat),
+    )
+
+
+def pay_link_summary(link) -> dict:
+    """The fields of an lnurlp link the dashboard shows."""
+    return {
+        "id": link.id,
+        "wallet": link.wallet,
+        "description": link.description,
+        "min": link.min,
+        "max": link.max,
+        "lnurl": getattr(link, "lnurl", None),
+    }
+
+
+def withdraw_link_summary(link) -> dict:
+    """The fields of a withdraw link the dashboard shows."""
+    return {
+        "id": link.id,
+        "wallet": link.wallet,
+        "title": link.title,
+        "min_withdrawable": link.min_withdrawable,
+        "max_withdrawable": link.max_withdrawable,
+        "lnurl": getattr(link, "lnurl", None),
+    }
 
 
 
@@ -68,8 +202,7 @@ async def create_payment_response(request: Request, lnurlflip_id: str, pay_link)
 @lnurlFlip_api_router.get("/api/v1/lnurlflip/lnurlp_links")
 async def api_get_lnurlp_links(wallet: WalletTypeInfo = Depends(require_invoice_key)):
     try:
-        from lnbits.extensions.lnurlp.crud import get_pay_links
-        pay_links = await get_pay_links(wallet_ids=[wallet.wallet.id])
+        pay_links = await get_adapter().get_pay_links([wallet.wallet.id])
 
         formatted_links = [
             {
@@ -107,27 +240,77 @@ async def api_lnurlFlips(
         user = await get_user(wallet.wallet.user)
         wallet_ids = user.wallet_ids if user else []
 
-    records = await get_lnurlFlips(wallet_ids)
-    result = []
-
-    for record in records:
-        # Get comment count for each record
-        comment_count = await db.fetchone(
-            "SELECT COUNT(*) as count FROM lnurlFlip.invoice_comments WHERE flip_id = :flip_id",
-            {"flip_id": record.id}
+    # Balances and comment counts come back with the flips in one query
+    return FastJSONResponse(await get_lnurlflip_summaries(wallet_ids))
+
+@lnurlFlip_api_router.get("/api/v1/dashboard", status_code=HTTPStatus.OK)
+async def api_dashboard(wallet: WalletTypeInfo = Depends(require_invoice_key)):
+    """
+    Everything the admin page needs on load in one round trip: the user's
+    flips with balances and comment counts, their linked pay/withdraw links,
+    and the pay/withdraw links available for the create/edit form.
+    """
+    user = await get_user(wallet.wallet.user)
+    wallet_ids = user.wallet_ids if user else [wallet.wallet.id]
+    adapter = get_adapter()
+
+    # The flips query and both extension lookups are independent
+    flips, pay_links, withdraw_links = await asyncio.gather(
+        get_lnurlflip_summaries(wallet_ids),
+        adapter.get_pay_links(wallet_ids),
+        adapter.get_withdraw_links(wallet_ids),
+        return_exceptions=True
+    )
+    if isinstance(flips, BaseException):
+        raise flips
+    # A missing or failing extension leaves its links out rather than the page
+    if isinstance(pay_links, BaseException):
+        logger.warning(f"Dashboard - could not load pay links: {str(pay_links)}")
+        pay_links = []
+    if isinstance(withdraw_links, BaseException):
+        logger.warning(f"Dashboard - could not load withdraw links: {str(withdraw_links)}")
+        withdraw_links = []
+
+    pay_by_id = {link.id: pay_link_summary(link) for link in pay_links}
+    withdraw_by_id = {link.id: withdraw_link_summary(link) for link in withdraw_links}
+
+    # Links the wallet listings missed are fetched by id, but only shown if
+    # they belong to one of the user's wallets; others stay null
+    missing_pay = [f["selectedLnurlp"] for f in flips if f["selectedLnurlp"] not in pay_by_id]
+    missing_withdraw = [f["selectedLnurlw"] for f in flips if f["selectedLnurlw"] not in withdraw_by_id]
+    if missing_pay or missing_withdraw:
+        extra_pay, extra_withdraw = await asyncio.gather(
+            adapter.get_pay_links_by_id(missing_pay),
+            adapter.get_withdraw_links_by_id(missing_withdraw),
+            return_exceptions=True
         )
-        data = record.dict()
-        data['comment_count'] = comment_count['count'] if comment_count else 0
-        result.append(data)
-
-    return result
+        if not isinstance(extra_pay, BaseException):
+            pay_by_id.update({
+                i: pay_link_summary(link) for i, link in extra_pay.items()
+                if link.wallet in wallet_ids
+            })
+        if not isinstance(extra_withdraw, BaseException):
+            withdraw_by_id.update({
+                i: withdraw_link_summary(link) for i, link in extra_withdraw.items()
+                if link.wallet in wallet_ids
+            })
+
+    for flip in flips:
+        flip["pay_link"] = pay_by_id.get(flip["selectedLnurlp"])
+        flip["withdraw_link"] = withdraw_by_id.get(flip["selectedLnurlw"])
+
+    return FastJSONResponse({
+        "flips": flips,
+        "pay_links": [pay_link_summary(link) for link in pay_links],
+        "withdraw_links": [withdraw_link_summary(link) for link in withdraw_links],
+    })
 
 @lnurlFlip_api_router.get("/api/v1/balance/{lnurlflip_id}")
 async def api_get_balance(
     lnurlflip_id: str,
     wallet: WalletTypeInfo = Depends(require_invoice_key)
 ) -> dict:
-    flip = await get_lnurlFlip(lnurlflip_id)
+    flip = await get_lnurlflip_record(lnurlflip_id)
     if not flip:
         raise HTTPException(status_code=404, detail="Not found")
     
@@ -138,7 +321,85 @@ async def api_get_balance(
             raise HTTPException(status_code=403, detail="Access denied")
     
     balance = await get_lnurlflip_balance(lnurlflip_id)
-    return {"balance": balance}
+    return FastJSONResponse({"balance": balance})
+
+RESOLVE_FIELDS = ["id", "mode", "min_msat", "max_msat", "balance_msat"]
+
+
+async def serving_flip(lnurlflip: LnurlFlipRecord, flip_balance_msat: int):
+    """
+    The flip as a scan would most likely see it, without advancing the pool
+    selection: a pooled flip that can pay out is served by its richest member.
+    """
+    if not lnurlflip.pool_policy:
+        return lnurlflip, flip_balance_msat
+    members = await pool_selector.members(lnurlflip.id)
+    richest = max(members, key=lambda m: m.available_msat, default=None)
+    if (
+        richest
+        and flip_balance_msat >= MIN_WITHDRAWABLE_MSAT
+        and richest.available_msat >= MIN_WITHDRAWABLE_MSAT
+    ):
+        return with_member(lnurlflip, richest), min(flip_balance_msat, richest.available_msat)
+    return lnurlflip, flip_balance_msat
+
+
+@lnurlFlip_api_router.post("/api/v1/resolve")
+async def api_resolve_flips(
+    data: ResolveFlipsData,
+    wallet: WalletTypeInfo = Depends(require_invoice_key)
+):
+    """
+    Mode, limits and available balance of many flips in one round trip, for
+    displays that poll. Flips come back as rows in RESOLVE_FIELDS order; ids
+    that don't exist or aren't the user's are listed under "missing". This
+    doesn't count as a scan.
+    """
+    ids = list(dict.fromkeys(data.ids))
+    found = await get_lnurlflips_with_balance(ids)
+
+    # Check the user has access to each flip, loading the user only if needed
+    wallet_ids = {wallet.wallet.id}
+    if any(flip.wallet != wallet.wallet.id for flip, _ in found.values()):
+        user = await get_user(wallet.wallet.user)
+        wallet_ids.update(user.wallet_ids if user else [])
+    requested = [found[i] for i in ids if i in found and found[i][0].wallet in wallet_ids]
+    missing = [i for i in ids if i not in found or found[i][0].wallet not in wallet_ids]
+
+    # One query for the members of every pooled flip, instead of one per flip
+    await pool_selector.preload([flip.id for flip, _ in requested if flip.pool_policy])
+    flips = await asyncio.gather(*(serving_flip(flip, balance) for flip, balance in requested))
+
+    # Links for both modes are fetched alongside the wallets, as in the redirect
+    adapter = get_adapter()
+    wallets, pay_links, withdraw_links = await asyncio.gather(
+        adapter.get_wallets_by_id(flip.wallet for flip, _ in flips),
+        adapter.get_pay_links_by_id(flip.selectedLnurlp for flip, _ in flips),
+        adapter.get_withdraw_links_by_id(flip.selectedLnurlw for flip, _ in flips)
+    )
+
+    rows = []
+    for (flip, balance), (original, _) in zip(flips, requested):
+        flip_wallet = wallets.get(flip.wallet)
+        wallet_balance_msat = flip_wallet.balance_msat if flip_wallet else 0
+        mode = resolve_mode(balance, wallet_balance_msat)
+        min_msat = max_msat = None
+        if mode == "payment":
+            pay_link = pay_links.get(flip.selectedLnurlp)
+            if pay_link:
+                min_msat, max_msat = int(pay_link.min) * 1000, int(pay_link.max) * 1000
+        else:
+            withdraw_link = withdraw_links.get(flip.selectedLnurlw)
+            if withdraw_link:
+                min_msat, max_msat = withdraw_limits(
+                    withdraw_link.min_withdrawable,
+                    withdraw_link.max_withdrawable,
+                    balance,
+                    wallet_balance_msat
+                )
+        rows.append([original.id, mode, min_msat, max_msat, balance])
+
+    return FastJSONResponse({"fields": RESOLVE_FIELDS, "flips": rows, "missing": missing})
 
 @lnurlFlip_api_router.get("/api/v1/lnurl/{lnurlflip_id}")
 async def api_get_lnurl(
@@ -146,7 +407,7 @@ async def api_get_lnurl(
     lnurlflip_id: str,
     wallet: WalletTypeInfo = Depends(require_invoice_key)
 ):
-    flip = await get_lnurlFlip(lnurlflip_id)
+    flip = await get_lnurlflip_record(lnurlflip_id)
     if not flip:
         raise HTTPException(status_code=404, detail="Not found")
     
@@ -177,7 +438,7 @@ async def api_lnurlFlip(
     lnurlflip_id: str,
     wallet: WalletTypeInfo = Depends(require_invoice_key)
 ):
-    lnurlflip = await get_lnurlFlip(lnurlflip_id)
+    lnurlflip = await get_lnurlflip_record(lnurlflip_id)
     if not lnurlflip:
         raise HTTPException(status_code=404, detail="Not found")
     
@@ -194,10 +455,17 @@ async def api_lnurlFlip(
         {"flip_id": lnurlflip_id}
     )
     
-    data = lnurlflip.dict()
+    # Scan counters: what was flushed plus what this node still holds
+    scans = await get_scan_counts(lnurlflip_id)
+    unflushed = scan_counters.unflushed(lnurlflip_id)
+
+    data = lnurlflip._asdict()
     data['balance'] = balance
     data['comment_count'] = comment_count['count'] if comment_count else 0
-    return data
+    for field in ("scans", "pay_scans", "withdraw_scans"):
+        data[field] = scans[field] + unflushed[field]
+    data['last_scan_time'] = max(scans["last_scan_time"] or 0, unflushed.get("last_scan_time", 0)) or None
+    return FastJSONResponse(data)
 
 
 
@@ -205,45 +473,49 @@ async def api_lnurlFlip(
 @lnurlFlip_api_router.get("/api/v1/redirect/{lnurlflip_id}")
 async def api_lnurlflip_redirect(request: Request, lnurlflip_id: str):
    logging.info(f"Redirect request for id: {lnurlflip_id}")
-   lnurlflip = await get_lnurlFlip(lnurlflip_id)
-   if not lnurlflip:
+   # Flip and balance (all balances in msats for consistency) in one query
+   found = await get_lnurlflip_with_balance(lnurlflip_id)
+   if not found:
        logger.error(f"Record not found for lnurlflip_id: {lnurlflip_id}")
        raise HTTPException(status_code=404, detail="Not found")
-
-   # Get balance information (all balances in msats for consistency)
-   flip_balance_msat = await get_lnurlflip_balance(lnurlflip_id)
-
-   # Check actual wallet balance
-   from lnbits.core.crud import get_wallet
-   wallet = await get_wallet(lnurlflip.wallet)
+   lnurlflip, flip_balance_msat = found
+   member = None
+   if lnurlflip.pool_policy:
+       lnurlflip, member, flip_balance_msat = await select_pool_member(
+           lnurlflip, flip_balance_msat
+       )
+
+   # The mode depends on the wallet balance, so fetch both links
+   # speculatively alongside it rather than after it
+   adapter = get_adapter()
+   wallet, pay_link, withdraw_info = await asyncio.gather(
+       adapter.get_wallet(lnurlflip.wallet),
+       adapter.get_pay_link(lnurlflip.selectedLnurlp),
+       get_withdraw_link_info(lnurlflip.selectedLnurlw),
+       return_exceptions=True
+   )
+   if isinstance(wallet, BaseException):
+       raise wallet
    actual_balance_msat = wallet.balance_msat
 
-   # Simplified state determination logic:
-   # Use withdraw mode only if flip has withdrawable balance
-   # and wallet can cover the withdrawal
-   can_withdraw = (
-       flip_balance_msat >= MIN_WITHDRAWABLE_MSAT and  # Has minimum withdrawable balance
-       actual_balance_msat >= flip_balance_msat  # Wallet can cover the withdrawal
-   )
-   
-   # Log the decision
-   mode = "withdraw" if can_withdraw else "payment"
+   mode = resolve_mode(flip_balance_msat, actual_balance_msat)
+   scan_counters.record(lnurlflip_id, mode)  # In memory, flushed in bulk
    logger.debug(f"Using {mode} mode - flip: {flip_balance_msat // 1000} sats, wallet: {actual_balance_msat // 1000} sats")
    
    # Generate appropriate response based on withdrawal capability
-   if not can_withdraw:
-       # Payment mode response
-       pay_link = await get_pay_link(lnurlflip.selectedLnurlp)
+   if mode == "payment":
+       # Payment mode response; a failed speculative fetch only matters here
+       if isinstance(pay_link, BaseException):
+           raise pay_link
        if not pay_link:
            logger.error(f"Payment link not found: {lnurlflip.selectedLnurlp} for flip_id: {lnurlflip_id}")
            raise HTTPException(status_code=404, detail="Not found")
        
-       return await create_payment_response(request, lnurlflip_id, pay_link)
+       return FastJSONResponse(
+           await create_payment_response(request, lnurlflip_id, pay_link, member)
+       )
    else:
        # Withdraw mode response
-       
-       # Get withdraw link configuration
-       withdraw_info = await get_withdraw_link_info(lnurlflip.selectedLnurlw)
        if "error" in withdraw_info:
            logger.error(f"Withdraw link not found: {lnurlflip.selectedLnurlw} for flip_id: {lnurlflip_id}")
            raise HTTPException(status_code=404, detail="Withdraw link not found")
@@ -251,33 +523,26 @@ async def api_lnurlflip_redirect(request: Request, lnurlflip_id: str):
        callback_url = str(request.url_for(
            "lnurlFlip.api_withdraw_callback",
            lnurlflip_id=lnurlflip_id
-       ))
-       
-       # Use withdraw link's configured limits (converting from sats to msats)
-       min_withdrawable_msat = withdraw_info["min_withdrawable"] * 1000
-       max_withdrawable_msat = withdraw_info["max_withdrawable"] * 1000
-       
+       )) + member_query(member)
        
-       # Apply constraints: flip balance and wallet balance
-       # First, limit to flip balance
-       effective_max_msat = min(max_withdrawable_msat, flip_balance_msat)
-       
-       # Then, ensure we don't exceed available wallet balance
-       if effective_max_msat > actual_balance_msat:
-           effective_max_msat = max(0, actual_balance_msat)
-           
-       max_withdrawable_msat = effective_max_msat
+       # The link's configured limits, capped by the flip and wallet balances
+       min_withdrawable_msat, max_withdrawable_msat = withdraw_limits(
+           withdraw_info["min_withdrawable"],
+           withdraw_info["max_withdrawable"],
+           flip_balance_msat,
+           actual_balance_msat
+       )
        
        logger.info(f"Withdraw limits for {lnurlflip_id[:8]}... - min: {min_withdrawable_msat // 1000} sats, max: {max_withdrawable_msat // 1000} sats")
        
-       return {
+       return FastJSONResponse({
            "tag": "withdrawRequest",
            "callback": callback_url,
            "k1": urlsafe_short_hash(),
            "minWithdrawable": min_withdrawable_msat,
            "maxWithdrawable": max_withdrawable_msat,
            "defaultDescription": f"Withdraw from {lnurlflip.name}"
-       }
+       })
 
 @lnurlFlip_api_router.get(
     "/api/v1/lnurl/cb/{lnurlflip_id}",
@@ -287,14 +552,50 @@ async def api_lnurl_callback(
     request: Request,
     lnurlflip_id: str,
     amount: int = Query(...),
-    comment: Optional[str] = Query(None, max_length=500, regex="^[^<>]*$")
+    comment: Optional[str] = Query(None, max_length=500, regex="^[^<>]*$"),
+    member: Optional[str] = Query(None)
 ):
-    lnurlflip = await get_lnurlFlip(lnurlflip_id)
+    lnurlflip = await get_lnurlflip_record(lnurlflip_id)
     if not lnurlflip:
         logger.error(f"Pay callback - record not found: {lnurlflip_id}")
         return {"status": "ERROR", "reason": "Invalid payment link"}
 
-    pay_link = await get_pay_link(lnurlflip.selectedLnurlp)
+    # Pooled flips take the payment on the member the redirect picked
+    pool_member = None
+    if lnurlflip.pool_policy:
+        pool_member = (
+            await pool_selector.member(lnurlflip_id, member) if member else None
+        ) or await pool_selector.select(lnurlflip_id, lnurlflip.pool_policy, "payment")
+        if pool_member:
+            lnurlflip = with_member(lnurlflip, pool_member)
+    member_id = pool_member.id if pool_member else None
+
+    # Fixed-amount links hand out an invoice minted ahead of time (see invoices.py)
+    if not comment and invoice_pool.watching(lnurlflip_id, member_id):
+        current_link = await invoice_pool.pay_link(lnurlflip.selectedLnurlp)
+        if (
+            not current_link
+            or current_link.wallet != lnurlflip.wallet
+            or not is_fixed_amount(current_link, int(current_link.min) * 1000)
+        ):
+            # Deleted, moved or no longer fixed-amount: stop minting for it
+            invoice_pool.discard(lnurlflip_id)
+        elif is_fixed_amount(current_link, amount):
+            preminted = invoice_pool.take(
+                lnurlflip_id, member_id, lnurlflip.wallet, current_link.id, amount,
+                f"{current_link.description}"
+            )
+            if preminted:
+                logger.info(f"Handed out pre-minted invoice for flip {lnurlflip_id[:8]}... hash: {preminted.payment_hash[:8]}...")
+                return pay_callback_response(preminted.bolt11)
+
+    # The pay link almost always lives on the flip's wallet, so fetch that
+    # wallet alongside the link instead of waiting for the link first
+    adapter = get_adapter()
+    pay_link, wallet = await asyncio.gather(
+        adapter.get_pay_link(lnurlflip.selectedLnurlp),
+        adapter.get_wallet(lnurlflip.wallet)
+    )
     if not pay_link:
         logger.error(f"Pay callback - payment link not found: {lnurlflip.selectedLnurlp}")
         return {"status": "ERROR", "reason": "Payment setup error"}
@@ -302,7 +603,8 @@ async def api_lnurl_callback(
     logger.debug(f"Payment link {pay_link.id} for flip {lnurlflip_id[:8]}...")
     
     # Validate that the wallet exists
-    wallet = await get_wallet(pay_link.wallet)
+    if not wallet or wallet.id != pay_link.wallet:
+        wallet = await adapter.get_wallet(pay_link.wallet)
     if not wallet:
         logger.error(f"Wallet not found: {pay_link.wallet}")
         return {"status": "ERROR", "reason": "Wallet configuration error"}
@@ -311,41 +613,45 @@ async def api_lnurl_callback(
     logger.info(f"Wallet found - ID: {wallet.id}, Name: {wallet.name}, Balance: {wallet.balance_msat} msats")
     
     # Check funding source
-    from lnbits.wallets import get_funding_source
-    funding_source = get_funding_source()
+    funding_source = adapter.get_funding_source()
     logger.info(f"Funding source: {type(funding_source).__name__}")
 
-    if comment:
-        comment_id = urlsafe_short_hash()
-        await db.execute(
-            """
-            INSERT INTO lnurlFlip.invoice_comments 
-            (id, flip_id, comment, timestamp, amount_msat)
-            VALUES (:id, :flip_id, :comment, :timestamp, :amount_msat)
-            """,
-            {
-                "id": comment_id,
-                "flip_id": lnurlflip_id,
-                "comment": comment,
-                "timestamp": int(time.time()),
-                "amount_msat": amount  # Amount in msats from LNURL
-            }
+    # The comment is stored while the invoice is being created
+    save_comment = save_invoice_comment(lnurlflip_id, comment, amount) if comment else None
+
+    memo = f"{pay_link.description}{' - ' + comment if comment else ''}"
+    extra = {
+        "tag": "ext_lnurlflip",
+        "flip_id": lnurlflip_id,
+        "selectedLnurlp": lnurlflip.selectedLnurlp,
+        "link": pay_link.id,
+        "comment": comment if comment else None,
+        "member_id": member_id
+    }
+    if not comment and pay_link.wallet == lnurlflip.wallet and is_fixed_amount(pay_link, amount):
+        # Have the next payers' invoices ready before they ask
+        invoice_pool.watch(
+            lnurlflip_id,
+            member_id,
+            InvoiceSpec(pay_link.wallet, lnurlflip.selectedLnurlp, amount, memo, extra)
         )
 
-    
     try:
-        payment = await create_invoice(
+        create = adapter.create_invoice(
             wallet_id=pay_link.wallet,
             amount=amount // 1000,  # Convert from msats to sats for invoice creation
-            memo=f"{pay_link.description}{' - ' + comment if comment else ''}",
-            extra={
-                "tag": "ext_lnurlflip",
-                "flip_id": lnurlflip_id,
-                "selectedLnurlp": lnurlflip.selectedLnurlp,
-                "link": pay_link.id,
-                "comment": comment if comment else None
-            }
+            memo=memo,
+            extra=extra
         )
+        if save_comment:
+            payment, saved = await asyncio.gather(create, save_comment, return_exceptions=True)
+            if isinstance(payment, BaseException):
+                raise payment
+            if isinstance(saved, BaseException):
+                # The invoice exists; losing its comment must not fail the payer
+                logger.error(f"Could not save comment for flip {lnurlflip_id[:8]}...: {str(saved)}")
+        else:
+            payment = await create
         
         if not payment or not payment.bolt11:
             logger.error(f"Invoice creation failed - no payment object returned")
@@ -356,18 +662,9 @@ async def api_lnurl_callback(
         return {"status": "ERROR", "reason": f"Invoice creation error: {str(e)}"}
 
     # Do not update balance here - it will be updated when payment is confirmed in tasks.py
-    current_balance = await get_lnurlflip_balance(lnurlflip_id)
-    
     logger.info(f"Created invoice for flip {lnurlflip_id[:8]}... amount: {amount // 1000} sats, hash: {payment.payment_hash[:8]}...")
 
-    return {
-        "pr": payment.bolt11,
-        "successAction": {
-            "tag": "message",
-            "message": "Payment received!"
-        },
-        "routes": []
-    }
+    return pay_callback_response(payment.bolt11)
 
 
 @lnurlFlip_api_router.get(
@@ -379,21 +676,40 @@ async def api_withdraw_callback(
   request: Request,
   lnurlflip_id: str,
   k1: str = Query(...),
-  pr: str = Query(...)
+  pr: str = Query(...),
+  member: Optional[str] = Query(None)
 ):
-  lnurlflip = await get_lnurlFlip(lnurlflip_id)
-  if not lnurlflip:
+  found = await get_lnurlflip_with_balance(lnurlflip_id)  # Balance in msats
+  if not found:
       return {"status": "ERROR", "reason": "Record not found"}
-
-  # Get withdraw link configuration to validate limits
-  withdraw_info = await get_withdraw_link_info(lnurlflip.selectedLnurlw)
+  lnurlflip, available_balance_msat = found
+
+  invoice = decode_bolt11(pr)
+  amount_msat = invoice.amount_msat  # Amount from invoice in msats
+
+  # Pooled flips pay out from the member the redirect picked, limited to its share
+  pool_member = None
+  if lnurlflip.pool_policy:
+      pool_member = (
+          await pool_selector.member(lnurlflip_id, member) if member else None
+      ) or await pool_selector.select(
+          lnurlflip_id, lnurlflip.pool_policy, "withdraw", amount_msat
+      )
+      if not pool_member:
+          return {"status": "ERROR", "reason": "Insufficient balance for withdrawal"}
+      lnurlflip = with_member(lnurlflip, pool_member)
+      available_balance_msat = min(available_balance_msat, pool_member.available_msat)
+
+  # Withdraw link configuration (to validate limits) and the wallet balance
+  # are independent lookups
+  withdraw_info, wallet = await asyncio.gather(
+      get_withdraw_link_info(lnurlflip.selectedLnurlw),
+      get_adapter().get_wallet(lnurlflip.wallet)
+  )
   if "error" in withdraw_info:
       logger.error(f"Withdraw link not found: {lnurlflip.selectedLnurlw} for flip_id: {lnurlflip_id}")
       return {"status": "ERROR", "reason": "Withdraw link configuration error"}
 
-  amount_msat = decode_bolt11(pr).amount_msat  # Amount from invoice in msats
-  available_balance_msat = await get_lnurlflip_balance(lnurlflip_id)  # Balance in msats
-
   # Check against withdraw link limits
   min_withdrawable_msat = withdraw_info["min_withdrawable"] * 1000
   max_withdrawable_msat = withdraw_info["max_withdrawable"] * 1000
@@ -410,82 +726,39 @@ async def api_withdraw_callback(
   if amount_msat > available_balance_msat:
       return {"status": "ERROR", "reason": "Insufficient balance for withdrawal"}
 
-  withdraw_id = urlsafe_short_hash()
-  await db.execute(
-      """
-      INSERT INTO lnurlFlip.pending_withdrawals (id, flip_id, amount_msat, created_time, payment_request)
-      VALUES (:id, :flip_id, :amount_msat, :created_time, :payment_request)
-      """,
-      {
-          "id": withdraw_id,
-          "flip_id": lnurlflip_id,
-          "amount_msat": amount_msat,  # Store amount in msats
-          "created_time": int(time.time()),
-          "payment_request": pr
+  # Check wallet balance to ensure we have enough
+  if not wallet:
+      return {"status": "ERROR", "reason": "Wallet not found"}
+  wallet_balance_msat = wallet.balance_msat
+
+  logging.info(f"Withdraw attempt: amount={amount_msat} msat, wallet_balance={wallet_balance_msat} msat")
+
+  # Check if wallet has enough balance for withdrawal
+  if wallet_balance_msat < amount_msat:
+      logger.warning(f"Insufficient wallet balance for withdrawal: wallet={wallet_balance_msat}, amount={amount_msat}, flip_id={lnurlflip_id}")
+      return {
+          "status": "ERROR",
+          "reason": "Insufficient balance"
       }
-  )
 
+  # Reserve the funds and queue the payment; LNURL-withdraw lets us answer OK
+  # now and pay afterwards, so the callback never waits on routing
   try:
-      # Check wallet balance to ensure we have enough
-      from lnbits.core.crud import get_wallet
-      wallet = await get_wallet(lnurlflip.wallet)
-      wallet_balance_msat = wallet.balance_msat
-      
-      logging.info(f"Withdraw attempt: amount={amount_msat} msat, wallet_balance={wallet_balance_msat} msat")
-      
-      # Check if wallet has enough balance for withdrawal
-      if wallet_balance_msat < amount_msat:
-          logger.warning(f"Insufficient wallet balance for withdrawal: wallet={wallet_balance_msat}, amount={amount_msat}, flip_id={lnurlflip_id}")
-          return {
-              "status": "ERROR", 
-              "reason": "Insufficient balance"
-          }
-      
-      payment_hash = await pay_invoice(
-          wallet_id=lnurlflip.wallet,
-          payment_request=pr,
-          extra={
-              "tag": "ext_lnurlflip",
-              "lnurlwithdraw": True,
-              "flip_id": lnurlflip_id,
-              "selectedLnurlw": lnurlflip.selectedLnurlw,
-              "withdraw_id": withdraw_id
-          }
-      )
-      # Withdrawal processed
-
-      await db.execute(
-          """
-          UPDATE lnurlFlip.pending_withdrawals
-          SET status = 'completed'
-          WHERE payment_request = :payment_request
-          """,
-          {"payment_request": pr}
+      withdraw_id = await reserve_withdrawal(
+          lnurlflip_id, amount_msat, pr, invoice.payment_hash,
+          pool_member.id if pool_member else None
       )
+  except ValueError as e:
+      # The same invoice was submitted before
+      return {"status": "ERROR", "reason": str(e)}
+  if not withdraw_id:
+      return {"status": "ERROR", "reason": "Insufficient balance for withdrawal"}
 
-      # Use locked payment processing to prevent race conditions
-      increment_uses = amount_msat >= lnurlflip.total_msat
-      updated_flip = await process_payment_with_lock(
-          lnurlflip_id,
-          -amount_msat,  # Negative because we're withdrawing
-          increment_uses=increment_uses,
-          operation_type="withdrawal"
-      )
-
-      return {"status": "OK"}
-  except Exception as e:
-      await db.execute(
-          """
-          UPDATE lnurlFlip.pending_withdrawals
-          SET status = 'failed'
-          WHERE payment_request = :payment_request
-          """,
-          {"payment_request": pr}
-      )
-      # Log full error for debugging
-      logger.error(f"Withdrawal failed: {str(e)} flip_id={lnurlflip_id} amount_msat={amount_msat}")
-      # Return simple LNURL-compliant error response
-      return {"status": "ERROR", "reason": "Payment failed"}
+  if pool_member:
+      pool_selector.adjust(lnurlflip_id, pool_member.id, reserved_msat=amount_msat)
+  notify_withdrawal_queued()
+  logger.info(f"Queued withdrawal {withdraw_id} for flip {lnurlflip_id[:8]}... amount: {amount_msat // 1000} sats")
+  return {"status": "OK"}
 
 
 @lnurlFlip_api_router.put("/api/v1/lnurlflip/{lnurlflip_id}")
@@ -507,20 +780,20 @@ async def api_lnurlFlip_update(
     if lnurlflip.wallet != wallet.wallet.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    # Check for duplicate name if the name is being changed
-    if lnurlflip.name != data.name:
-        if await check_duplicate_name(data.name, lnurlflip.wallet, exclude_id=lnurlflip_id):
-            raise HTTPException(
-                status_code=HTTPStatus.BAD_REQUEST,
-                detail=f"A lnurlflip with the name '{data.name}' already exists in this wallet"
-            )
-
     # Update only the fields that exist in the new model
     lnurlflip.name = data.name
     lnurlflip.selectedLnurlp = data.selectedLnurlp
     lnurlflip.selectedLnurlw = data.selectedLnurlw
+    lnurlflip.webhook_url = data.webhook_url
 
-    return await update_lnurlFlip(lnurlflip)
+    try:
+        updated = await update_lnurlFlip(lnurlflip)
+    except ValueError as e:
+        # A duplicate name, rejected by the unique index
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(e)) from e
+    pool_selector.invalidate(lnurlflip_id)
+    invoice_pool.discard(lnurlflip_id)
+    return updated
 
 
 ## Create a new record
@@ -533,13 +806,7 @@ async def api_lnurlflip_create(
 ) -> LnurlFlip:
     data.wallet = data.wallet or key_type.wallet.id
     
-    # Check for duplicate name
-    if await check_duplicate_name(data.name, data.wallet):
-        raise HTTPException(
-            status_code=HTTPStatus.BAD_REQUEST,
-            detail=f"A lnurlflip with the name '{data.name}' already exists in this wallet"
-        )
-    
+    # Duplicate names are rejected by the unique index (see create_lnurlflip)
     lnurlflip_id = urlsafe_short_hash()
     lnurlflip = LnurlFlip(
         id=lnurlflip_id,
@@ -547,11 +814,15 @@ async def api_lnurlflip_create(
         wallet=data.wallet,
         selectedLnurlp=data.selectedLnurlp,
         selectedLnurlw=data.selectedLnurlw,
+        webhook_url=data.webhook_url,
         total_msat=0,  # Initialize total to 0
         uses=0    # Initialize uses to 0
     )
 
-    created_lnurlflip = await create_lnurlflip(lnurlflip)
+    try:
+        created_lnurlflip = await create_lnurlflip(lnurlflip)
+    except ValueError as e:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(e)) from e
     
     # Fetch the created LnurlFlip to ensure all fields are populated
     fetched_lnurlflip = await get_lnurlFlip(created_lnurlflip.id)
@@ -573,7 +844,143 @@ async def api_lnurlflip_delete(
     if lnurlflip.wallet != wallet.wallet.id:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    await delete_lnurlFlip(lnurlflip_id)
+    if not await delete_lnurlFlip(lnurlflip_id):
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT,
+            detail="The lnurlflip has queued withdrawals, try again once they finish"
+        )
+    pool_selector.invalidate(lnurlflip_id)
+    invoice_pool.discard(lnurlflip_id)
+    scan_counters.discard(lnurlflip_id)
+    return "", HTTPStatus.NO_CONTENT
+
+
+## Pools of wallets and links behind one flip (see pools.py)
+
+
+async def pool_response(lnurlflip_id: str, policy: Optional[str]) -> dict:
+    members = await get_pool_members(lnurlflip_id)
+    return {
+        "policy": policy,
+        "members": [
+            dict(member.dict(), available_msat=member.available_msat) for member in members
+        ],
+    }
+
+
+@lnurlFlip_api_router.get("/api/v1/lnurlflip/{lnurlflip_id}/pool")
+async def api_get_pool(
+    lnurlflip_id: str,
+    wallet: WalletTypeInfo = Depends(require_invoice_key)
+):
+    lnurlflip = await get_lnurlflip_record(lnurlflip_id)
+    if not lnurlflip:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # Check if user has access to this flip
+    if lnurlflip.wallet != wallet.wallet.id:
+        user = await get_user(wallet.wallet.user)
+        if not user or lnurlflip.wallet not in user.wallet_ids:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+    return await pool_response(lnurlflip_id, lnurlflip.pool_policy)
+
+
+@lnurlFlip_api_router.put("/api/v1/lnurlflip/{lnurlflip_id}/pool")
+async def api_set_pool_policy(
+    lnurlflip_id: str,
+    data: SetPoolPolicyData,
+    wallet: WalletTypeInfo = Depends(require_admin_key)
+):
+    """Turn the pool on with a policy, change the policy, or turn it off (null)"""
+    lnurlflip = await get_lnurlflip_record(lnurlflip_id)
+    if not lnurlflip:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # Admin operations require direct wallet ownership
+    if lnurlflip.wallet != wallet.wallet.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if data.policy is None and lnurlflip.pool_policy:
+        # Without the pool, funds held by other members could not be paid out
+        members = await get_pool_members(lnurlflip_id)
+        if any(m.id != lnurlflip_id and (m.balance_msat or m.reserved_msat) for m in members):
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                detail="Other pool members still hold funds"
+            )
+
+    await set_pool_policy(lnurlflip_id, data.policy)
+    pool_selector.invalidate(lnurlflip_id)
+    invoice_pool.discard(lnurlflip_id)
+    return await pool_response(lnurlflip_id, data.policy)
+
+
+@lnurlFlip_api_router.post(
+    "/api/v1/lnurlflip/{lnurlflip_id}/pool/members", status_code=HTTPStatus.CREATED
+)
+async def api_add_pool_member(
+    lnurlflip_id: str,
+    data: CreatePoolMemberData,
+    wallet: WalletTypeInfo = Depends(require_admin_key)
+) -> PoolMember:
+    lnurlflip = await get_lnurlflip_record(lnurlflip_id)
+    if not lnurlflip:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # Admin operations require direct wallet ownership
+    if lnurlflip.wallet != wallet.wallet.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not lnurlflip.pool_policy:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="Turn the pool on first"
+        )
+
+    # Members must be the owner's wallets, with links on those wallets
+    user = await get_user(wallet.wallet.user)
+    if not user or data.wallet not in user.wallet_ids:
+        raise HTTPException(status_code=403, detail="Access denied")
+    adapter = get_adapter()
+    pay_link, withdraw_link = await asyncio.gather(
+        adapter.get_pay_link(data.selectedLnurlp),
+        adapter.get_withdraw_link(data.selectedLnurlw)
+    )
+    if not pay_link or pay_link.wallet != data.wallet:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="Pay link not found on that wallet"
+        )
+    if not withdraw_link or withdraw_link.wallet != data.wallet:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="Withdraw link not found on that wallet"
+        )
+
+    member = await add_pool_member(lnurlflip_id, data)
+    pool_selector.invalidate(lnurlflip_id)
+    invoice_pool.discard(lnurlflip_id)
+    return member
+
+
+@lnurlFlip_api_router.delete("/api/v1/lnurlflip/{lnurlflip_id}/pool/members/{member_id}")
+async def api_remove_pool_member(
+    lnurlflip_id: str,
+    member_id: str,
+    wallet: WalletTypeInfo = Depends(require_admin_key)
+):
+    lnurlflip = await get_lnurlflip_record(lnurlflip_id)
+    if not lnurlflip:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # Admin operations require direct wallet ownership
+    if lnurlflip.wallet != wallet.wallet.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if not await remove_pool_member(lnurlflip_id, member_id):
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="Only other members without funds or queued withdrawals can be removed"
+        )
+    pool_selector.invalidate(lnurlflip_id)
+    invoice_pool.discard(lnurlflip_id)
     return "", HTTPStatus.NO_CONTENT
 
 
@@ -591,7 +998,7 @@ async def api_lnurlflip_create_invoice(
     memo: str = "",
     wallet: WalletTypeInfo = Depends(require_invoice_key)
 ) -> dict:
-    lnurlflip = await get_lnurlFlip(lnurlflip_id)
+    lnurlflip = await get_lnurlflip_record(lnurlflip_id)
     if not lnurlflip:
         raise HTTPException(status_code=404, detail="Not found")
     
@@ -605,7 +1012,7 @@ async def api_lnurlflip_create_invoice(
     # so tasks.py can grab the payment once its paid
 
     try:
-        payment = await create_invoice(
+        payment = await get_adapter().create_invoice(
             wallet_id=lnurlflip.wallet,
             amount=amount,  # Already in sats, no conversion needed
             memo=f"{memo} to {lnurlflip.name}" if memo else f"{lnurlflip.name}",
@@ -628,7 +1035,7 @@ async def api_get_comments(
     wallet: WalletTypeInfo = Depends(require_invoice_key)
 ) -> list[dict]:
     """Get comments for a flip"""
-    flip = await get_lnurlFlip(flip_id)
+    flip = await get_lnurlflip_record(flip_id)
     if not flip:
         raise HTTPException(status_code=404, detail="Not found")
     
@@ -641,5 +1048,98 @@ async def api_get_comments(
     comments = await get_flip_comments(flip_id)
     return comments
 
+@lnurlFlip_api_router.get("/api/v1/search/comments")
+async def api_search_comments(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    all_wallets: bool = Query(False),
+    wallet: WalletTypeInfo = Depends(require_invoice_key)
+) -> list[dict]:
+    """Search payment comments on the caller's flips, best match first"""
+    wallet_ids = [wallet.wallet.id]
+    if all_wallets:
+        user = await get_user(wallet.wallet.user)
+        wallet_ids = user.wallet_ids if user else []
+
+    # A page shorter than `limit` is the last one
+    return await search_comments(wallet_ids, q, limit, offset)
+
+@lnurlFlip_api_router.get("/api/v1/stats/{lnurlflip_id}")
+async def api_get_stats(
+    lnurlflip_id: str,
+    start: Optional[str] = Query(None),  # YYYY-MM-DD, defaults to 30 days ago
+    end: Optional[str] = Query(None),  # YYYY-MM-DD, defaults to today
+    wallet: WalletTypeInfo = Depends(require_invoice_key)
+) -> list[FlipDailyStats]:
+    """Get daily payment/withdrawal rollups for a flip"""
+    flip = await get_lnurlflip_record(lnurlflip_id)
+    if not flip:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    # Check if user has access to this flip
+    if flip.wallet != wallet.wallet.id:
+        user = await get_user(wallet.wallet.user)
+        if not user or flip.wallet not in user.wallet_ids:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+    try:
+        end_day = date.fromisoformat(end) if end else date.fromisoformat(stats_day())
+        start_day = date.fromisoformat(start) if start else end_day - timedelta(days=30)
+    except ValueError:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="Dates must be YYYY-MM-DD"
+        )
+    if start_day > end_day:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="start must not be after end"
+        )
+
+    return await get_daily_stats(lnurlflip_id, start_day.isoformat(), end_day.isoformat())
+
+## Profiling (admins only)
+
+
+@lnurlFlip_api_router.post("/api/v1/profiler", status_code=HTTPStatus.CREATED)
+async def api_start_profiler(
+    data: StartProfilerData, account: Account = Depends(check_admin)
+):
+    """Start a sampling session; it switches itself off after duration_seconds"""
+    targets = list(data.routes)
+    if data.listener:
+        targets.append(LISTENER_TARGET)
+    if not targets:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="Choose routes or the listener to profile"
+        )
+    return profiler.start(
+        targets, data.sample_percent, data.duration_seconds, data.interval_ms
+    )
+
+
+@lnurlFlip_api_router.get("/api/v1/profiler")
+async def api_get_profiler(account: Account = Depends(check_admin)):
+    return profiler.status()
+
+
+@lnurlFlip_api_router.get("/api/v1/profiler/profile", response_class=PlainTextResponse)
+async def api_get_profile(account: Account = Depends(check_admin)):
+    """Aggregated profile of the current or last session as collapsed stacks"""
+    return PlainTextResponse(profiler.collapsed())
+
+
+@lnurlFlip_api_router.delete("/api/v1/profiler")
+async def api_stop_profiler(account: Account = Depends(check_admin)):
+    profiler.stop()
+    return profiler.status()
+
+## Backfills (admins only)
+
+
+@lnurlFlip_api_router.get("/api/v1/backfills")
+async def api_get_backfills(account: Account = Depends(check_admin)):
+    """Progress of the online backfills (see backfills.py)"""
+    return await get_backfill_progress()
+
 # LNURL-specific routes
 
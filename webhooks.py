@@ -0,0 +1,227 @@
+"""
+Outbound webhooks for flip events.
+
+A flip with a webhook_url gets an event for every payment and withdrawal
+settled on it. It also gets mode_changed when its balance crosses the
+withdrawable minimum. crud.enqueue_flip_events writes the events to
+webhook_outbox in the settlement's own transaction, so the listener never
+waits on HTTP and no settled event is lost.
+
+WEBHOOK_WORKERS delivery workers per node then drain the outbox:
+
+- A worker claims up to WEBHOOK_BATCH_MAX due events for one endpoint and
+  POSTs them as {"events": [...]} in one request. Any 2xx response counts
+  as delivered, and the events are deleted.
+- A failed request puts the events back with exponential backoff and
+  jitter. After WEBHOOK_MAX_ATTEMPTS they are kept as 'failed'.
+- Each endpoint has a circuit breaker. After WEBHOOK_CIRCUIT_FAILURES
+  failures in a row it opens for WEBHOOK_CIRCUIT_OPEN_SECONDS. Events for
+  that endpoint are then postponed without using up attempts. After that a
+  single batch probes the endpoint, and success closes the circuit again.
+  Breakers are kept per node.
+
+Endpoints on loopback, private, link-local or metadata addresses are
+refused (see utils.webhook_url_error), both when the URL is set and, after
+resolving its name, before every delivery. The POST then connects to the
+address that was checked, with the name sent as Host and TLS server name, so
+a second lookup cannot point it elsewhere. Redirects are not followed. Set
+LNURLFLIP_WEBHOOK_ALLOW_PRIVATE=1 to allow such endpoints.
+
+Delivery is at least once. A node can die after the POST but before the
+delete, and its claimed events are retried once WEBHOOK_CLAIM_TIMEOUT_SECONDS
+passes. Receivers should dedupe on the event "id".
+"""
+
+import asyncio
+import random
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger
+
+from .crud import claim_webhook_batch, delete_webhook_events, retry_webhook_events
+from .utils import (
+    is_public_address,
+    private_webhooks_allowed,
+    wait_for_event,
+    webhook_url_error,
+)
+
+WEBHOOK_WORKERS = 4
+WEBHOOK_BATCH_MAX = 50
+WEBHOOK_TIMEOUT_SECONDS = 10
+WEBHOOK_POLL_SECONDS = 5  # Fallback poll when no wake-up arrives
+WEBHOOK_CLAIM_TIMEOUT_SECONDS = 60  # Claimed events older than this are retried
+WEBHOOK_MAX_ATTEMPTS = 12
+WEBHOOK_BACKOFF_BASE_SECONDS = 5
+WEBHOOK_BACKOFF_MAX_SECONDS = 3600
+WEBHOOK_CIRCUIT_FAILURES = 5
+WEBHOOK_CIRCUIT_OPEN_SECONDS = 60
+
+webhook_wakeup = asyncio.Event()
+
+
+def notify_webhooks_queued() -> None:
+    """Wake the delivery workers after events were queued."""
+    webhook_wakeup.set()
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before the next attempt: doubling per attempt, capped, with jitter."""
+    delay = min(WEBHOOK_BACKOFF_MAX_SECONDS, WEBHOOK_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class CircuitBreaker:
+    """Per-endpoint failure tracking: closed, open until a time, then one probe."""
+
+    def __init__(
+        self,
+        failures: int = WEBHOOK_CIRCUIT_FAILURES,
+        open_seconds: float = WEBHOOK_CIRCUIT_OPEN_SECONDS,
+    ):
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self._failed: Dict[str, int] = {}
+        self._open_until: Dict[str, float] = {}
+        self._probing: Dict[str, bool] = {}
+
+    def blocked_until(self, url: str) -> Optional[float]:
+        """When the endpoint may be tried again, or None if it may be tried now."""
+        until = self._open_until.get(url)
+        if until is None:
+            return None
+        now = time.time()
+        if now < until or self._probing.get(url):
+            return max(until, now + 1)
+        self._probing[url] = True  # Half open: this batch is the probe
+        return None
+
+    def record(self, url: str, ok: bool) -> None:
+        self._probing.pop(url, None)
+        if ok:
+            if url in self._open_until:
+                logger.info(f"Webhook endpoint {url} recovered, closing circuit")
+            self._failed.pop(url, None)
+            self._open_until.pop(url, None)
+            return
+        failed = self._failed.get(url, 0) + 1
+        self._failed[url] = failed
+        if failed >= self.failures:
+            if url not in self._open_until or time.time() >= self._open_until[url]:
+                logger.warning(f"Webhook endpoint {url} failing, opening circuit for {self.open_seconds}s")
+            self._open_until[url] = time.time() + self.open_seconds
+
+
+circuits = CircuitBreaker()
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS, follow_redirects=False)
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def resolve_endpoint(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Resolve `url` once and check the node may POST to it right now. Returns
+    (address, error): the address to connect to, or None to leave resolution
+    to httpx (private endpoints allowed), and why not to POST, or None.
+    """
+    error = webhook_url_error(url)
+    if error or private_webhooks_allowed():
+        return None, error
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    try:
+        addresses = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, port, type=socket.SOCK_STREAM
+        )
+    except OSError as e:
+        return None, f"Could not resolve {parts.hostname}: {str(e)}"
+    if not addresses:
+        return None, f"Could not resolve {parts.hostname}"
+    if not all(is_public_address(address[4][0]) for address in addresses):
+        return None, f"{parts.hostname} resolves to a non-public address"
+    return addresses[0][4][0], None
+
+
+async def post_events(url: str, payloads: List[str]) -> Optional[str]:
+    """POST a batch to its endpoint; None on success, otherwise the error."""
+    address, error = await resolve_endpoint(url)
+    if error:
+        return error
+    body = '{"events": [' + ",".join(payloads) + "]}"
+    target = httpx.URL(url)
+    headers = {"Content-Type": "application/json"}
+    extensions = {}
+    if address:
+        # Connect to the checked address; Host and SNI keep the name, so
+        # virtual hosting and certificate checks still see it
+        headers["Host"] = target.netloc.decode("ascii")
+        if target.scheme == "https":
+            extensions["sni_hostname"] = target.host
+        target = target.copy_with(host=address.split("%", 1)[0])
+    try:
+        response = await get_client().post(
+            target, content=body, headers=headers, extensions=extensions
+        )
+    except httpx.HTTPError as e:
+        return f"{type(e).__name__}: {str(e)}"[:500]
+    if response.is_success:
+        return None
+    return f"HTTP {response.status_code}"
+
+
+async def deliver_batch(batch: List[dict]) -> None:
+    url = batch[0]["url"]
+    ids = [event["id"] for event in batch]
+    attempts = max(event["attempts"] for event in batch)
+
+    blocked_until = circuits.blocked_until(url)
+    if blocked_until is not None:
+        await retry_webhook_events(
+            ids, int(blocked_until * 1000), None, WEBHOOK_MAX_ATTEMPTS, count_attempt=False
+        )
+        return
+
+    error = await post_events(url, [event["payload"] for event in batch])
+    circuits.record(url, error is None)
+    if error is None:
+        await delete_webhook_events(ids)
+        return
+    logger.warning(f"Webhook delivery of {len(ids)} events to {url} failed: {error}")
+    next_attempt = time.time() + backoff_seconds(attempts)
+    await retry_webhook_events(ids, int(next_attempt * 1000), error, WEBHOOK_MAX_ATTEMPTS)
+
+
+async def run_webhook_worker():
+    while True:
+        webhook_wakeup.clear()
+        stale_before = int((time.time() - WEBHOOK_CLAIM_TIMEOUT_SECONDS) * 1000)
+        try:
+            batch = await claim_webhook_batch(WEBHOOK_BATCH_MAX, stale_before)
+        except Exception as e:
+            logger.error(f"Error claiming webhook events: {str(e)}")
+            batch = []
+        if not batch:
+            await wait_for_event(webhook_wakeup, WEBHOOK_POLL_SECONDS)
+            continue
+        try:
+            await deliver_batch(batch)
+        except Exception as e:
+            # The claim goes stale and the events are retried
+            logger.error(f"Error delivering webhooks to {batch[0]['url']}: {str(e)}")
@@ -0,0 +1,129 @@
+"""
+Optional single-writer mode for SQLite.
+
+With LNURLFLIP_SINGLE_WRITER=1 on an SQLite install, every mutation in
+crud.py is handed to one writer task instead of opening its own transaction.
+The writer takes whatever mutations are waiting (up to MAX_BATCH), runs them
+in one transaction and commits once, so a burst of settlements, comments and
+withdrawal writes costs one SQLite write lock and one commit per batch rather
+than one per statement. Reads never go through the writer.
+
+If a batch fails, it is rolled back and each mutation is retried in its own
+transaction, so one bad write only fails its own caller. On stop the writer
+commits what is already queued, for up to STOP_SECONDS, and fails whatever
+is left so no caller waits forever.
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from loguru import logger
+
+SINGLE_WRITER_ENV = "LNURLFLIP_SINGLE_WRITER"
+MAX_BATCH = 64
+STOP_SECONDS = 5
+
+Mutation = Callable[[Any], Awaitable[Any]]
+
+
+class SingleWriter:
+    """Serializes mutations through one task and commits them in batches."""
+
+    def __init__(self, transaction: Callable, max_batch: int = MAX_BATCH):
+        self._transaction = transaction
+        self.max_batch = max_batch
+        self.enabled = False
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batch: List[Tuple[Mutation, asyncio.Future]] = []
+        self.batches = 0
+        self.writes = 0
+
+    def configure(self, db_type: str) -> None:
+        """Enable the writer when requested by the environment and on SQLite."""
+        requested = os.getenv(SINGLE_WRITER_ENV, "").lower() in {"1", "true", "yes"}
+        if requested and db_type != "SQLITE":
+            logger.warning(f"{SINGLE_WRITER_ENV} is only used on SQLite, ignoring it")
+        self.enabled = requested and db_type == "SQLITE"
+
+    async def submit(self, mutation: Mutation) -> Any:
+        """Queue a mutation (an async callable taking the transaction) and await its result."""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((mutation, future))
+        return await future
+
+    async def stop(self, timeout: float = STOP_SECONDS) -> None:
+        """
+        Let the writer commit the mutations already queued, for up to
+        `timeout` seconds, then cancel it. Mutations it did not get to fail
+        with a RuntimeError.
+        """
+        task, queue = self._task, self._queue
+        if task is None or queue is None:
+            return
+        if not task.done():
+            drained = asyncio.ensure_future(queue.join())
+            await asyncio.wait({drained}, timeout=timeout)
+            drained.cancel()
+            task.cancel()
+            await asyncio.wait({task}, timeout=1)
+        # The batch cut off mid-transaction was rolled back
+        pending = [future for _, future in self._batch]
+        self._batch = []
+        while not queue.empty():
+            pending.append(queue.get_nowait()[1])
+            queue.task_done()
+        for future in pending:
+            _resolve(future, error=RuntimeError("Writer stopped before this write was committed"))
+        if pending:
+            logger.warning(f"Writer stopped with {len(pending)} writes uncommitted")
+
+    async def _run(self) -> None:
+        while True:
+            # Kept on the writer so stop can fail a batch cut off mid-way
+            batch = self._batch = [await self._queue.get()]
+            # Give submitters that are already runnable a chance to join
+            await asyncio.sleep(0)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._commit(batch)
+            self._batch = []
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _commit(self, batch: List[Tuple[Mutation, asyncio.Future]]) -> None:
+        try:
+            async with self._transaction() as tx:
+                results = [await mutation(tx) for mutation, _ in batch]
+        except Exception as e:
+            if len(batch) == 1:
+                _resolve(batch[0][1], error=e)
+                return
+            logger.debug(f"Write batch of {len(batch)} failed ({str(e)}), retrying one by one")
+            for mutation, future in batch:
+                try:
+                    async with self._transaction() as tx:
+                        result = await mutation(tx)
+                except Exception as single_error:
+                    _resolve(future, error=single_error)
+                else:
+                    _resolve(future, result)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for (_, future), result in zip(batch, results):
+            _resolve(future, result)
+
+
+def _resolve(future: asyncio.Future, result: Any = None, error: Optional[Exception] = None) -> None:
+    # The submitter may have been cancelled while its write was in flight
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)